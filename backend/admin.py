@@ -1,66 +1,104 @@
-from models import complaints_collection
-from complaints_db import get_complaints_by_ward, get_all_complaints
+from models import complaints_collection, ComplaintModel
+from rollups import get_rollup_stats
+from thumbnails import add_thumbnail_refs
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 
+STATUS_COUNTERS = ["pending", "acknowledged", "in_progress", "resolved"]
+
+def _count_if(condition: dict) -> dict:
+    return {"$sum": {"$cond": [condition, 1, 0]}}
+
+def build_stats_pipeline(ward_number: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Single-pass aggregation producing every dashboard counter server-side"""
+    match = {"ward_number": ward_number} if ward_number else {}
+    has_response_time = {"$and": [
+        {"$eq": ["$status", "resolved"]},
+        {"$gt": ["$response_time_hours", 0]}
+    ]}
+    group = {
+        "_id": None,
+        "total_complaints": {"$sum": 1},
+        "high_priority": _count_if({"$in": ["$priority", ["high", "urgent"]]}),
+        "response_time_sum": {"$sum": {"$cond": [has_response_time, "$response_time_hours", 0]}},
+        "response_time_count": _count_if(has_response_time),
+        "rated": _count_if({"$gt": ["$rating", 0]}),
+        "satisfied": _count_if({"$gte": ["$rating", 4]}),
+        "overdue": _count_if({"$eq": [{"$type": "$overdue_since"}, "date"]}),
+    }
+    for status in STATUS_COUNTERS:
+        group[status] = _count_if({"$eq": ["$status", status]})
+    return [{"$match": match}, {"$group": group}]
+
 def get_admin_dashboard_stats(ward_number: Optional[int] = None) -> Dict[str, Any]:
     """Get admin dashboard statistics"""
     try:
-        if ward_number:
-            all_complaints = get_complaints_by_ward(ward_number)
-        else:
-            all_complaints = get_all_complaints()
+        # Incrementally maintained counters make this a single document read
+        stats = get_rollup_stats(ward_number)
+        if stats is not None:
+            return stats
+        rows = list(complaints_collection.aggregate(build_stats_pipeline(ward_number)))
     except Exception as e:
         error_msg = str(e)
         if "ServerSelectionTimeoutError" in error_msg or "connection" in error_msg.lower():
             print(f"Warning: MongoDB connection failed: {error_msg}")
-            all_complaints = []
+            rows = []
         else:
             raise
+    counts = rows[0] if rows else {}
     
     stats = {
-        "total_complaints": len(all_complaints),
-        "pending": len([c for c in all_complaints if c.get("status") == "pending"]),
-        "acknowledged": len([c for c in all_complaints if c.get("status") == "acknowledged"]),
-        "in_progress": len([c for c in all_complaints if c.get("status") == "in_progress"]),
-        "resolved": len([c for c in all_complaints if c.get("status") == "resolved"]),
-        "high_priority": len([c for c in all_complaints if c.get("priority") in ["high", "urgent"]]),
+        "total_complaints": counts.get("total_complaints", 0),
+        "pending": counts.get("pending", 0),
+        "acknowledged": counts.get("acknowledged", 0),
+        "in_progress": counts.get("in_progress", 0),
+        "resolved": counts.get("resolved", 0),
+        "high_priority": counts.get("high_priority", 0),
         "avg_response_time": None,
         "satisfaction_rate": None,
+        "overdue": counts.get("overdue", 0),
     }
     
     # Calculate average response time
-    resolved_complaints = [c for c in all_complaints if c.get("status") == "resolved" and c.get("response_time_hours")]
-    if resolved_complaints:
-        avg_time = sum(c.get("response_time_hours", 0) for c in resolved_complaints) / len(resolved_complaints)
-        stats["avg_response_time"] = round(avg_time, 2)
+    if counts.get("response_time_count"):
+        stats["avg_response_time"] = round(counts["response_time_sum"] / counts["response_time_count"], 2)
     
     # Calculate satisfaction rate (ratings >= 4)
-    rated_complaints = [c for c in all_complaints if c.get("rating")]
-    if rated_complaints:
-        satisfied = len([c for c in rated_complaints if c.get("rating", 0) >= 4])
-        stats["satisfaction_rate"] = round((satisfied / len(rated_complaints)) * 100, 1)
+    if counts.get("rated"):
+        stats["satisfaction_rate"] = round((counts["satisfied"] / counts["rated"]) * 100, 1)
     
     return stats
 
+# Fields the dashboard list renders; attachments and timeline are left out
+RECENT_COMPLAINT_PROJECTION = {
+    "complaint_id": 1, "title": 1, "description": 1, "category": 1, "ward_number": 1,
+    "status": 1, "priority": 1, "created_by": 1, "assigned_officer_id": 1, "location": 1,
+    "created_at": 1, "updated_at": 1
+}
+
 def get_recent_complaints(ward_number: Optional[int] = None, limit: int = 10) -> List[Dict[str, Any]]:
     """Get recent complaints for admin dashboard"""
-    if ward_number:
-        complaints = get_complaints_by_ward(ward_number)
-    else:
-        complaints = get_all_complaints()
-    
-    # Sort by created_at descending and limit
-    sorted_complaints = sorted(complaints, key=lambda x: x.get("created_at", datetime.min) if isinstance(x.get("created_at"), datetime) else datetime.min, reverse=True)
+    query = {"ward_number": ward_number} if ward_number else {}
+    try:
+        # Served by the (ward_number, created_at) index; only `limit` documents are read
+        cursor = complaints_collection.aggregate(
+            ComplaintModel.summary_pipeline(query, RECENT_COMPLAINT_PROJECTION, limit)
+        )
+        complaints = list(cursor)
+    except Exception as e:
+        error_msg = str(e)
+        if "ServerSelectionTimeoutError" in error_msg or "connection" in error_msg.lower():
+            print(f"Warning: MongoDB connection failed: {error_msg}")
+            return []
+        raise
     
     # Convert datetime to ISO string for response
-    result = []
-    for complaint in sorted_complaints[:limit]:
-        complaint_dict = dict(complaint) if not isinstance(complaint, dict) else complaint
-        if "created_at" in complaint_dict and isinstance(complaint_dict["created_at"], datetime):
-            complaint_dict["created_at"] = complaint_dict["created_at"].isoformat()
-        if "updated_at" in complaint_dict and isinstance(complaint_dict["updated_at"], datetime):
-            complaint_dict["updated_at"] = complaint_dict["updated_at"].isoformat()
-        result.append(complaint_dict)
+    for complaint in complaints:
+        complaint["_id"] = str(complaint["_id"])
+        if "created_at" in complaint and isinstance(complaint["created_at"], datetime):
+            complaint["created_at"] = complaint["created_at"].isoformat()
+        if "updated_at" in complaint and isinstance(complaint["updated_at"], datetime):
+            complaint["updated_at"] = complaint["updated_at"].isoformat()
+        add_thumbnail_refs(complaint)
     
-    return result
+    return complaints
@@ -0,0 +1,53 @@
+"""Benchmark the in-memory crowdsource report store.
+
+    python bench_crowdsource.py --reports 200000 --threads 8
+
+Reports are spread over Delhi within the retention window; queries ask for a
+viewport of a few neighbourhoods over the last 30 minutes.
+"""
+import argparse
+import random
+import threading
+import time
+
+from crowdsource import CrowdReportStore
+
+SOUTH, WEST, NORTH, EAST = 28.40, 76.85, 28.88, 77.35
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--reports", type=int, default=200000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    store = CrowdReportStore(snapshot_path=None)
+    now = time.time()
+    per_thread = args.reports // args.threads
+
+    def ingest(seed: int):
+        rng = random.Random(seed)
+        for _ in range(per_thread):
+            store.add(rng.uniform(SOUTH, NORTH), rng.uniform(WEST, EAST), rng.uniform(0, 90),
+                      timestamp=now - rng.uniform(0, store.ttl - 60))
+
+    threads = [threading.Thread(target=ingest, args=(i,)) for i in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(f"ingest: {len(store)} reports in {elapsed:.2f}s ({len(store) / elapsed:,.0f} reports/s)")
+
+    rng = random.Random(0)
+    start = time.perf_counter()
+    found = 0
+    for _ in range(args.queries):
+        lat, lng = rng.uniform(SOUTH, NORTH - 0.05), rng.uniform(WEST, EAST - 0.05)
+        found += len(store.query(lat, lng, lat + 0.05, lng + 0.05, minutes=30))
+    elapsed = time.perf_counter() - start
+    print(f"query:  {elapsed / args.queries * 1000:.2f} ms per viewport ({found / args.queries:.0f} reports each)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Benchmark the FCM client against a local fake FCM endpoint.
+
+    python bench_fcm.py --messages 5000 --in-flight 64 --latency-ms 20
+
+Tokens starting with "bad" are answered with UNREGISTERED so pruning is exercised.
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from fcm import FCMClient
+
+class FakeCredentials:
+    """Stands in for service account credentials; counts OAuth refreshes"""
+
+    def __init__(self, lifetime_seconds: int = 3600):
+        self.lifetime_seconds = lifetime_seconds
+        self.token = None
+        self.expiry = None
+        self.refreshes = 0
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.token = f"fake-token-{self.refreshes}"
+        self.expiry = datetime.utcnow() + timedelta(seconds=self.lifetime_seconds)
+
+class FakeFCMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency_seconds = 0.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        if body["message"]["token"].startswith("bad"):
+            status = 404
+            response = {"error": {"code": 404, "status": "NOT_FOUND",
+                                  "details": [{"errorCode": "UNREGISTERED"}]}}
+        else:
+            status = 200
+            response = {"name": "projects/bench/messages/1"}
+        data = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_fake_fcm(latency_ms: float = 0.0, port: int = 0) -> ThreadingHTTPServer:
+    FakeFCMHandler.latency_seconds = latency_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeFCMHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def send_naive(endpoint: str, tokens):
+    """The previous transport: sequential sends, each on a fresh connection"""
+    for token in tokens:
+        requests.post(
+            f"{endpoint}/v1/projects/bench/messages:send",
+            headers={"Authorization": "Bearer fake", "Content-Type": "application/json"},
+            json={"message": {"token": token, "notification": {"title": "t", "body": "b"}, "data": {}}},
+            timeout=10
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--in-flight", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=10.0)
+    parser.add_argument("--invalid-ratio", type=float, default=0.01)
+    parser.add_argument("--naive-messages", type=int, default=200)
+    args = parser.parse_args()
+
+    server = start_fake_fcm(args.latency_ms)
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+    invalid_every = int(1 / args.invalid_ratio) if args.invalid_ratio else 0
+    tokens = [
+        f"bad-{i}" if invalid_every and i % invalid_every == 0 else f"token-{i}"
+        for i in range(args.messages)
+    ]
+
+    start = time.perf_counter()
+    send_naive(endpoint, tokens[:args.naive_messages])
+    naive_rate = args.naive_messages / (time.perf_counter() - start)
+    print(f"naive sequential:  {naive_rate:10.1f} msg/s ({args.naive_messages} messages)")
+
+    pruned = []
+    credentials = FakeCredentials()
+    client = FCMClient("bench", credentials, endpoint=endpoint, max_in_flight=args.in_flight,
+                       on_invalid_tokens=pruned.extend)
+    start = time.perf_counter()
+    results = client.send_many(tokens, "Flood alert", "Benchmark message")
+    rate = args.messages / (time.perf_counter() - start)
+    print(f"FCMClient x{args.in_flight}:  {rate:10.1f} msg/s ({args.messages} messages)")
+    print(f"results={results} pruned={len(pruned)} oauth_refreshes={credentials.refreshes}")
+
+    client.close()
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark fan-out of the in-process event broker to many SSE subscribers.
+
+    python bench_stream.py --subscribers 5000 --events 200 --interval-ms 2
+
+Subscribers are consumed by asyncio tasks reading broker.stream(), as the SSE
+endpoint does; a tenth of them read slowly to show that their bounded queues
+drop old events (and get a resync) instead of slowing everyone else down.
+Events are published from a separate thread, like the rainfall feed and the
+outbox dispatcher do.
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from pubsub import Broker
+
+async def consume(broker: Broker, subscription, received: list, index: int, slow: bool, done: asyncio.Event):
+    async for chunk in broker.stream(subscription, heartbeat=60):
+        received[index] += chunk.count("event: tick")
+        if slow:
+            await asyncio.sleep(0.05)
+        if done.is_set():
+            break
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--subscribers", type=int, default=5000)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--interval-ms", type=float, default=2.0, help="pause between published events")
+    args = parser.parse_args()
+
+    broker = Broker(queue_size=args.queue_size, max_subscribers=args.subscribers)
+    broker.bind(asyncio.get_running_loop())
+    received = [0] * args.subscribers
+    done = asyncio.Event()
+    tasks, subscriptions = [], []
+    for index in range(args.subscribers):
+        subscription = broker.subscribe(["risk"])
+        subscriptions.append(subscription)
+        slow = index % 10 == 0
+        tasks.append(asyncio.create_task(consume(broker, subscription, received, index, slow, done)))
+    await asyncio.sleep(0.1)
+
+    def publisher():
+        for number in range(args.events):
+            broker.publish("risk", "tick", {"n": number})
+            time.sleep(args.interval_ms / 1000)
+
+    start = time.perf_counter()
+    thread = threading.Thread(target=publisher)
+    thread.start()
+    while thread.is_alive():
+        await asyncio.sleep(0.01)
+    published = time.perf_counter() - start
+    # Let every fast reader drain what is still queued for it
+    while any(subscription.frames for index, subscription in enumerate(subscriptions) if index % 10):
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    fast = [index for index in range(args.subscribers) if index % 10]
+    slow = [index for index in range(args.subscribers) if index % 10 == 0]
+    deliveries = sum(received[index] for index in fast)
+    print(f"Published {args.events} events in {published:.2f}s ({args.events / published:,.0f} events/s)")
+    print(f"{len(fast)} fast subscribers: {deliveries:,} deliveries in {elapsed:.2f}s "
+          f"({deliveries / elapsed:,.0f}/s), {sum(subscriptions[index].dropped for index in fast):,} dropped")
+    print(f"{len(slow)} slow subscribers: {min(received[index] for index in slow)}-"
+          f"{max(received[index] for index in slow)} events each, "
+          f"{sum(subscriptions[index].dropped for index in slow):,} dropped and resynced")
+
+    done.set()
+    broker.publish("risk", "tick", {"n": -1})
+    await asyncio.wait(tasks, timeout=5)
+    for task in tasks:
+        task.cancel()
+
+if __name__ == "__main__":
+    asyncio.run(main())
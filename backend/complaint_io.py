@@ -0,0 +1,288 @@
+"""Streaming export and batched import of complaints.
+
+Exports read from a cursor and emit NDJSON or CSV as they go. Imports parse
+JSON arrays (like complaints_db.json) or NDJSON one document at a time and load
+them with batched insert_many, replacing complaints that already exist.
+
+    python complaint_io.py export complaints.ndjson --format ndjson --ward 44
+    python complaint_io.py import complaints_db.json
+"""
+from models import complaints_collection, ComplaintModel, TimelineModel
+from pymongo import ReplaceOne, ASCENDING
+from pymongo.errors import BulkWriteError
+from typing import List, Dict, Any, Optional, Iterator, IO
+from datetime import datetime
+import argparse
+import csv
+import io
+import json
+import os
+
+# Export/import settings
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", str(64 * 1024)))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_READ_BYTES = 64 * 1024
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+CSV_COLUMNS = [
+    "complaint_id", "title", "description", "category", "ward_number", "status", "priority",
+    "created_by", "assigned_officer_id", "latitude", "longitude", "response_time_hours",
+    "resolution", "rating", "feedback", "due_at", "overdue_since", "escalation_level",
+    "created_at", "updated_at"
+]
+DATE_FIELDS = ["created_at", "updated_at", "due_at", "overdue_since"]
+DUPLICATE_KEY_ERROR = 11000
+
+def build_export_query(
+    ward_number: Optional[int] = None,
+    status: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+) -> Dict[str, Any]:
+    query = {}
+    if ward_number:
+        query["ward_number"] = ward_number
+    if status:
+        query["status"] = status
+    if since or until:
+        query["created_at"] = {}
+        if since:
+            query["created_at"]["$gte"] = since
+        if until:
+            query["created_at"]["$lt"] = until
+    return query
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def _csv_row(complaint: Dict[str, Any]) -> List[Any]:
+    location = complaint.get("location") or {}
+    row = []
+    for column in CSV_COLUMNS:
+        if column in ("latitude", "longitude"):
+            value = location.get(column)
+        else:
+            value = complaint.get(column)
+        row.append(value.isoformat() if isinstance(value, datetime) else value)
+    return row
+
+def _batches(cursor, size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _archived_timelines(complaints: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Complete timelines of a batch's archived complaints, read with one bucket query"""
+    complaint_ids = [c["complaint_id"] for c in complaints if c.get("timeline_archived")]
+    timelines: Dict[str, List[Dict[str, Any]]] = {}
+    if complaint_ids:
+        buckets = TimelineModel.iter_buckets(complaint_ids=complaint_ids, projection={"complaint_id": 1, "entries": 1})
+        for bucket in buckets:
+            timelines.setdefault(bucket["complaint_id"], []).extend(bucket.get("entries") or [])
+    return timelines
+
+def iter_export(query: Dict[str, Any], format: str = "ndjson", include_attachments: bool = False) -> Iterator[str]:
+    """Yield the export in chunks of about EXPORT_CHUNK_BYTES, holding one cursor batch in memory"""
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {list(EXPORT_FORMATS)}")
+    projection = {"_id": 0}
+    if not include_attachments or format == "csv":
+        projection["attachments"] = 0
+    if format == "csv":
+        projection["timeline"] = 0
+    cursor = complaints_collection.find(query, projection).sort("created_at", ASCENDING).batch_size(EXPORT_BATCH_SIZE)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if format == "csv" else None
+    if writer:
+        writer.writerow(CSV_COLUMNS)
+    try:
+        for batch in _batches(cursor, EXPORT_BATCH_SIZE):
+            timelines = {} if writer else _archived_timelines(batch)
+            for complaint in batch:
+                if writer:
+                    writer.writerow(_csv_row(complaint))
+                else:
+                    if complaint.pop("timeline_archived", None):
+                        # Export the complete history, not just the entries kept embedded
+                        complaint["timeline"] = timelines.get(complaint["complaint_id"], [])
+                    buffer.write(json.dumps(complaint, default=_json_default))
+                    buffer.write("\n")
+                if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+    finally:
+        cursor.close()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def iter_json_documents(file: IO[str]) -> Iterator[Dict[str, Any]]:
+    """Parse a JSON array or NDJSON file one document at a time"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    in_array = None
+    read_size = IMPORT_READ_BYTES
+
+    def fill() -> bool:
+        nonlocal buffer, position, eof, read_size
+        data = file.read(read_size)
+        if not data:
+            eof = True
+            return False
+        buffer = buffer[position:] + data
+        position = 0
+        return True
+
+    while True:
+        # Skip whitespace and the separators between array elements
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) or not fill():
+                break
+        if position >= len(buffer):
+            if in_array:
+                raise ValueError("Unexpected end of file inside a JSON array")
+            return
+        if in_array is None:
+            in_array = buffer[position] == "["
+            if in_array:
+                position += 1
+                continue
+        if in_array and buffer[position] == "]":
+            return
+        try:
+            document, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # Most likely the document continues past the buffer; read more and try again
+            if eof or not fill():
+                raise
+            # Large documents (base64 attachments) would otherwise be re-parsed many times
+            read_size *= 2
+            continue
+        position = end
+        read_size = IMPORT_READ_BYTES
+        yield document
+
+def _parse_datetime(value):
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    return value
+
+def prepare_document(document: Dict[str, Any]) -> Dict[str, Any]:
+    """Restore the datetimes a JSON export turned into strings"""
+    document.pop("_id", None)
+    # Exports carry the complete timeline; it is archived again by `python timeline.py migrate`
+    document.pop("timeline_archived", None)
+    for field in DATE_FIELDS:
+        if field in document:
+            document[field] = _parse_datetime(document[field])
+    for entry in document.get("timeline") or []:
+        if "timestamp" in entry:
+            entry["timestamp"] = _parse_datetime(entry["timestamp"])
+    return document
+
+def load_batch(documents: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Insert a batch, replacing the complaints whose complaint_id already exists"""
+    try:
+        result = complaints_collection.insert_many(documents, ordered=False)
+        return {"inserted": len(result.inserted_ids), "replaced": 0}
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        duplicates = [error["index"] for error in errors if error.get("code") == DUPLICATE_KEY_ERROR]
+        if len(duplicates) != len(errors):
+            raise
+        # insert_many gave every document a new _id, which must not replace the stored one
+        replaced = complaints_collection.bulk_write([
+            ReplaceOne(
+                {"complaint_id": documents[index]["complaint_id"]},
+                {key: value for key, value in documents[index].items() if key != "_id"},
+                upsert=True
+            )
+            for index in duplicates
+        ], ordered=False)
+        return {"inserted": e.details.get("nInserted", 0), "replaced": replaced.matched_count + replaced.upserted_count}
+
+def import_file(path: str, batch_size: int = IMPORT_BATCH_SIZE) -> Dict[str, int]:
+    """Stream complaints from a JSON or NDJSON file into MongoDB"""
+    # Existing complaints are only detected through the unique complaint_id index
+    ComplaintModel.ensure_indexes()
+    totals = {"inserted": 0, "replaced": 0, "skipped": 0}
+    batch = []
+    with open(path, encoding="utf-8") as file:
+        for document in iter_json_documents(file):
+            if not isinstance(document, dict) or not document.get("complaint_id"):
+                totals["skipped"] += 1
+                continue
+            batch.append(prepare_document(document))
+            if len(batch) >= batch_size:
+                for key, value in load_batch(batch).items():
+                    totals[key] += value
+                batch = []
+                print(f"[Import] {totals['inserted']} inserted, {totals['replaced']} replaced")
+    if batch:
+        for key, value in load_batch(batch).items():
+            totals[key] += value
+    return totals
+
+def export_file(path: str, format: str, query: Dict[str, Any], include_attachments: bool = False) -> int:
+    written = 0
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        for chunk in iter_export(query, format, include_attachments):
+            written += file.write(chunk)
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="ndjson")
+    export_parser.add_argument("--ward", type=int)
+    export_parser.add_argument("--status")
+    export_parser.add_argument("--since", type=datetime.fromisoformat)
+    export_parser.add_argument("--until", type=datetime.fromisoformat)
+    export_parser.add_argument("--include-attachments", action="store_true")
+
+    import_parser = commands.add_parser("import")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    import_parser.add_argument("--skip-rebuild", action="store_true", help="Do not rebuild timelines, map points, rollups and SLA deadlines")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        query = build_export_query(args.ward, args.status, args.since, args.until)
+        written = export_file(args.path, args.format, query, args.include_attachments)
+        print(f"[Export] Wrote {written} characters to {args.path}")
+    else:
+        totals = import_file(args.path, args.batch_size)
+        print(f"[Import] Done: {totals}")
+        if not args.skip_rebuild:
+            # Imported complaints bypass the incremental counters and deadlines
+            from rollups import rebuild
+            from sla import backfill
+            from timeline import migrate
+            import geo
+            migrate()
+            geo.backfill()
+            rebuild()
+            geo.rebuild()
+            backfill()
+
+if __name__ == "__main__":
+    main()
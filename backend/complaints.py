@@ -16,8 +16,8 @@ class ComplaintPriority(str, Enum):
     URGENT = "urgent"
 
 class LocationData(BaseModel):
-    latitude: float
-    longitude: float
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
 
 class ComplaintCreate(BaseModel):
     title: str = Field(..., min_length=5, max_length=200)
@@ -35,4 +35,21 @@ class ComplaintUpdate(BaseModel):
 
 class ComplaintRating(BaseModel):
     rating: int = Field(..., ge=1, le=5)
-    feedback: Optional[str] = None
\ No newline at end of file
+    feedback: Optional[str] = None
+
+
+class BulkAction(str, Enum):
+    ASSIGN = "assign"
+    STATUS = "status"
+    RESOLVE = "resolve"
+
+class ComplaintBulkOperation(BaseModel):
+    complaint_id: str
+    action: BulkAction
+    status: Optional[ComplaintStatus] = None
+    remarks: Optional[str] = None
+    officer_id: Optional[str] = None
+    resolution: Optional[str] = None
+
+class ComplaintBulkRequest(BaseModel):
+    operations: List[ComplaintBulkOperation]
@@ -2,14 +2,26 @@
 from fastapi import HTTPException
 from complaints import (
     ComplaintStatus, ComplaintPriority, ComplaintCreate, 
-    ComplaintUpdate, ComplaintRating
+    ComplaintUpdate, ComplaintRating, BulkAction, ComplaintBulkOperation
 )
-from models import ComplaintModel
-from notifications import create_notification_for_ward_admin, create_complaint_status_notification
-from typing import Optional, List, Dict, Any
+from models import ComplaintModel, TimelineModel, run_transaction, store, TIMELINE_EMBEDDED_ENTRIES
+from local_store import OP_INSERT
+from outbox import enqueue, enqueue_many
+from rollups import record_filed, record_transition, record_transitions
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import ConnectionFailure
+from thumbnails import schedule_thumbnails, add_thumbnail_refs
+from dedup import index as duplicate_index, signature, DEDUP_ENABLED
+from geo import geo_point
+from sla import compute_due_at, due_at_expression, next_escalation_at, tracker as sla_tracker, SLA_MAX_ESCALATIONS, CLOSED_STATUSES
+from typing import Optional, List, Dict, Any, Tuple
 from datetime import datetime
+import os
 import uuid
 
+# Largest number of operations accepted by one bulk request
+BULK_MAX_OPERATIONS = int(os.getenv("BULK_MAX_OPERATIONS", "500"))
+
 def file_complaint(complaint_data: ComplaintCreate, user_id: str) -> dict:
     """File a new complaint"""
     complaint_id = f"COMP-{uuid.uuid4().hex[:8].upper()}"
@@ -48,45 +60,136 @@ def file_complaint(complaint_data: ComplaintCreate, user_id: str) -> dict:
         "resolution": None,
         "rating": None,
         "feedback": None,
+        "timeline_archived": True,
+        "due_at": compute_due_at(complaint_data.priority.value, ComplaintStatus.PENDING.value, now),
+        "escalation_level": 0,
         "created_at": now,  # Keep as datetime for MongoDB
         "updated_at": now   # Keep as datetime for MongoDB
     }
     
-    # Save to MongoDB (this adds the datetime objects)
-    ComplaintModel.create(complaint)
+    point = geo_point(location_dict)
+    if point:
+        complaint["geo"] = point
     
-    # Auto-assign to ward officer
-    auto_assign_complaint(complaint_id, complaint_data.ward_number)
+    # A repeat of a recent complaint nearby is linked to it instead of alerting the ward admin again
+    complaint_signature = signature(complaint)
+    parent = duplicate_index.find_parent(complaint, complaint_signature) if DEDUP_ENABLED else None
+    due_at = complaint.pop("due_at")
+    
+    # Save to MongoDB together with the ward admin notification event
+    def write(session):
+        complaint.pop("duplicate_of", None)
+        complaint.pop("due_at", None)
+        if parent and ComplaintModel.link_duplicate(parent[0], now, CLOSED_STATUSES, session=session):
+            # The parent's deadline covers the work, so duplicates do not escalate on their own
+            complaint["duplicate_of"] = parent[0]
+            complaint["duplicate_score"] = round(parent[1], 3)
+        else:
+            complaint.pop("duplicate_score", None)
+            complaint["due_at"] = due_at
+        complaint["_id"] = ComplaintModel.create(complaint, session=session)
+        TimelineModel.append(complaint_id, complaint["timeline"], session=session)
+        record_filed(complaint, session=session)
+        if "duplicate_of" not in complaint:
+            enqueue("new_complaint", _new_complaint_event(complaint), session=session)
     
-    # Create notification for ward admin
-    create_notification_for_ward_admin(complaint_data.ward_number, complaint_id, complaint_data.title)
+    saved = False
+    if store.available():
+        try:
+            run_transaction(write)
+            saved = True
+        except ConnectionFailure as e:
+            store.mark_down(e)
+    if not saved:
+        # Counted and announced to the ward admin when the local store replays it
+        complaint.pop("duplicate_of", None)
+        complaint.pop("duplicate_score", None)
+        complaint["due_at"] = due_at
+        complaint["_id"] = ComplaintModel.create_local(complaint)
+    if "duplicate_of" in complaint:
+        print(f"[Dedup] Complaint {complaint_id} linked to {complaint['duplicate_of']} (similarity {complaint['duplicate_score']})")
+    else:
+        duplicate_index.add(complaint, complaint_signature)
+        sla_tracker.track(complaint_id, complaint["due_at"])
     
-    # NOW get the complaint back and convert datetimes for response
-    saved_complaint = get_complaint_by_id(complaint_id)
+    # Generate attachment thumbnails in the background
+    schedule_thumbnails(complaint_id, complaint["attachments"])
     
-    return saved_complaint  # This already has ISO formatted dates
+    # Auto-assign to ward officer
+    auto_assign_complaint(complaint_id, complaint_data.ward_number)
+    
+    # Build the response from the inserted document instead of reading it back
+    return serialize_complaint(complaint)
+
+def _new_complaint_event(complaint: dict) -> dict:
+    return {
+        "ward_number": complaint["ward_number"],
+        "complaint_id": complaint["complaint_id"],
+        "complaint_title": complaint["title"]
+    }
+
+def _complaints_replayed(complaints: List[dict]):
+    """Complaints filed while MongoDB was down reach the rollups and ward admins once replayed"""
+    TimelineModel.append_many([
+        (complaint["complaint_id"], entry) for complaint in complaints for entry in complaint.get("timeline") or []
+    ])
+    for complaint in complaints:
+        record_filed(complaint)
+    enqueue_many("new_complaint", [_new_complaint_event(complaint) for complaint in complaints])
+
+store.register_replay_hook("complaints", OP_INSERT, _complaints_replayed)
 
 def auto_assign_complaint(complaint_id: str, ward_number: int):
     """Auto-assign complaint to ward admin (placeholder)"""
     # In future, assign to specific ward officer
     pass
 
+def serialize_complaint(complaint: dict) -> dict:
+    """Convert complaint datetimes to ISO strings for responses"""
+    if "created_at" in complaint and isinstance(complaint["created_at"], datetime):
+        complaint["created_at"] = complaint["created_at"].isoformat()
+    if "updated_at" in complaint and isinstance(complaint["updated_at"], datetime):
+        complaint["updated_at"] = complaint["updated_at"].isoformat()
+    for key in ("due_at", "overdue_since"):
+        if isinstance(complaint.get(key), datetime):
+            complaint[key] = complaint[key].isoformat()
+    # Convert timeline datetimes
+    if "timeline" in complaint:
+        for entry in complaint["timeline"]:
+            if "timestamp" in entry and isinstance(entry["timestamp"], datetime):
+                entry["timestamp"] = entry["timestamp"].isoformat()
+    add_thumbnail_refs(complaint)
+    return complaint
+
 def get_complaint_by_id(complaint_id: str) -> Optional[dict]:
     """Get complaint by ID"""
     complaint = ComplaintModel.find_by_id(complaint_id)
     if complaint:
-        # Convert datetime to ISO
-        if "created_at" in complaint and isinstance(complaint["created_at"], datetime):
-            complaint["created_at"] = complaint["created_at"].isoformat()
-        if "updated_at" in complaint and isinstance(complaint["updated_at"], datetime):
-            complaint["updated_at"] = complaint["updated_at"].isoformat()
-        # Convert timeline datetimes
-        if "timeline" in complaint:
-            for entry in complaint["timeline"]:
-                if "timestamp" in entry and isinstance(entry["timestamp"], datetime):
-                    entry["timestamp"] = entry["timestamp"].isoformat()
+        serialize_complaint(complaint)
     return complaint
 
+def get_complaint_timeline(complaint_id: str, before: Optional[str] = None, limit: int = 20) -> Optional[dict]:
+    """One page of a complaint's timeline, newest first"""
+    complaint = ComplaintModel.find_by_id(complaint_id)
+    if not complaint:
+        return None
+    if complaint.get("timeline_archived"):
+        entries, next_cursor = TimelineModel.find_page(complaint_id, before, limit)
+    else:
+        # Not migrated yet: the whole timeline is embedded, and the cursor is an offset into it
+        timeline = complaint.get("timeline") or []
+        try:
+            end = int(before) if before else len(timeline)
+        except ValueError:
+            raise ValueError("Invalid timeline cursor")
+        start = max(end - limit, 0)
+        entries = list(reversed(timeline[start:end]))
+        next_cursor = str(start) if start > 0 else None
+    for entry in entries:
+        if isinstance(entry.get("timestamp"), datetime):
+            entry["timestamp"] = entry["timestamp"].isoformat()
+    return {"complaint_id": complaint_id, "entries": entries, "next_cursor": next_cursor}
+
 def get_complaints_by_user(user_id: str) -> List[dict]:
     """Get all complaints by a user"""
     try:
@@ -97,6 +200,7 @@ def get_complaints_by_user(user_id: str) -> List[dict]:
                 complaint["created_at"] = complaint["created_at"].isoformat()
             if "updated_at" in complaint and isinstance(complaint["updated_at"], datetime):
                 complaint["updated_at"] = complaint["updated_at"].isoformat()
+            add_thumbnail_refs(complaint)
         return complaints
     except Exception as e:
         error_msg = str(e)
@@ -115,6 +219,7 @@ def get_complaints_by_ward(ward_number: int) -> List[dict]:
                 complaint["created_at"] = complaint["created_at"].isoformat()
             if "updated_at" in complaint and isinstance(complaint["updated_at"], datetime):
                 complaint["updated_at"] = complaint["updated_at"].isoformat()
+            add_thumbnail_refs(complaint)
         return complaints
     except Exception as e:
         error_msg = str(e)
@@ -139,6 +244,7 @@ def get_all_complaints(ward_number: Optional[int] = None, status: Optional[str]
                 complaint["created_at"] = complaint["created_at"].isoformat()
             if "updated_at" in complaint and isinstance(complaint["updated_at"], datetime):
                 complaint["updated_at"] = complaint["updated_at"].isoformat()
+            add_thumbnail_refs(complaint)
         return complaints
     except Exception as e:
         error_msg = str(e)
@@ -147,105 +253,512 @@ def get_all_complaints(ward_number: Optional[int] = None, status: Optional[str]
             return []
         raise
 
+def _append_timeline(entry: dict) -> dict:
+    """Update-pipeline expression appending an entry to the stored timeline"""
+    return TimelineModel.append_expression(entry)
+
+def _response_time_hours(created_at, resolved_at: datetime) -> float:
+    """Hours from filing to resolution, matching the value MongoDB stores"""
+    if isinstance(created_at, str):
+        try:
+            created_at = datetime.fromisoformat(created_at)
+        except ValueError:
+            created_at = None
+    if not isinstance(created_at, datetime):
+        created_at = resolved_at
+    # MongoDB dates have millisecond precision
+    created_at = created_at.replace(microsecond=created_at.microsecond // 1000 * 1000)
+    resolved_at = resolved_at.replace(microsecond=resolved_at.microsecond // 1000 * 1000)
+    return round((resolved_at - created_at).total_seconds() / 3600, 2)
+
+def _archive_timeline(previous: dict, entries: List[dict], session=None):
+    """Copy new entries to the timeline buckets of complaints whose history lives there"""
+    if previous.get("timeline_archived"):
+        TimelineModel.append(previous["complaint_id"], entries, session=session)
+
+def _enqueue_status_notification(complaint: dict, status: str, session=None):
+    """Queue the owner's status-change notification in the same write as the complaint"""
+    enqueue("complaint_status", {
+        "complaint_id": complaint["complaint_id"],
+        "complaint_title": complaint["title"],
+        "status": status,
+        "user_id": complaint["created_by"]
+    }, session=session)
+
+def _follow_parents(changes: List[Tuple[dict, dict]], updated_by: str, now: datetime, session=None) -> List[dict]:
+    """Carry parents' status and resolution over to the complaints linked as their duplicates.
+    
+    Duplicates have no deadline of their own, so their owners only hear about progress through
+    this. Returns the updated duplicates.
+    """
+    parents = {
+        complaint["complaint_id"]: complaint for previous, complaint in changes
+        if complaint.get("status") != previous.get("status") or complaint.get("resolution") != previous.get("resolution")
+    }
+    if not parents:
+        return []
+    writes = []
+    applied_changes = []
+    archived_entries = []
+    notifications = []
+    for child in ComplaintModel.find_duplicates(list(parents), session=session):
+        parent = parents[child["duplicate_of"]]
+        set_fields = {"status": parent["status"], "updated_at": now}
+        if parent["status"] == ComplaintStatus.RESOLVED.value:
+            set_fields["resolution"] = parent.get("resolution")
+            set_fields["response_time_hours"] = _response_time_hours(child.get("created_at"), now)
+        timeline_entry = {
+            "timestamp": now,
+            "status": parent["status"],
+            "remarks": f"Updated together with {parent['complaint_id']}, which this complaint duplicates",
+            "updated_by": updated_by
+        }
+        push = {"$each": [timeline_entry]}
+        if child.get("timeline_archived"):
+            push["$slice"] = -TIMELINE_EMBEDDED_ENTRIES
+            archived_entries.append((child["complaint_id"], timeline_entry))
+        writes.append(UpdateOne(
+            {"complaint_id": child["complaint_id"], "duplicate_of": parent["complaint_id"]},
+            {"$set": set_fields, "$push": {"timeline": push}}
+        ))
+        applied_changes.append((child, {**child, **set_fields}))
+        notifications.append({
+            "complaint_id": child["complaint_id"],
+            "complaint_title": child.get("title", ""),
+            "status": parent["status"],
+            "user_id": child.get("created_by")
+        })
+    if not writes:
+        return []
+    ComplaintModel.bulk_write(writes, session=session)
+    TimelineModel.append_many(archived_entries, session=session)
+    record_transitions(applied_changes, session=session)
+    enqueue_many("complaint_status", notifications, session=session)
+    return [complaint for _, complaint in applied_changes]
+
 def update_complaint_status(complaint_id: str, status: ComplaintStatus, remarks: str, updated_by: str) -> dict:
     """Update complaint status"""
-    complaint = get_complaint_by_id(complaint_id)
-    if not complaint:
-        from fastapi import HTTPException
-        raise HTTPException(status_code=404, detail="Complaint not found")
-    
-    ComplaintModel.update(complaint_id, {"status": status.value})
-    ComplaintModel.add_timeline_entry(complaint_id, {
+    now = datetime.now()
+    timeline_entry = {
+        "timestamp": now,
         "status": status.value,
         "remarks": remarks,
         "updated_by": updated_by
-    })
+    }
+    # Entering a new status restarts the SLA clock; the deadline depends on the stored priority
+    update = [
+        {"$set": {
+            "status": status.value,
+            "timeline": _append_timeline({key: {"$literal": value} for key, value in timeline_entry.items()}),
+            "due_at": due_at_expression(status.value, now),
+            "escalation_level": 0,
+            "updated_at": now
+        }},
+        {"$unset": ["overdue_since"]}
+    ]
     
-    # Send notification to complaint owner
-    create_complaint_status_notification(
-        complaint_id,
-        complaint["title"],
-        status.value,
-        complaint["created_by"]
-    )
+    def write(session):
+        previous = ComplaintModel.find_one_and_update(
+            complaint_id, update, session=session, return_document=ReturnDocument.BEFORE
+        )
+        if not previous:
+            return None
+        complaint = {
+            **previous,
+            "status": status.value,
+            "timeline": TimelineModel.embedded(previous, timeline_entry),
+            "due_at": compute_due_at(previous.get("priority"), status.value, now),
+            "escalation_level": 0,
+            "updated_at": now
+        }
+        complaint.pop("overdue_since", None)
+        if complaint["due_at"] is None:
+            complaint.pop("due_at")
+        _archive_timeline(previous, [timeline_entry], session)
+        record_transition(previous, complaint, session=session)
+        # Notify complaint owner
+        _enqueue_status_notification(complaint, status.value, session)
+        _follow_parents([(previous, complaint)], updated_by, now, session)
+        return complaint
     
-    return get_complaint_by_id(complaint_id)
+    complaint = run_transaction(write)
+    if not complaint:
+        raise HTTPException(status_code=404, detail="Complaint not found")
+    sla_tracker.track(complaint_id, complaint.get("due_at"))
+    if status.value in CLOSED_STATUSES:
+        duplicate_index.discard(complaint_id)
+    return serialize_complaint(complaint)
 
 def add_timeline_entry(complaint_id: str, entry: dict) -> dict:
     """Add timeline entry to complaint"""
-    complaint = get_complaint_by_id(complaint_id)
+    complaint = ComplaintModel.update_with_timeline(complaint_id, {}, entry)
     if not complaint:
         raise HTTPException(status_code=404, detail="Complaint not found")
-    
-    ComplaintModel.add_timeline_entry(complaint_id, entry)
-    return get_complaint_by_id(complaint_id)
+    return serialize_complaint(complaint)
 
 def resolve_complaint(complaint_id: str, resolution: str, resolved_by: str) -> dict:
     """Resolve a complaint"""
-    complaint = get_complaint_by_id(complaint_id)
-    if not complaint:
-        raise HTTPException(status_code=404, detail="Complaint not found")
-    
-    # Calculate response time
-    created_at = datetime.fromisoformat(complaint["created_at"]) if isinstance(complaint.get("created_at"), str) else complaint.get("created_at", datetime.now())
     resolved_at = datetime.now()
-    response_time = (resolved_at - created_at).total_seconds() / 3600
-    
-    ComplaintModel.update(complaint_id, {
-        "status": ComplaintStatus.RESOLVED.value,
-        "resolution": resolution,
-        "response_time_hours": round(response_time, 2)
-    })
-    
-    ComplaintModel.add_timeline_entry(complaint_id, {
+    timeline_entry = {
+        "timestamp": resolved_at,
         "status": ComplaintStatus.RESOLVED.value,
         "remarks": f"Resolved: {resolution}",
         "updated_by": resolved_by
-    })
+    }
+    # Response time is computed by MongoDB from the stored created_at, so no read is needed.
+    # User supplied strings are wrapped in $literal so they are never parsed as expressions.
+    created_at = {"$convert": {"input": "$created_at", "to": "date", "onError": resolved_at, "onNull": resolved_at}}
+    update = [{"$set": {
+        "status": ComplaintStatus.RESOLVED.value,
+        "resolution": {"$literal": resolution},
+        "response_time_hours": {"$round": [
+            {"$divide": [{"$subtract": [resolved_at, created_at]}, 3600 * 1000]}, 2
+        ]},
+        "timeline": _append_timeline({key: {"$literal": value} for key, value in timeline_entry.items()}),
+        "updated_at": resolved_at
+    }}, {"$unset": ["due_at", "overdue_since"]}]
     
-    # Send notification
-    create_complaint_status_notification(
-        complaint_id,
-        complaint["title"],
-        ComplaintStatus.RESOLVED.value,
-        complaint["created_by"]
-    )
+    def write(session):
+        # The previous document tells the rollups which status the complaint left
+        previous = ComplaintModel.find_one_and_update(
+            complaint_id, update, session=session, return_document=ReturnDocument.BEFORE
+        )
+        if not previous:
+            return None
+        complaint = {
+            **previous,
+            "status": ComplaintStatus.RESOLVED.value,
+            "resolution": resolution,
+            "response_time_hours": _response_time_hours(previous.get("created_at"), resolved_at),
+            "timeline": TimelineModel.embedded(previous, timeline_entry),
+            "updated_at": resolved_at
+        }
+        complaint.pop("due_at", None)
+        complaint.pop("overdue_since", None)
+        _archive_timeline(previous, [timeline_entry], session)
+        record_transition(previous, complaint, session=session)
+        _enqueue_status_notification(complaint, ComplaintStatus.RESOLVED.value, session)
+        _follow_parents([(previous, complaint)], resolved_by, resolved_at, session)
+        return complaint
     
-    return get_complaint_by_id(complaint_id)
+    complaint = run_transaction(write)
+    if not complaint:
+        raise HTTPException(status_code=404, detail="Complaint not found")
+    duplicate_index.discard(complaint_id)
+    return serialize_complaint(complaint)
 
 def rate_complaint(complaint_id: str, rating: int, feedback: Optional[str], user_id: str) -> dict:
     """Rate a complaint"""
-    complaint = get_complaint_by_id(complaint_id)
-    if not complaint:
-        raise HTTPException(status_code=404, detail="Complaint not found")
+    update_data = {"rating": rating, "feedback": feedback, "updated_at": datetime.now()}
     
-    if complaint["created_by"] != user_id:
-        raise HTTPException(status_code=403, detail="Only the complainant can rate")
+    def write(session):
+        previous = ComplaintModel.find_one_and_update(
+            complaint_id,
+            {"$set": update_data},
+            conditions={"created_by": user_id, "status": ComplaintStatus.RESOLVED.value},
+            session=session,
+            return_document=ReturnDocument.BEFORE
+        )
+        if not previous:
+            return None
+        complaint = {**previous, **update_data}
+        record_transition(previous, complaint, session=session)
+        return complaint
     
-    if complaint["status"] != ComplaintStatus.RESOLVED.value:
+    complaint = run_transaction(write)
+    if not complaint:
+        # Read the complaint only to explain why the update was rejected
+        existing = ComplaintModel.find_by_id(complaint_id)
+        if not existing:
+            raise HTTPException(status_code=404, detail="Complaint not found")
+        if existing["created_by"] != user_id:
+            raise HTTPException(status_code=403, detail="Only the complainant can rate")
         raise HTTPException(status_code=400, detail="Can only rate resolved complaints")
     
-    ComplaintModel.update(complaint_id, {
-        "rating": rating,
-        "feedback": feedback
-    })
-    
-    return get_complaint_by_id(complaint_id)
+    return serialize_complaint(complaint)
 
 def assign_complaint(complaint_id: str, officer_id: str, assigned_by: str) -> dict:
     """Assign complaint to officer"""
-    complaint = get_complaint_by_id(complaint_id)
+    now = datetime.now()
+    update = [{"$set": {
+        "assigned_officer_id": {"$literal": officer_id},
+        "timeline": _append_timeline({
+            "timestamp": now,
+            "status": {"$ifNull": ["$status", ComplaintStatus.PENDING.value]},
+            "remarks": {"$literal": f"Assigned to officer {officer_id}"},
+            "updated_by": {"$literal": assigned_by}
+        }),
+        "updated_at": now
+    }}]
+    
+    def write(session):
+        complaint = ComplaintModel.find_one_and_update(complaint_id, update, session=session)
+        if complaint:
+            _archive_timeline(complaint, complaint["timeline"][-1:], session)
+        return complaint
+    
+    complaint = run_transaction(write)
     if not complaint:
         raise HTTPException(status_code=404, detail="Complaint not found")
     
-    ComplaintModel.update(complaint_id, {"assigned_officer_id": officer_id})
-    ComplaintModel.add_timeline_entry(complaint_id, {
-        "status": complaint.get("status", ComplaintStatus.PENDING.value),
-        "remarks": f"Assigned to officer {officer_id}",
-        "updated_by": assigned_by
-    })
+    return serialize_complaint(complaint)
+
+def escalate_overdue_complaint(complaint_id: str, due_at: datetime) -> Optional[dict]:
+    """Escalate a complaint whose deadline passed.
+    
+    Matches on the exact deadline, so a complaint that changed status since, or was already
+    escalated by another worker, is left alone and None is returned.
+    """
+    now = datetime.now()
+    level = {"$add": [{"$ifNull": ["$escalation_level", 0]}, 1]}
+    next_due_at = next_escalation_at(now)
+    update = [{"$set": {
+        "escalation_level": level,
+        "overdue_since": {"$ifNull": ["$overdue_since", "$due_at"]},
+        "due_at": {"$cond": [{"$lt": [level, SLA_MAX_ESCALATIONS]}, next_due_at, "$$REMOVE"]},
+        "timeline": _append_timeline({
+            "timestamp": now,
+            "status": {"$ifNull": ["$status", ComplaintStatus.PENDING.value]},
+            "remarks": {"$concat": ["SLA deadline missed, escalated to level ", {"$toString": level}]},
+            "updated_by": "system"
+        }),
+        "updated_at": now
+    }}]
     
-    return get_complaint_by_id(complaint_id)
+    def write(session):
+        previous = ComplaintModel.find_one_and_update(
+            complaint_id,
+            update,
+            conditions={"due_at": due_at, "status": {"$nin": CLOSED_STATUSES}},
+            session=session,
+            return_document=ReturnDocument.BEFORE
+        )
+        if not previous:
+            return None
+        escalation_level = previous.get("escalation_level", 0) + 1
+        timeline_entry = {
+            "timestamp": now,
+            "status": previous.get("status") or ComplaintStatus.PENDING.value,
+            "remarks": f"SLA deadline missed, escalated to level {escalation_level}",
+            "updated_by": "system"
+        }
+        complaint = {
+            **previous,
+            "escalation_level": escalation_level,
+            "overdue_since": previous.get("overdue_since") or previous["due_at"],
+            "timeline": TimelineModel.embedded(previous, timeline_entry),
+            "updated_at": now
+        }
+        complaint.pop("due_at")
+        if escalation_level < SLA_MAX_ESCALATIONS:
+            complaint["due_at"] = next_due_at
+        _archive_timeline(previous, [timeline_entry], session)
+        record_transition(previous, complaint, session=session)
+        enqueue("sla_breach", {
+            "ward_number": complaint.get("ward_number"),
+            "complaint_id": complaint_id,
+            "complaint_title": complaint.get("title", ""),
+            "priority": complaint.get("priority"),
+            "status": complaint.get("status"),
+            "escalation_level": escalation_level
+        }, session=session)
+        return complaint
+    
+    complaint = run_transaction(write)
+    if complaint:
+        sla_tracker.track(complaint_id, complaint.get("due_at"))
+    return complaint
+
+def _bulk_change(operation: ComplaintBulkOperation, previous: dict, now: datetime, updated_by: str) -> Tuple[dict, List[str], dict]:
+    """Fields to set, fields to unset and the timeline entry for one bulk operation"""
+    unset_fields = []
+    if operation.action == BulkAction.ASSIGN:
+        if not operation.officer_id:
+            raise ValueError("officer_id is required to assign")
+        status = previous.get("status") or ComplaintStatus.PENDING.value
+        set_fields = {"assigned_officer_id": operation.officer_id}
+        remarks = f"Assigned to officer {operation.officer_id}"
+    elif operation.action == BulkAction.STATUS:
+        if not operation.status:
+            raise ValueError("status is required")
+        status = operation.status.value
+        set_fields = {"status": status, "escalation_level": 0}
+        due_at = compute_due_at(previous.get("priority"), status, now)
+        if due_at is None:
+            unset_fields.append("due_at")
+        else:
+            set_fields["due_at"] = due_at
+        unset_fields.append("overdue_since")
+        remarks = operation.remarks or "Status updated"
+    else:
+        if not operation.resolution:
+            raise ValueError("resolution is required")
+        status = ComplaintStatus.RESOLVED.value
+        set_fields = {
+            "status": status,
+            "resolution": operation.resolution,
+            "response_time_hours": _response_time_hours(previous.get("created_at"), now)
+        }
+        unset_fields += ["due_at", "overdue_since"]
+        remarks = f"Resolved: {operation.resolution}"
+    set_fields["updated_at"] = now
+    timeline_entry = {"timestamp": now, "status": status, "remarks": remarks, "updated_by": updated_by}
+    return set_fields, unset_fields, timeline_entry
+
+def bulk_update_complaints(operations: List[ComplaintBulkOperation], updated_by: str) -> dict:
+    """Assign, change the status of or resolve many complaints in one bulk write.
+    
+    Each complaint is only updated if it has not changed since it was read; otherwise its
+    result is "conflict" and the operation can be retried.
+    """
+    if len(operations) > BULK_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_OPERATIONS} operations per request")
+    # Millisecond precision so the stamp can be matched against what MongoDB stored
+    now = datetime.now()
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    results = []
+    seen = set()
+    
+    def write(session):
+        # Rebuilt on every attempt, since a transaction may be retried
+        results.clear()
+        seen.clear()
+        for operation in operations:
+            if operation.complaint_id in seen:
+                results.append({"complaint_id": operation.complaint_id, "result": "invalid",
+                                "detail": "Duplicate complaint_id in request"})
+            else:
+                results.append({"complaint_id": operation.complaint_id, "result": "updated"})
+            seen.add(operation.complaint_id)
+        previous_by_id = ComplaintModel.find_many_by_ids(
+            list(seen), {"timeline": 0, "attachments": 0}, session=session
+        )
+        writes = []
+        changes = {}
+        for index, operation in enumerate(operations):
+            if results[index]["result"] != "updated":
+                continue
+            previous = previous_by_id.get(operation.complaint_id)
+            if not previous:
+                results[index].update(result="not_found", detail="Complaint not found")
+                continue
+            try:
+                set_fields, unset_fields, timeline_entry = _bulk_change(operation, previous, now, updated_by)
+            except ValueError as e:
+                results[index].update(result="invalid", detail=str(e))
+                continue
+            push = {"$each": [timeline_entry]}
+            if previous.get("timeline_archived"):
+                push["$slice"] = -TIMELINE_EMBEDDED_ENTRIES
+            update = {"$set": set_fields, "$push": {"timeline": push}}
+            if unset_fields:
+                update["$unset"] = {field: "" for field in unset_fields}
+            writes.append(UpdateOne(
+                {"complaint_id": operation.complaint_id, "updated_at": previous.get("updated_at")}, update
+            ))
+            complaint = {**previous, **set_fields}
+            for field in unset_fields:
+                complaint.pop(field, None)
+            changes[operation.complaint_id] = (index, previous, complaint, timeline_entry)
+        if not writes:
+            return []
+        
+        result = ComplaintModel.bulk_write(writes, session=session)
+        applied = set(changes)
+        if result.matched_count < len(writes):
+            # Some complaints changed after they were read; find out which updates landed
+            landed = ComplaintModel.find_many_by_ids(list(changes), {"complaint_id": 1, "updated_at": 1}, session=session)
+            applied = {complaint_id for complaint_id, doc in landed.items() if doc.get("updated_at") == now}
+        
+        applied_changes = []
+        notifications = []
+        archived_entries = []
+        for complaint_id, (index, previous, complaint, timeline_entry) in changes.items():
+            if complaint_id not in applied:
+                results[index].update(result="conflict", detail="Complaint changed during the update, retry")
+                continue
+            applied_changes.append((previous, complaint))
+            if previous.get("timeline_archived"):
+                archived_entries.append((complaint_id, timeline_entry))
+            if operations[index].action != BulkAction.ASSIGN:
+                notifications.append({
+                    "complaint_id": complaint_id,
+                    "complaint_title": complaint.get("title", ""),
+                    "status": complaint["status"],
+                    "user_id": complaint.get("created_by")
+                })
+        TimelineModel.append_many(archived_entries, session=session)
+        record_transitions(applied_changes, session=session)
+        # Owner notifications for the whole batch go into the outbox in one insert
+        enqueue_many("complaint_status", notifications, session=session)
+        _follow_parents(applied_changes, updated_by, now, session)
+        return applied_changes
+    
+    applied_changes = run_transaction(write)
+    for _, complaint in applied_changes:
+        sla_tracker.track(complaint["complaint_id"], complaint.get("due_at"))
+        if complaint["status"] in CLOSED_STATUSES:
+            duplicate_index.discard(complaint["complaint_id"])
+    updated = sum(1 for result in results if result["result"] == "updated")
+    return {"results": results, "updated": updated, "failed": len(results) - updated}
+
+def get_duplicates(complaint_id: str) -> List[dict]:
+    """Complaints linked as duplicates of a complaint"""
+    complaints = ComplaintModel.find_duplicates_of(complaint_id)
+    for complaint in complaints:
+        serialize_complaint(complaint)
+    return complaints
+
+def unlink_duplicate(complaint_id: str, updated_by: str) -> dict:
+    """Turn a complaint wrongly linked as a duplicate back into an original.
+    
+    It gets its own deadline again and the ward admin is notified as for a new complaint.
+    """
+    now = datetime.now()
+    
+    def write(session):
+        previous = ComplaintModel.find_many_by_ids([complaint_id], {"timeline": 0, "attachments": 0}, session=session).get(complaint_id)
+        if not previous:
+            return None, (404, "Complaint not found")
+        if "duplicate_of" not in previous:
+            return None, (400, "Complaint is not linked as a duplicate")
+        timeline_entry = {
+            "timestamp": now,
+            "status": previous.get("status") or ComplaintStatus.PENDING.value,
+            "remarks": f"No longer treated as a duplicate of {previous['duplicate_of']}",
+            "updated_by": updated_by
+        }
+        set_fields = {"escalation_level": 0, "updated_at": now}
+        unset_fields = {"duplicate_of": "", "duplicate_score": ""}
+        due_at = compute_due_at(previous.get("priority"), previous.get("status"), now)
+        if due_at is None:
+            unset_fields["due_at"] = ""
+        else:
+            set_fields["due_at"] = due_at
+        push = {"$each": [timeline_entry]}
+        if previous.get("timeline_archived"):
+            push["$slice"] = -TIMELINE_EMBEDDED_ENTRIES
+        complaint = ComplaintModel.find_one_and_update(
+            complaint_id,
+            {"$set": set_fields, "$unset": unset_fields, "$push": {"timeline": push}},
+            conditions={"duplicate_of": previous["duplicate_of"]},
+            session=session
+        )
+        if not complaint:
+            return None, (409, "Complaint changed during the update, retry")
+        ComplaintModel.unlink_duplicate(previous["duplicate_of"], session=session)
+        _archive_timeline(previous, [timeline_entry], session)
+        if complaint.get("status") not in CLOSED_STATUSES:
+            enqueue("new_complaint", _new_complaint_event(complaint), session=session)
+        return complaint, None
+    
+    complaint, error = run_transaction(write)
+    if not complaint:
+        raise HTTPException(status_code=error[0], detail=error[1])
+    sla_tracker.track(complaint_id, complaint.get("due_at"))
+    if complaint.get("status") not in CLOSED_STATUSES:
+        duplicate_index.add(complaint, signature(complaint))
+    return serialize_complaint(complaint)
 
 def track_complaint(complaint_id: str) -> Optional[dict]:
     """Track complaint (public endpoint)"""
@@ -1,5 +1,25 @@
+from collections import deque
+from typing import List, Dict, Any, Optional, Tuple
+import json
+import math
+import os
 import random
+import threading
 import time
+import uuid
+
+# Live report store settings
+CROWD_TTL_MINUTES = int(os.getenv("CROWD_TTL_MINUTES", "180"))
+CROWD_BUCKET_SECONDS = int(os.getenv("CROWD_BUCKET_SECONDS", "60"))
+CROWD_CELL_DEGREES = float(os.getenv("CROWD_CELL_DEGREES", "0.01"))
+CROWD_SNAPSHOT_PATH = os.getenv("CROWD_SNAPSHOT_PATH", "crowd_reports.ndjson")
+CROWD_SNAPSHOT_SECONDS = int(os.getenv("CROWD_SNAPSHOT_SECONDS", "30"))
+CROWD_MAX_RESULTS = int(os.getenv("CROWD_MAX_RESULTS", "2000"))
+# Serve generated reports while no real ones have been filed (demo deployments)
+CROWDSOURCE_DEMO = os.getenv("CROWDSOURCE_DEMO", "false").lower() == "true"
+
+# Water depth (cm) at which a report becomes moderate / severe; map markers use severity 0-2
+SEVERITY_DEPTHS_CM = [15, 45]
 
 CROWDSOURCE_TEMPLATES = [
     "User reported {depth}ft water here",
@@ -48,3 +68,224 @@ def generate_crowdsource_reports(rainfall_intensity: float, hotspots: list = Non
             })
     
     return reports
+
+def severity_for_depth(depth_cm: float) -> int:
+    return sum(1 for threshold in SEVERITY_DEPTHS_CM if depth_cm >= threshold)
+
+class CrowdReportStore:
+    """Recent citizen reports in memory, bucketed by minute and by grid cell.
+
+    Each time bucket maps grid cells to their reports, so a query only visits the
+    buckets inside its time window and the cells inside its bounding box. Whole
+    buckets are dropped once older than the TTL. Live reports are snapshotted so a
+    restart does not lose the storm in progress.
+
+    Each worker process keeps its own store: reports POSTed to one worker are only
+    returned by GET /crowdsource, and only fused into hotspot risk, on that worker.
+    Run a single worker where every report must be seen everywhere. Each worker
+    snapshots to CROWD_SNAPSHOT_PATH suffixed with its pid, and on startup every
+    worker restores the reports of all recent snapshots.
+    """
+
+    def __init__(self, ttl_minutes: int = CROWD_TTL_MINUTES, bucket_seconds: int = CROWD_BUCKET_SECONDS,
+                 cell_degrees: float = CROWD_CELL_DEGREES, snapshot_path: Optional[str] = CROWD_SNAPSHOT_PATH):
+        self.ttl = ttl_minutes * 60
+        self.bucket_seconds = bucket_seconds
+        self.cell_degrees = cell_degrees
+        self.snapshot_path = snapshot_path
+        # (bucket start, {cell: [report, ...]}) oldest first
+        self._buckets: deque = deque()
+        self._count = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._listeners = []
+
+    def cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_degrees), math.floor(lng / self.cell_degrees)
+
+    def _expire(self, now: float):
+        while self._buckets and self._buckets[0][0] + self.bucket_seconds <= now - self.ttl:
+            _, cells = self._buckets.popleft()
+            self._count -= sum(len(reports) for reports in cells.values())
+            self._dirty = True
+
+    def _insert(self, report: Dict[str, Any]):
+        start = report["timestamp"] - report["timestamp"] % self.bucket_seconds
+        if not self._buckets or self._buckets[-1][0] < start:
+            self._buckets.append((start, {}))
+            bucket = self._buckets[-1]
+        else:
+            # Late reports (and snapshot loads) go into the bucket they belong to
+            bucket = next((b for b in reversed(self._buckets) if b[0] <= start), None)
+            if bucket is None or bucket[0] != start:
+                index = 0 if bucket is None else self._buckets.index(bucket) + 1
+                self._buckets.insert(index, (start, {}))
+                bucket = self._buckets[index]
+        bucket[1].setdefault(self.cell(report["lat"], report["lng"]), []).append(report)
+        self._count += 1
+        self._dirty = True
+
+    def add_listener(self, listener):
+        """Call listener(report) for every report added or restored"""
+        self._listeners.append(listener)
+
+    def _notify(self, report: Dict[str, Any]):
+        for listener in self._listeners:
+            try:
+                listener(report)
+            except Exception as e:
+                print(f"[Crowdsource] WARNING: Report listener failed: {type(e).__name__}: {str(e)}")
+
+    def add(self, lat: float, lng: float, depth_cm: float, message: Optional[str] = None,
+            reported_by: Optional[str] = None, timestamp: Optional[float] = None) -> Dict[str, Any]:
+        now = time.time()
+        report = {
+            "id": f"report_{uuid.uuid4().hex[:12]}",
+            "lat": lat,
+            "lng": lng,
+            "depth_cm": depth_cm,
+            "message": message or f"User reported {depth_cm:g}cm water here",
+            "timestamp": int(min(timestamp or now, now)),
+            "severity": severity_for_depth(depth_cm),
+            "reported_by": reported_by
+        }
+        if report["timestamp"] <= now - self.ttl:
+            raise ValueError("Report is older than the retention window")
+        with self._lock:
+            self._insert(report)
+            self._expire(now)
+        self._notify(report)
+        return report
+
+    def query(self, south: Optional[float] = None, west: Optional[float] = None, north: Optional[float] = None,
+              east: Optional[float] = None, minutes: Optional[int] = None, limit: int = CROWD_MAX_RESULTS) -> List[Dict[str, Any]]:
+        """Reports inside the bounding box filed in the last `minutes`, newest first"""
+        now = time.time()
+        since = now - min((minutes or self.ttl // 60) * 60, self.ttl)
+        bounded = None not in (south, west, north, east)
+        if bounded:
+            min_row, min_col = self.cell(south, west)
+            max_row, max_col = self.cell(north, east)
+            box_cells = (max_row - min_row + 1) * (max_col - min_col + 1)
+        results = []
+        with self._lock:
+            self._expire(now)
+            for start, cells in reversed(self._buckets):
+                if start + self.bucket_seconds <= since:
+                    break
+                if not bounded:
+                    candidates = list(cells.values())
+                elif box_cells < len(cells):
+                    candidates = [
+                        cells[(row, col)] for row in range(min_row, max_row + 1) for col in range(min_col, max_col + 1)
+                        if (row, col) in cells
+                    ]
+                else:
+                    candidates = [
+                        reports for (row, col), reports in cells.items()
+                        if min_row <= row <= max_row and min_col <= col <= max_col
+                    ]
+                for reports in candidates:
+                    for report in reports:
+                        if report["timestamp"] < since:
+                            continue
+                        if bounded and not (south <= report["lat"] <= north and west <= report["lng"] <= east):
+                            continue
+                        results.append(report)
+        results.sort(key=lambda report: report["timestamp"], reverse=True)
+        return results[:limit]
+
+    def __len__(self) -> int:
+        return self._count
+
+    def snapshot(self) -> int:
+        """Write the live reports to disk atomically, if anything changed since the last snapshot"""
+        if not self.snapshot_path:
+            return 0
+        with self._lock:
+            if not self._dirty:
+                return 0
+            self._expire(time.time())
+            reports = [report for _, cells in self._buckets for reports in cells.values() for report in reports]
+            self._dirty = False
+        # One file per worker process, so workers never overwrite each other's reports
+        path = f"{self.snapshot_path}.{os.getpid()}"
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            for report in reports:
+                file.write(json.dumps(report))
+                file.write("\n")
+        os.replace(temporary, path)
+        return len(reports)
+
+    def _snapshot_files(self) -> List[str]:
+        """Snapshots of every worker, plus the unsuffixed file older versions wrote"""
+        directory = os.path.dirname(self.snapshot_path) or "."
+        name = os.path.basename(self.snapshot_path)
+        return [
+            os.path.join(directory, entry) for entry in os.listdir(directory)
+            if entry == name or (entry.startswith(f"{name}.") and entry[len(name) + 1:].isdigit())
+        ]
+
+    def load(self) -> int:
+        """Restore the reports of recent snapshots that have not expired yet"""
+        if not self.snapshot_path:
+            return 0
+        now = time.time()
+        restored = []
+        seen = set()
+        files = self._snapshot_files()
+        for path in files:
+            if os.path.getmtime(path) <= now - self.ttl:
+                # Left by a worker that stopped long enough ago for all its reports to expire
+                os.remove(path)
+                continue
+            with open(path, encoding="utf-8") as file, self._lock:
+                for line in file:
+                    try:
+                        report = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if report.get("id") in seen or report.get("timestamp", 0) <= now - self.ttl:
+                        continue
+                    seen.add(report.get("id"))
+                    self._insert(report)
+                    restored.append(report)
+                self._dirty = False
+        for report in restored:
+            self._notify(report)
+        loaded = len(restored)
+        print(f"[Crowdsource] Restored {loaded} reports from {len(files)} snapshots of {self.snapshot_path}")
+        return loaded
+
+    def start(self):
+        if self._thread:
+            return
+        try:
+            self.load()
+        except OSError as e:
+            print(f"[Crowdsource] WARNING: Could not read snapshot: {type(e).__name__}: {str(e)}")
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="crowd-snapshots", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(5)
+        self._thread = None
+        self._snapshot_safely()
+
+    def _snapshot_safely(self):
+        try:
+            self.snapshot()
+        except OSError as e:
+            print(f"[Crowdsource] WARNING: Snapshot failed: {type(e).__name__}: {str(e)}")
+
+    def _run(self):
+        while not self._stopping.wait(CROWD_SNAPSHOT_SECONDS):
+            self._snapshot_safely()
+
+store = CrowdReportStore()
@@ -0,0 +1,166 @@
+"""Near-duplicate detection for newly filed complaints.
+
+Recent open complaints are kept in an in-memory grid of cells at least
+DEDUP_RADIUS_METERS wide, so a new complaint is only compared with those in
+its own and the eight neighbouring cells. Complaints without a location are
+grouped by ward instead. Text similarity is the Jaccard similarity of word
+shingles, estimated from MinHash signatures.
+
+Each worker process keeps its own grid, loaded from MongoDB on startup, so a
+duplicate filed through another worker within the same minute can be missed.
+"""
+from models import complaints_collection
+from sla import CLOSED_STATUSES
+from collections import deque
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime, timedelta
+import math
+import os
+import re
+import threading
+import zlib
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_RADIUS_METERS = float(os.getenv("DEDUP_RADIUS_METERS", "250"))
+DEDUP_WINDOW_HOURS = float(os.getenv("DEDUP_WINDOW_HOURS", "12"))
+DEDUP_SIMILARITY = float(os.getenv("DEDUP_SIMILARITY", "0.5"))
+
+MINHASH_PERMUTATIONS = 64
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# Fixed coefficients, so signatures agree across restarts and worker processes
+_PERMUTATIONS = [
+    (zlib.crc32(f"a{i}".encode()) | 1, zlib.crc32(f"b{i}".encode()))
+    for i in range(MINHASH_PERMUTATIONS)
+]
+_METERS_PER_DEGREE = 111320.0
+_WORD = re.compile(r"[a-z0-9]+")
+
+def shingles(text: str) -> set:
+    """Words and word pairs of the normalised text"""
+    words = _WORD.findall(text.lower())
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+def minhash(features: set) -> Tuple[int, ...]:
+    hashes = [zlib.crc32(feature.encode()) for feature in features]
+    if not hashes:
+        return tuple([_MAX_HASH] * MINHASH_PERMUTATIONS)
+    return tuple(
+        min((a * value + b) % _MERSENNE_PRIME & _MAX_HASH for value in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+def similarity(first: Tuple[int, ...], second: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures"""
+    return sum(1 for a, b in zip(first, second) if a == b) / MINHASH_PERMUTATIONS
+
+def signature(complaint: Dict[str, Any]) -> Tuple[int, ...]:
+    text = " ".join(str(complaint.get(field) or "") for field in ("category", "title", "description"))
+    return minhash(shingles(text))
+
+def distance_meters(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(h))
+
+def _coordinates(complaint: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    location = complaint.get("location") or {}
+    if location.get("latitude") is None or location.get("longitude") is None:
+        return None
+    return float(location["latitude"]), float(location["longitude"])
+
+class DuplicateIndex:
+    """Recent open complaints by grid cell, for finding the one a new complaint repeats"""
+
+    def __init__(self, radius_meters: float = DEDUP_RADIUS_METERS, window_hours: float = DEDUP_WINDOW_HOURS,
+                 threshold: float = DEDUP_SIMILARITY):
+        self.radius = radius_meters
+        self.window = timedelta(hours=window_hours)
+        self.threshold = threshold
+        self._lat_step = radius_meters / _METERS_PER_DEGREE
+        # Each cell holds (created_at, complaint_id, coordinates, signature) oldest first
+        self._cells: Dict[tuple, deque] = {}
+        self._lock = threading.Lock()
+
+    def _lon_step(self, row: int) -> float:
+        # Cells stay at least `radius` wide however far a row is from the equator
+        latitude = min(abs((row + 0.5) * self._lat_step), 89.0)
+        return self._lat_step / math.cos(math.radians(latitude))
+
+    def _cell(self, coordinates: Optional[Tuple[float, float]], ward_number) -> tuple:
+        if coordinates is None:
+            return ("ward", ward_number)
+        row = math.floor(coordinates[0] / self._lat_step)
+        return (row, math.floor(coordinates[1] / self._lon_step(row)))
+
+    def _neighbours(self, coordinates: Optional[Tuple[float, float]], ward_number) -> List[tuple]:
+        if coordinates is None:
+            return [("ward", ward_number)]
+        row = math.floor(coordinates[0] / self._lat_step)
+        cells = []
+        for neighbour_row in (row - 1, row, row + 1):
+            column = math.floor(coordinates[1] / self._lon_step(neighbour_row))
+            cells.extend((neighbour_row, neighbour_column) for neighbour_column in (column - 1, column, column + 1))
+        return cells
+
+    def _evict(self, cell: deque, now: datetime):
+        while cell and cell[0][0] < now - self.window:
+            cell.popleft()
+
+    def add(self, complaint: Dict[str, Any], complaint_signature: Optional[Tuple[int, ...]] = None):
+        coordinates = _coordinates(complaint)
+        key = self._cell(coordinates, complaint.get("ward_number"))
+        entry = (
+            complaint.get("created_at") or datetime.now(), complaint["complaint_id"], coordinates,
+            complaint_signature or signature(complaint)
+        )
+        with self._lock:
+            cell = self._cells.setdefault(key, deque())
+            cell.append(entry)
+            self._evict(cell, datetime.now())
+
+    def discard(self, complaint_id: str):
+        """Stop matching against a complaint, e.g. once it is closed"""
+        with self._lock:
+            for cell in self._cells.values():
+                for entry in list(cell):
+                    if entry[1] == complaint_id:
+                        cell.remove(entry)
+
+    def find_parent(self, complaint: Dict[str, Any], complaint_signature: Optional[Tuple[int, ...]] = None
+                    ) -> Optional[Tuple[str, float]]:
+        """The most similar recent complaint nearby and its similarity, if any passes the threshold"""
+        coordinates = _coordinates(complaint)
+        complaint_signature = complaint_signature or signature(complaint)
+        now = datetime.now()
+        best = None
+        with self._lock:
+            for key in self._neighbours(coordinates, complaint.get("ward_number")):
+                cell = self._cells.get(key)
+                if not cell:
+                    continue
+                self._evict(cell, now)
+                for _, complaint_id, other_coordinates, other_signature in cell:
+                    if coordinates is not None and distance_meters(*coordinates, *other_coordinates) > self.radius:
+                        continue
+                    score = similarity(complaint_signature, other_signature)
+                    if score >= self.threshold and (best is None or score > best[1]):
+                        best = (complaint_id, score)
+        return best
+
+    def load(self) -> int:
+        """Fill the grid with the open, non-duplicate complaints filed within the window"""
+        since = datetime.now() - self.window
+        cursor = complaints_collection.find(
+            {"created_at": {"$gte": since}, "status": {"$nin": CLOSED_STATUSES}, "duplicate_of": {"$exists": False}},
+            {"complaint_id": 1, "title": 1, "description": 1, "category": 1, "ward_number": 1,
+             "location": 1, "created_at": 1}
+        ).sort("created_at", 1)
+        count = 0
+        for complaint in cursor:
+            self.add(complaint)
+            count += 1
+        print(f"[Dedup] Loaded {count} recent complaints")
+        return count
+
+index = DuplicateIndex()
@@ -0,0 +1,176 @@
+from typing import List, Dict, Any, Optional, Callable, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from google.auth.transport.requests import Request
+
+# FCM transport settings
+FCM_ENDPOINT = os.getenv("FCM_ENDPOINT", "https://fcm.googleapis.com")
+FCM_MAX_IN_FLIGHT = int(os.getenv("FCM_MAX_IN_FLIGHT", "32"))
+FCM_TIMEOUT_SECONDS = float(os.getenv("FCM_TIMEOUT_SECONDS", "10"))
+FCM_TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("FCM_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+
+# Send results
+SENT = "sent"
+INVALID_TOKEN = "invalid_token"
+FAILED = "failed"
+
+# FCM error codes meaning the registration token will never work again
+INVALID_TOKEN_ERRORS = {"UNREGISTERED"}
+# INVALID_ARGUMENT only condemns the token when the field at fault is the token itself
+INVALID_TOKEN_FIELD = "message.token"
+
+class FCMClient:
+    """FCM V1 client with a cached OAuth token, pooled keep-alive connections and concurrent sends"""
+
+    def __init__(
+        self,
+        project_id: str,
+        credentials,
+        endpoint: str = FCM_ENDPOINT,
+        max_in_flight: int = FCM_MAX_IN_FLIGHT,
+        timeout: float = FCM_TIMEOUT_SECONDS,
+        on_invalid_tokens: Optional[Callable[[List[str]], Any]] = None
+    ):
+        self.project_id = project_id
+        self.credentials = credentials
+        self.url = f"{endpoint.rstrip('/')}/v1/projects/{project_id}/messages:send"
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.on_invalid_tokens = on_invalid_tokens
+
+        self._token_lock = threading.Lock()
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="fcm")
+
+    def _token_is_fresh(self) -> bool:
+        token = getattr(self.credentials, "token", None)
+        expiry = getattr(self.credentials, "expiry", None)
+        if not token:
+            return False
+        if expiry is None:
+            return True
+        # google-auth expiry is a naive UTC datetime
+        return expiry - timedelta(seconds=FCM_TOKEN_REFRESH_MARGIN_SECONDS) > datetime.utcnow()
+
+    def access_token(self, force_refresh: bool = False) -> str:
+        """Return the cached OAuth token, refreshing it shortly before it expires"""
+        if not force_refresh and self._token_is_fresh():
+            return self.credentials.token
+        with self._token_lock:
+            if force_refresh or not self._token_is_fresh():
+                self.credentials.refresh(Request())
+                print(f"[FCM] Access token refreshed, expires {getattr(self.credentials, 'expiry', None)}")
+            return self.credentials.token
+
+    def _post(self, payload: Dict[str, Any], force_refresh: bool = False) -> requests.Response:
+        headers = {
+            "Authorization": f"Bearer {self.access_token(force_refresh)}",
+            "Content-Type": "application/json"
+        }
+        return self._session.post(self.url, headers=headers, json=payload, timeout=self.timeout)
+
+    @staticmethod
+    def _error(response: requests.Response) -> Dict[str, Any]:
+        try:
+            body = response.json()
+        except ValueError:
+            return {}
+        error = body.get("error") if isinstance(body, dict) else None
+        return error if isinstance(error, dict) else {}
+
+    @staticmethod
+    def _error_code(error: Dict[str, Any]) -> Optional[str]:
+        for detail in error.get("details", []):
+            if detail.get("errorCode"):
+                return detail["errorCode"]
+        return error.get("status")
+
+    @staticmethod
+    def _token_rejected(error: Dict[str, Any]) -> bool:
+        """Whether FCM says the registration token itself is dead, as opposed to the request or project"""
+        error_code = FCMClient._error_code(error)
+        if error_code in INVALID_TOKEN_ERRORS:
+            return True
+        if error_code != "INVALID_ARGUMENT":
+            return False
+        return any(
+            violation.get("field") == INVALID_TOKEN_FIELD
+            for detail in error.get("details", [])
+            for violation in detail.get("fieldViolations", [])
+        )
+
+    def _send(self, push_token: str, title: str, message: str, data: Optional[Dict[str, Any]] = None) -> str:
+        payload = {
+            "message": {
+                "token": push_token,
+                "notification": {
+                    "title": title,
+                    "body": message
+                },
+                "data": {str(k): str(v) for k, v in (data or {}).items()}
+            }
+        }
+        try:
+            response = self._post(payload)
+            if response.status_code == 401:
+                # Token revoked or expired early; refresh once and retry
+                response = self._post(payload, force_refresh=True)
+            if response.ok:
+                return SENT
+            error = self._error(response)
+            # A bare 404 can also mean a wrong project id or endpoint, which must not prune every token
+            if self._token_rejected(error):
+                return INVALID_TOKEN
+            print(f"[FCM] Send failed: HTTP {response.status_code} {self._error_code(error)}")
+            return FAILED
+        except Exception as e:
+            print(f"[FCM] Error sending push notification: {type(e).__name__}: {str(e)}")
+            return FAILED
+
+    def _prune(self, tokens: List[str]):
+        if not tokens or not self.on_invalid_tokens:
+            return
+        try:
+            self.on_invalid_tokens(tokens)
+            print(f"[FCM] Pruned {len(tokens)} invalid push tokens")
+        except Exception as e:
+            print(f"[FCM] WARNING: Failed to prune invalid tokens: {type(e).__name__}: {str(e)}")
+
+    def send(self, push_token: str, title: str, message: str, data: Optional[Dict[str, Any]] = None) -> str:
+        """Send one message. Returns SENT, INVALID_TOKEN or FAILED."""
+        result = self._send(push_token, title, message, data)
+        if result == INVALID_TOKEN:
+            self._prune([push_token])
+        return result
+
+    def send_many(
+        self,
+        push_tokens: List[str],
+        title: str,
+        message: str,
+        data: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, int]:
+        """Send the same message to many tokens, at most max_in_flight at a time"""
+        results = list(self._executor.map(lambda token: (token, self._send(token, title, message, data)), push_tokens))
+        return self._summarize(results)
+
+    def _summarize(self, results: List[Tuple[str, str]]) -> Dict[str, int]:
+        counts = {SENT: 0, INVALID_TOKEN: 0, FAILED: 0}
+        invalid = []
+        for token, result in results:
+            counts[result] += 1
+            if result == INVALID_TOKEN:
+                invalid.append(token)
+        self._prune(invalid)
+        return counts
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._session.close()
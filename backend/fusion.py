@@ -0,0 +1,122 @@
+"""Fuse crowdsourced water-depth reports into hotspot and ward flood risk.
+
+Every report is joined, as it arrives, to the hotspots within
+FUSION_RADIUS_METERS and the wards containing it, through a map from crowd grid
+cells to the sites they touch. Each site keeps one exponentially decaying
+evidence score, so reading the fused risk costs O(1) per site however many
+reports have been filed.
+
+Evidence only ever raises risk: no reports is not evidence of a dry street.
+"""
+from crowdsource import store as crowd_store
+from hotspots import HOTSPOTS
+from wards import WARDS
+from typing import Dict, Any, Optional, Tuple
+import math
+import os
+import threading
+import time
+
+FUSION_RADIUS_METERS = float(os.getenv("FUSION_RADIUS_METERS", "750"))
+FUSION_HALF_LIFE_MINUTES = float(os.getenv("FUSION_HALF_LIFE_MINUTES", "30"))
+# Evidence added by one nearby report of severity 0, 1 and 2
+FUSION_SEVERITY_WEIGHTS = [0.15, 0.4, 0.8]
+# Crowd risk at which reports alone justify risk level 1 and 2
+FUSION_LEVEL_THRESHOLDS = [0.5, 0.8]
+
+_METERS_PER_DEGREE = 111320.0
+
+def _distance_meters(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    # Equirectangular approximation, accurate to well under a meter at these distances
+    x = math.radians(lng2 - lng1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return 6371000 * math.hypot(x, y)
+
+class RiskFusion:
+    """Decaying crowd evidence per hotspot and ward, updated by every new report"""
+
+    def __init__(self, radius_meters: float = FUSION_RADIUS_METERS, half_life_minutes: float = FUSION_HALF_LIFE_MINUTES):
+        self.radius = radius_meters
+        self.decay_rate = math.log(2) / (half_life_minutes * 60)
+        # Site key -> (evidence, decayed report count, as of timestamp)
+        self._evidence: Dict[Tuple[str, Any], Tuple[float, float, float]] = {}
+        self._cells: Dict[Tuple[int, int], list] = {}
+        self._lock = threading.Lock()
+        self._index_sites()
+
+    def _cell_range(self, south: float, west: float, north: float, east: float):
+        min_row, min_col = crowd_store.cell(south, west)
+        max_row, max_col = crowd_store.cell(north, east)
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                yield row, col
+
+    def _index_sites(self):
+        for hotspot in HOTSPOTS:
+            lat_margin = self.radius / _METERS_PER_DEGREE
+            lng_margin = lat_margin / math.cos(math.radians(hotspot["lat"]))
+            site = ("hotspot", hotspot["id"], hotspot["lat"], hotspot["lng"])
+            for cell in self._cell_range(hotspot["lat"] - lat_margin, hotspot["lng"] - lng_margin,
+                                         hotspot["lat"] + lat_margin, hotspot["lng"] + lng_margin):
+                self._cells.setdefault(cell, []).append(site)
+        for ward in WARDS:
+            (south, west), (north, east) = ward["bounds"][0], ward["bounds"][2]
+            site = ("ward", ward["id"], (south, west, north, east))
+            for cell in self._cell_range(south, west, north, east):
+                self._cells.setdefault(cell, []).append(site)
+
+    def _weight(self, site: tuple, lat: float, lng: float) -> float:
+        if site[0] == "hotspot":
+            distance = _distance_meters(site[2], site[3], lat, lng)
+            return max(0.0, 1 - distance / self.radius)
+        south, west, north, east = site[2]
+        return 1.0 if south <= lat <= north and west <= lng <= east else 0.0
+
+    def _decayed(self, key, now: float) -> Tuple[float, float]:
+        evidence, count, as_of = self._evidence.get(key, (0.0, 0.0, now))
+        factor = math.exp(-self.decay_rate * max(now - as_of, 0))
+        return evidence * factor, count * factor
+
+    def observe(self, report: Dict[str, Any]):
+        """Add one report's evidence to the sites around it"""
+        sites = self._cells.get(crowd_store.cell(report["lat"], report["lng"]))
+        if not sites:
+            return
+        now = time.time()
+        severity = min(max(int(report.get("severity", 0)), 0), len(FUSION_SEVERITY_WEIGHTS) - 1)
+        # A late or restored report counts as much as it would have had it been added on time
+        recency = math.exp(-self.decay_rate * max(now - report.get("timestamp", now), 0))
+        with self._lock:
+            for site in sites:
+                weight = self._weight(site, report["lat"], report["lng"])
+                if weight <= 0:
+                    continue
+                key = site[:2]
+                evidence, count = self._decayed(key, now)
+                self._evidence[key] = (
+                    evidence + FUSION_SEVERITY_WEIGHTS[severity] * weight * recency, count + recency, now
+                )
+
+    def crowd_risk(self, kind: str, site_id) -> Dict[str, float]:
+        """Probability-like crowd risk in [0, 1) and the decayed number of reports behind it"""
+        with self._lock:
+            evidence, count = self._decayed((kind, site_id), time.time())
+        return {"crowd_risk": round(1 - math.exp(-evidence), 4), "crowd_reports": round(count, 2)}
+
+    def fuse(self, kind: str, site_id, risk_level: int, probability: Optional[float] = None) -> Dict[str, Any]:
+        """Model risk level and probability, raised by the crowd evidence around the site"""
+        crowd = self.crowd_risk(kind, site_id)
+        crowd_level = sum(1 for threshold in FUSION_LEVEL_THRESHOLDS if crowd["crowd_risk"] >= threshold)
+        fused = {"risk_level": max(int(risk_level), crowd_level), **crowd}
+        if probability is not None:
+            if crowd_level > risk_level:
+                fused["probability"] = crowd["crowd_risk"]
+            elif crowd_level == risk_level and risk_level > 0:
+                # Reports agree with the model, so they add confidence to its prediction
+                fused["probability"] = 1 - (1 - float(probability)) * (1 - crowd["crowd_risk"])
+            else:
+                fused["probability"] = float(probability)
+        return fused
+
+fusion = RiskFusion()
+crowd_store.add_listener(fusion.observe)
@@ -0,0 +1,227 @@
+"""Spatial complaint queries and precomputed map clusters.
+
+Complaints with a location also store it as a GeoJSON point in `geo`, indexed
+2dsphere for radius and bounding-box queries. For zoomed-out maps, counts are
+kept per grid cell at every zoom level up to CLUSTER_MAX_ZOOM (cells are
+CLUSTER_CELL_PIXELS wide in web-mercator pixels) and updated with $inc
+alongside the rollups, so a whole-city view reads a few dozen cells.
+
+Give existing complaints their point and build the clusters with:
+
+    python geo.py backfill
+    python geo.py rebuild
+"""
+from models import complaints_collection, map_clusters_collection
+from pymongo import UpdateOne, ASCENDING
+from typing import List, Dict, Any, Optional, Tuple
+from collections import defaultdict
+from datetime import datetime
+import math
+import os
+import sys
+
+CLUSTER_MIN_ZOOM = int(os.getenv("CLUSTER_MIN_ZOOM", "0"))
+CLUSTER_MAX_ZOOM = int(os.getenv("CLUSTER_MAX_ZOOM", "16"))
+CLUSTER_CELL_PIXELS = int(os.getenv("CLUSTER_CELL_PIXELS", "64"))
+MAP_MAX_RADIUS_METERS = int(os.getenv("MAP_MAX_RADIUS_METERS", "20000"))
+MAP_MAX_POINTS = int(os.getenv("MAP_MAX_POINTS", "1000"))
+
+META_ID = "meta"
+_TILE_PIXELS = 256
+# Web mercator stops here; points beyond it are clamped into the edge cells
+_MAX_LATITUDE = 85.05112878
+
+MAP_PROJECTION = {
+    "_id": 0, "complaint_id": 1, "title": 1, "category": 1, "status": 1, "priority": 1,
+    "ward_number": 1, "location": 1, "created_at": 1
+}
+
+def geo_point(location: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """GeoJSON point for a {latitude, longitude} location, or None if it has none"""
+    if not location or location.get("latitude") is None or location.get("longitude") is None:
+        return None
+    latitude, longitude = float(location["latitude"]), float(location["longitude"])
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+def ensure_indexes():
+    complaints_collection.create_index([("geo", "2dsphere")])
+    map_clusters_collection.create_index([("zoom", ASCENDING), ("x", ASCENDING), ("y", ASCENDING)])
+
+def _cells_per_axis(zoom: int) -> int:
+    return (1 << zoom) * _TILE_PIXELS // CLUSTER_CELL_PIXELS
+
+def cell(latitude: float, longitude: float, zoom: int) -> Tuple[int, int]:
+    """Web-mercator grid cell holding the point at this zoom"""
+    cells = _cells_per_axis(zoom)
+    latitude = max(min(latitude, _MAX_LATITUDE), -_MAX_LATITUDE)
+    x = (longitude + 180) / 360
+    sin_latitude = math.sin(math.radians(latitude))
+    y = 0.5 - math.log((1 + sin_latitude) / (1 - sin_latitude)) / (4 * math.pi)
+    return min(int(x * cells), cells - 1), min(int(y * cells), cells - 1)
+
+def _cluster_id(zoom: int, x: int, y: int) -> str:
+    return f"{zoom}:{x}:{y}"
+
+def _cluster_contributions(complaint: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    if not complaint or not complaint.get("status"):
+        return {}
+    return {f"status.{complaint['status']}": 1}
+
+def _cluster_deltas(changes: List[Tuple[Optional[Dict[str, Any]], Dict[str, Any]]]) -> Dict[Tuple[int, int, int], Dict[str, float]]:
+    deltas = defaultdict(lambda: defaultdict(int))
+    for previous, complaint in changes:
+        point = complaint.get("geo") if complaint else None
+        if not point:
+            continue
+        inc = defaultdict(int)
+        if previous is None:
+            # Newly filed; the coordinate sums give each cluster its centroid
+            longitude, latitude = point["coordinates"]
+            inc.update({"count": 1, "latitude_sum": latitude, "longitude_sum": longitude})
+        for key, value in _cluster_contributions(complaint).items():
+            inc[key] += value
+        for key, value in _cluster_contributions(previous).items():
+            inc[key] -= value
+        inc = {key: value for key, value in inc.items() if value}
+        if not inc:
+            continue
+        longitude, latitude = point["coordinates"]
+        for zoom in range(CLUSTER_MIN_ZOOM, CLUSTER_MAX_ZOOM + 1):
+            x, y = cell(latitude, longitude, zoom)
+            for key, value in inc.items():
+                deltas[(zoom, x, y)][key] += value
+    return deltas
+
+def record_cluster_changes(changes: List[Tuple[Optional[Dict[str, Any]], Dict[str, Any]]], session=None):
+    """Apply (previous, complaint) changes to the map clusters; previous is None for new complaints"""
+    deltas = _cluster_deltas(changes)
+    if not deltas:
+        return
+    map_clusters_collection.bulk_write([
+        UpdateOne(
+            {"_id": _cluster_id(zoom, x, y)},
+            {"$inc": dict(inc), "$setOnInsert": {"zoom": zoom, "x": x, "y": y}},
+            upsert=True
+        )
+        for (zoom, x, y), inc in deltas.items()
+    ], ordered=False, session=session)
+
+def clusters_ready() -> bool:
+    return map_clusters_collection.find_one({"_id": META_ID}, {"_id": 1}) is not None
+
+def rebuild() -> int:
+    """Recompute every cluster from the complaints collection.
+
+    Like the rollups, run it while traffic is quiet; complaints filed meanwhile may be missed.
+    """
+    cursor = complaints_collection.find({"geo": {"$exists": True}}, {"_id": 0, "geo": 1, "status": 1})
+    deltas = _cluster_deltas((None, complaint) for complaint in cursor)
+    map_clusters_collection.delete_many({})
+    documents = [
+        {"_id": _cluster_id(zoom, x, y), "zoom": zoom, "x": x, "y": y,
+         "count": inc.pop("count"), "latitude_sum": inc.pop("latitude_sum"), "longitude_sum": inc.pop("longitude_sum"),
+         "status": {key.split(".", 1)[1]: value for key, value in inc.items()}}
+        for (zoom, x, y), inc in deltas.items()
+    ]
+    for start in range(0, len(documents), 1000):
+        map_clusters_collection.insert_many(documents[start:start + 1000])
+    map_clusters_collection.insert_one({"_id": META_ID, "built_at": datetime.now()})
+    print(f"[Geo] Rebuilt {len(documents)} map clusters")
+    return len(documents)
+
+def backfill() -> int:
+    """Store GeoJSON points for complaints saved with only latitude/longitude"""
+    result = complaints_collection.update_many(
+        {
+            "geo": {"$exists": False},
+            "location.latitude": {"$gte": -90, "$lte": 90},
+            "location.longitude": {"$gte": -180, "$lte": 180}
+        },
+        [{"$set": {"geo": {"type": "Point", "coordinates": ["$location.longitude", "$location.latitude"]}}}]
+    )
+    if result.modified_count:
+        print(f"[Geo] Stored points for {result.modified_count} complaints")
+    return result.modified_count
+
+def _serialize(complaints: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    for complaint in complaints:
+        if isinstance(complaint.get("created_at"), datetime):
+            complaint["created_at"] = complaint["created_at"].isoformat()
+        if "distance_meters" in complaint:
+            complaint["distance_meters"] = round(complaint["distance_meters"], 1)
+    return complaints
+
+def find_near(latitude: float, longitude: float, radius_meters: float, status: Optional[str] = None,
+              limit: int = 100) -> List[Dict[str, Any]]:
+    """Complaints within radius_meters of a point, nearest first"""
+    if radius_meters <= 0 or radius_meters > MAP_MAX_RADIUS_METERS:
+        raise ValueError(f"radius must be between 0 and {MAP_MAX_RADIUS_METERS} meters")
+    point = geo_point({"latitude": latitude, "longitude": longitude})
+    if not point:
+        raise ValueError("Invalid coordinates")
+    near = {
+        "near": point, "key": "geo", "distanceField": "distance_meters",
+        "maxDistance": radius_meters, "spherical": True
+    }
+    if status:
+        near["query"] = {"status": status}
+    pipeline = [{"$geoNear": near}, {"$limit": min(limit, MAP_MAX_POINTS)},
+                {"$project": {**MAP_PROJECTION, "distance_meters": 1}}]
+    return _serialize(list(complaints_collection.aggregate(pipeline)))
+
+def _validate_bbox(south: float, west: float, north: float, east: float):
+    if not (-90 <= south < north <= 90 and -180 <= west < east <= 180):
+        raise ValueError("Bounding box must have south < north and west < east, in degrees")
+
+def find_in_bbox(south: float, west: float, north: float, east: float, status: Optional[str] = None,
+                 limit: int = 500) -> List[Dict[str, Any]]:
+    """Complaints inside a bounding box, newest first"""
+    _validate_bbox(south, west, north, east)
+    query = {"geo": {"$geoWithin": {"$geometry": {"type": "Polygon", "coordinates": [[
+        [west, south], [east, south], [east, north], [west, north], [west, south]
+    ]]}}}}
+    if status:
+        query["status"] = status
+    cursor = complaints_collection.find(query, MAP_PROJECTION).sort("created_at", -1).limit(min(limit, MAP_MAX_POINTS))
+    return _serialize(list(cursor))
+
+def get_clusters(zoom: int, south: float, west: float, north: float, east: float,
+                 status: Optional[str] = None) -> Dict[str, Any]:
+    """Cluster counts covering a bounding box; beyond CLUSTER_MAX_ZOOM the points themselves"""
+    _validate_bbox(south, west, north, east)
+    if zoom < CLUSTER_MIN_ZOOM:
+        zoom = CLUSTER_MIN_ZOOM
+    if zoom > CLUSTER_MAX_ZOOM:
+        return {"zoom": zoom, "clusters": [], "points": find_in_bbox(south, west, north, east, status, MAP_MAX_POINTS)}
+    min_x, min_y = cell(north, west, zoom)
+    max_x, max_y = cell(south, east, zoom)
+    cursor = map_clusters_collection.find(
+        {"zoom": zoom, "x": {"$gte": min_x, "$lte": max_x}, "y": {"$gte": min_y, "$lte": max_y}},
+        {"_id": 0, "count": 1, "status": 1, "latitude_sum": 1, "longitude_sum": 1}
+    )
+    clusters = []
+    for row in cursor:
+        count = row.get("count", 0)
+        matching = row.get("status", {}).get(status, 0) if status else count
+        if not count or not matching:
+            continue
+        clusters.append({
+            "latitude": round(row["latitude_sum"] / count, 6),
+            "longitude": round(row["longitude_sum"] / count, 6),
+            "count": matching,
+            "status": {key: value for key, value in row.get("status", {}).items() if value}
+        })
+    return {"zoom": zoom, "clusters": clusters, "points": []}
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "backfill":
+        print(f"{backfill()} complaints updated")
+    elif command == "rebuild":
+        ensure_indexes()
+        print(f"{rebuild()} clusters")
+    else:
+        print(__doc__)
+        sys.exit(2)
@@ -0,0 +1,371 @@
+"""Embedded fallback storage for when MongoDB is unreachable.
+
+LocalStore is a SQLite database in WAL mode holding a copy of recently read
+documents (attachments left out, at most LOCAL_MIRROR_MAX_DOCUMENTS per
+collection) plus the documents written while MongoDB was down and a journal of
+those writes. FailoverStore sends reads and
+writes to MongoDB while it is up and to LocalStore while it is not, and its
+sync thread replays the journal in batches of idempotent upserts once MongoDB
+answers again. A journaled write that MongoDB rejects is moved to the
+dead_letters table instead of holding up the rest.
+"""
+from pymongo import UpdateOne
+from pymongo.errors import ConnectionFailure, BulkWriteError
+from bson import ObjectId, json_util
+from bson.json_util import JSONOptions, JSONMode
+from typing import List, Dict, Any, Optional, Callable, Tuple
+from datetime import datetime
+import os
+import sqlite3
+import threading
+
+# Local store settings
+LOCAL_STORE_PATH = os.getenv("LOCAL_STORE_PATH", os.path.join(os.path.dirname(__file__), "local_store.db"))
+LOCAL_SYNC_INTERVAL_SECONDS = float(os.getenv("LOCAL_SYNC_INTERVAL_SECONDS", "5"))
+LOCAL_SYNC_BATCH_SIZE = int(os.getenv("LOCAL_SYNC_BATCH_SIZE", "500"))
+LOCAL_MIRROR_READS = os.getenv("LOCAL_MIRROR_READS", "true").lower() == "true"
+LOCAL_MIRROR_MAX_DOCUMENTS = int(os.getenv("LOCAL_MIRROR_MAX_DOCUMENTS", "20000"))
+
+# Field identifying a document in each collection that can fail over
+KEY_FIELDS = {"complaints": "complaint_id", "notifications": "_id", "users": "user_id"}
+
+# Journal operations
+OP_INSERT = "insert"
+OP_SET = "set"
+
+_JSON_OPTIONS = JSONOptions(json_mode=JSONMode.RELAXED, tz_aware=False)
+
+def _encode(document: Dict[str, Any]) -> str:
+    return json_util.dumps(document, json_options=_JSON_OPTIONS)
+
+def _decode(data: str) -> Dict[str, Any]:
+    return json_util.loads(data, json_options=_JSON_OPTIONS)
+
+def _sort_value(document: Dict[str, Any]) -> str:
+    created_at = document.get("created_at")
+    return created_at.isoformat() if isinstance(created_at, datetime) else str(created_at or "")
+
+class LocalStore:
+    """SQLite copy of documents plus the journal of writes awaiting replay"""
+
+    def __init__(self, path: str = LOCAL_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                collection TEXT NOT NULL,
+                key TEXT NOT NULL,
+                created_at TEXT,
+                doc TEXT NOT NULL,
+                PRIMARY KEY (collection, key)
+            );
+            CREATE INDEX IF NOT EXISTS documents_created_at ON documents (collection, created_at);
+            CREATE TABLE IF NOT EXISTS journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                collection TEXT NOT NULL,
+                key TEXT NOT NULL,
+                op TEXT NOT NULL,
+                doc TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                seq INTEGER PRIMARY KEY,
+                collection TEXT NOT NULL,
+                key TEXT NOT NULL,
+                op TEXT NOT NULL,
+                doc TEXT NOT NULL,
+                error TEXT,
+                created_at TEXT NOT NULL
+            );
+        """)
+
+    def _transaction(self, statements: List[Tuple[str, tuple]]):
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                for sql, params in statements:
+                    self._connection.execute(sql, params)
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _put(collection: str, key: str, document: Dict[str, Any]) -> Tuple[str, tuple]:
+        return (
+            "INSERT OR REPLACE INTO documents (collection, key, created_at, doc) VALUES (?, ?, ?, ?)",
+            (collection, key, _sort_value(document), _encode(document))
+        )
+
+    def mirror(self, collection: str, documents: List[Dict[str, Any]]):
+        """Keep a copy of documents read from MongoDB for use while it is down, without attachments"""
+        key_field = KEY_FIELDS[collection]
+        statements = []
+        for document in documents:
+            if document.get(key_field) is None:
+                continue
+            if "attachments" in document:
+                document = {**document, "attachment_count": len(document["attachments"] or [])}
+                del document["attachments"]
+            statements.append(self._put(collection, str(document[key_field]), document))
+        self._transaction(statements)
+
+    def write(self, collection: str, key: str, document: Dict[str, Any], op: str, change: Dict[str, Any]):
+        """Store the document and journal the change in one local transaction"""
+        self._transaction([
+            self._put(collection, key, document),
+            (
+                "INSERT INTO journal (collection, key, op, doc, created_at) VALUES (?, ?, ?, ?, ?)",
+                (collection, key, op, _encode(change), datetime.now().isoformat())
+            )
+        ])
+
+    def get(self, collection: str, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT doc FROM documents WHERE collection = ? AND key = ?", (collection, key)
+            ).fetchone()
+        return _decode(row[0]) if row else None
+
+    def find(self, collection: str, query: Dict[str, Any], limit: int = 0) -> List[Dict[str, Any]]:
+        """Documents matching top-level equality filters, newest first"""
+        sql = "SELECT doc FROM documents WHERE collection = ?"
+        params = [collection]
+        for field, value in query.items():
+            if isinstance(value, (dict, list)):
+                raise ValueError(f"Local store only supports equality filters, got {field}={value!r}")
+            if value is None:
+                sql += " AND json_extract(doc, ?) IS NULL"
+                params.append(f"$.{field}")
+            else:
+                sql += " AND json_extract(doc, ?) = ?"
+                params += [f"$.{field}", value]
+        sql += " ORDER BY created_at DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            rows = self._connection.execute(sql, params).fetchall()
+        return [_decode(row[0]) for row in rows]
+
+    def pending(self, limit: int = LOCAL_SYNC_BATCH_SIZE) -> List[Tuple[int, str, str, str, Dict[str, Any]]]:
+        """Oldest journal entries as (seq, collection, key, op, change)"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT seq, collection, key, op, doc FROM journal ORDER BY seq LIMIT ?", (limit,)
+            ).fetchall()
+        return [(seq, collection, key, op, _decode(doc)) for seq, collection, key, op, doc in rows]
+
+    def acknowledge(self, last_seq: int):
+        """Drop journal entries that reached MongoDB"""
+        with self._lock:
+            self._connection.execute("DELETE FROM journal WHERE seq <= ?", (last_seq,))
+
+    def trim(self, collection: str, keep: int = LOCAL_MIRROR_MAX_DOCUMENTS) -> int:
+        """Drop the oldest mirrored documents beyond `keep`; documents with writes awaiting replay stay"""
+        with self._lock:
+            cursor = self._connection.execute("""
+                DELETE FROM documents WHERE collection = ? AND rowid IN (
+                    SELECT rowid FROM documents WHERE collection = ?
+                    ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                ) AND key NOT IN (SELECT key FROM journal WHERE collection = ?)
+            """, (collection, collection, keep, collection))
+            return cursor.rowcount
+
+    def dead_letter(self, entry: Tuple[int, str, str, str, Dict[str, Any]], error: str):
+        """Set aside a journal entry MongoDB rejected; it is dropped from the journal with its batch"""
+        seq, collection, key, op, change = entry
+        self._transaction([(
+            "INSERT OR REPLACE INTO dead_letters (seq, collection, key, op, doc, error, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (seq, collection, key, op, _encode(change), error, datetime.now().isoformat())
+        )])
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+
+class FailoverStore:
+    """Routes reads and writes to MongoDB or, while it is unreachable, to the local store"""
+
+    def __init__(self, client, db, local: LocalStore, available: bool = True):
+        self.client = client
+        self.db = db
+        self.local = local
+        self._available = available and local.pending_count() == 0
+        self._hooks: Dict[Tuple[str, str], Callable[[List[Dict[str, Any]]], None]] = {}
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def available(self) -> bool:
+        """False while MongoDB is down or journaled writes are still being replayed"""
+        return self._available
+
+    def mark_down(self, error: Exception):
+        if self._available:
+            print(f"[LocalStore] WARNING: MongoDB unreachable, serving from {self.local.path}: {type(error).__name__}: {str(error)}")
+        self._available = False
+        self._wakeup.set()
+
+    def register_replay_hook(self, collection: str, op: str, hook: Callable[[List[Dict[str, Any]]], None]):
+        """Call hook with the documents a replay created in MongoDB, e.g. to count them or notify"""
+        self._hooks[(collection, op)] = hook
+
+    # ------------------------------------------------------------------
+    # Reads and writes
+    # ------------------------------------------------------------------
+
+    def find(self, collection: str, query: Dict[str, Any], mongo_read: Callable[[], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Run mongo_read, or answer the same equality query from the local copy"""
+        if self._available:
+            try:
+                documents = mongo_read()
+                if LOCAL_MIRROR_READS:
+                    self._mirror(collection, documents)
+                return documents
+            except ConnectionFailure as e:
+                self.mark_down(e)
+        documents = self.local.find(collection, query)
+        for document in documents:
+            document["_id"] = str(document["_id"])
+        return documents
+
+    def find_one(self, collection: str, key: str, mongo_read: Callable[[], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        if self._available:
+            try:
+                document = mongo_read()
+                if document and LOCAL_MIRROR_READS:
+                    self._mirror(collection, [document])
+                return document
+            except ConnectionFailure as e:
+                self.mark_down(e)
+        document = self.local.get(collection, key)
+        if document:
+            document["_id"] = str(document["_id"])
+        return document
+
+    def _mirror(self, collection: str, documents: List[Dict[str, Any]]):
+        try:
+            self.local.mirror(collection, documents)
+        except sqlite3.Error as e:
+            print(f"[LocalStore] WARNING: Could not mirror {collection}: {type(e).__name__}: {str(e)}")
+
+    def insert_local(self, collection: str, document: Dict[str, Any]) -> str:
+        """Keep a new document locally until MongoDB is back; returns its _id"""
+        document.setdefault("_id", ObjectId())
+        key = str(document[KEY_FIELDS[collection]])
+        self.local.write(collection, key, document, OP_INSERT, document)
+        return str(document["_id"])
+
+    def set_local(self, collection: str, key: str, fields: Dict[str, Any], on_insert: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Apply a $set (with upsert) to the local copy and journal it; returns the merged document"""
+        document = self.local.get(collection, key)
+        if document is None:
+            document = {"_id": ObjectId(), KEY_FIELDS[collection]: key, **(on_insert or {})}
+        document.update(fields)
+        self.local.write(collection, key, document, OP_SET, {"fields": fields, "on_insert": on_insert or {}})
+        return document
+
+    # ------------------------------------------------------------------
+    # Replay
+    # ------------------------------------------------------------------
+
+    def _replay_run(self, collection: str, entries: List[Tuple[int, str, str, str, Dict[str, Any]]]):
+        key_field = KEY_FIELDS[collection]
+        while entries:
+            operations = []
+            for _, _, key, op, change in entries:
+                if op == OP_INSERT:
+                    # Inserting only if absent makes a repeated replay a no-op
+                    operations.append(UpdateOne({key_field: change[key_field]}, {"$setOnInsert": change}, upsert=True))
+                else:
+                    update = {"$set": change["fields"]}
+                    on_insert = {k: v for k, v in change["on_insert"].items() if k not in change["fields"]}
+                    if on_insert:
+                        update["$setOnInsert"] = on_insert
+                    operations.append(UpdateOne({key_field: key}, update, upsert=True))
+            try:
+                result = self.db[collection].bulk_write(operations, ordered=True)
+            except BulkWriteError as e:
+                # Writes before the rejected one were applied and the rest were not attempted
+                error = e.details["writeErrors"][0]
+                failed = error["index"]
+                upserted = [upsert["index"] for upsert in e.details.get("upserted", [])]
+                self._replayed(collection, entries[:failed], upserted)
+                self.local.dead_letter(entries[failed], error.get("errmsg"))
+                print(f"[LocalStore] WARNING: MongoDB rejected journaled {entries[failed][3]} of {collection} "
+                      f"{entries[failed][2]}, moved to dead letters: {error.get('errmsg')}")
+                entries = entries[failed + 1:]
+                continue
+            self._replayed(collection, entries, list(result.upserted_ids))
+            return
+
+    def _replayed(self, collection: str, entries: List[Tuple[int, str, str, str, Dict[str, Any]]], upserted: List[int]):
+        created = [entries[index][4] for index in upserted if entries[index][3] == OP_INSERT]
+        updated = [entry[4] for entry in entries if entry[3] == OP_SET]
+        for op, documents in ((OP_INSERT, created), (OP_SET, updated)):
+            hook = self._hooks.get((collection, op))
+            if hook and documents:
+                try:
+                    hook(documents)
+                except Exception as e:
+                    print(f"[LocalStore] WARNING: Replay hook for {collection} failed: {type(e).__name__}: {str(e)}")
+
+    def replay(self) -> int:
+        """Push journaled writes to MongoDB in batches. Returns how many were replayed."""
+        replayed = 0
+        while True:
+            entries = self.local.pending()
+            if not entries:
+                return replayed
+            # Consecutive entries for the same collection go out as one ordered bulk write
+            run = [entries[0]]
+            for entry in entries[1:]:
+                if entry[1] != run[0][1]:
+                    self._replay_run(run[0][1], run)
+                    run = []
+                run.append(entry)
+            self._replay_run(run[0][1], run)
+            self.local.acknowledge(entries[-1][0])
+            replayed += len(entries)
+            print(f"[LocalStore] Replayed {replayed} journaled writes to MongoDB")
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="local-store-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(5)
+        self._thread = None
+
+    def _trim(self):
+        for collection in KEY_FIELDS:
+            try:
+                self.local.trim(collection)
+            except sqlite3.Error as e:
+                print(f"[LocalStore] WARNING: Could not trim {collection}: {type(e).__name__}: {str(e)}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._available and LOCAL_MIRROR_READS:
+                self._trim()
+            if not self._available:
+                try:
+                    self.client.admin.command("ping")
+                    self.replay()
+                    self._available = True
+                    print(f"[LocalStore] MongoDB reachable again, local journal drained")
+                except ConnectionFailure as e:
+                    print(f"[LocalStore] MongoDB still unavailable: {type(e).__name__}: {str(e)}")
+                except Exception as e:
+                    print(f"[LocalStore] ERROR: Replaying the local journal failed: {type(e).__name__}: {str(e)}")
+            self._wakeup.wait(LOCAL_SYNC_INTERVAL_SECONDS)
+            self._wakeup.clear()
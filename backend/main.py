@@ -3,31 +3,50 @@ from datetime import datetime
 import json
 from fastapi import FastAPI, HTTPException, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response
+from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
 from datetime import datetime
+import asyncio
 import joblib
 import os
 import numpy as np
 import requests
+import threading
 import time
 from hotspots import HOTSPOTS
 from wards import WARDS, LANDMARKS
-from crowdsource import generate_crowdsource_reports
-from preparedness import calculate_ward_preparedness
+from crowdsource import generate_crowdsource_reports, store as crowd_store, CROWDSOURCE_DEMO, CROWD_MAX_RESULTS
+from fusion import fusion as risk_fusion
+from rainfall import feed as rainfall_feed
+from pubsub import broker as event_broker, publish
+from versioning import select as select_changes, ward_risk_states, hotspot_risk_states
+from ward_assets import store as ward_asset_store, WARD_HOTSPOTS, AssetConflictError
 
 # Import complaint and notification modules
-from complaints import ComplaintCreate, ComplaintUpdate, ComplaintRating, ComplaintStatus
+from complaints import ComplaintCreate, ComplaintUpdate, ComplaintRating, ComplaintStatus, ComplaintBulkRequest
 from complaints_db import (
     file_complaint, assign_complaint, update_complaint_status,
     add_timeline_entry, resolve_complaint, rate_complaint,
     get_complaints_by_user, get_complaints_by_ward, track_complaint,
-    get_all_complaints, get_complaint_by_id
+    get_all_complaints, get_complaint_by_id, bulk_update_complaints, get_complaint_timeline,
+    get_duplicates, unlink_duplicate
 )
-from notifications import create_ward_broadcast, get_user_notifications, get_ward_notifications
-from models import UserModel, NotificationModel
+from notifications import create_ward_broadcast, get_user_notifications, get_user_inbox, get_ward_notifications, get_broadcast_delivery, prepare_push_recipients, prepare_inbox
+from models import UserModel, NotificationModel, InboxModel, EmergencyContactModel, ComplaintModel, TimelineModel, WardAssetModel, store as failover_store
+from timeline import migrate as migrate_timelines
 from admin import get_admin_dashboard_stats, get_recent_complaints
+from outbox import dispatcher as outbox_dispatcher
+from notification_archive import archiver as notification_archiver, find_archived as find_archived_notifications
+from rollups import get_trends, rollups_ready, rebuild as rebuild_rollups, ensure_indexes as ensure_rollup_indexes
+from sos import engine as sos_engine, dispatch_sos, get_sos_job
+from sla import tracker as sla_tracker, get_overdue_complaints
+from complaint_io import build_export_query, iter_export, EXPORT_FORMATS
+from search import search_complaints, ensure_text_index
+from dedup import index as duplicate_index
+import geo
+from thumbnails import get_thumbnail, is_valid_size, THUMBNAIL_DEFAULT_SIZE, THUMBNAIL_SIZES, THUMBNAIL_CACHE_CONTROL
 
 app = FastAPI(title="FloodWatch Delhi API")
 
@@ -39,6 +58,53 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def bind_event_broker():
+    # Events published from worker threads are delivered on the server's loop
+    event_broker.bind(asyncio.get_running_loop())
+
+@app.on_event("startup")
+def start_background_workers():
+    outbox_dispatcher.start()
+    sos_engine.start()
+    threading.Thread(target=prepare_push_recipients, name="push-recipients", daemon=True).start()
+    threading.Thread(target=prepare_inbox, name="notification-inbox", daemon=True).start()
+    threading.Thread(target=prepare_complaint_indexes, name="complaint-indexes", daemon=True).start()
+    sla_tracker.start()
+    failover_store.start()
+    crowd_store.start()
+    ward_asset_store.start()
+    notification_archiver.start()
+    rainfall_feed.start_replay()
+
+def prepare_complaint_indexes():
+    try:
+        ComplaintModel.ensure_indexes()
+        ensure_rollup_indexes()
+        TimelineModel.ensure_indexes()
+        ensure_text_index()
+        duplicate_index.load()
+        geo.ensure_indexes()
+        geo.backfill()
+        # Build rollups and map clusters once for complaints filed before they were maintained
+        if not rollups_ready():
+            rebuild_rollups()
+        if not geo.clusters_ready():
+            geo.rebuild()
+        migrate_timelines()
+    except Exception as e:
+        print(f"[ComplaintModel] WARNING: Could not prepare indexes and rollups: {type(e).__name__}: {str(e)}")
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    outbox_dispatcher.stop()
+    sos_engine.stop()
+    sla_tracker.stop()
+    failover_store.stop()
+    crowd_store.stop()
+    ward_asset_store.stop()
+    notification_archiver.stop()
+
 model = None
 model_path = "flood_model.pkl"
 
@@ -59,9 +125,31 @@ class HotspotPrediction(BaseModel):
     lng: float
     risk_level: int
     probability: float
+    model_risk_level: Optional[int] = None
+    model_probability: Optional[float] = None
+    crowd_risk: float = 0.0
+    crowd_reports: float = 0.0
 
 class PredictionResponse(BaseModel):
     hotspots: List[HotspotPrediction]
+    version: Optional[int] = None
+    full: bool = True
+
+class RainfallReading(BaseModel):
+    station_id: str = Field(..., min_length=1, max_length=64)
+    lat: float = Field(..., ge=-90, le=90)
+    lng: float = Field(..., ge=-180, le=180)
+    intensity: float = Field(..., ge=0, le=500)
+    timestamp: Optional[float] = None
+
+def _list_length(min_length: int, max_length: int) -> dict:
+    """Field arguments bounding a list's length, named as the installed Pydantic expects"""
+    if hasattr(BaseModel, "model_dump"):
+        return {"min_length": min_length, "max_length": max_length}  # Pydantic v2
+    return {"min_items": min_length, "max_items": max_length}  # Pydantic v1
+
+class RainfallBatch(BaseModel):
+    readings: List[RainfallReading] = Field(..., **_list_length(1, 5000))
 
 class RouteRequest(BaseModel):
     start: str
@@ -83,12 +171,37 @@ class WardResponse(BaseModel):
     drains_desilted: bool
     emergency_contacts: int
 
+class WardAssetUpdate(BaseModel):
+    pumps_delta: int = Field(0, ge=-100, le=100)
+    pumps_available: Optional[int] = Field(None, ge=0)
+    pumps_total: Optional[int] = Field(None, ge=0)
+    drains_desilted: Optional[bool] = None
+    expected_version: Optional[int] = None
+    note: Optional[str] = Field(None, max_length=280)
+
 class CrowdsourceResponse(BaseModel):
     reports: List[Dict]
 
+class CrowdsourceReportCreate(BaseModel):
+    lat: float = Field(..., ge=-90, le=90)
+    lng: float = Field(..., ge=-180, le=180)
+    depth_cm: float = Field(..., ge=0, le=500)
+    message: Optional[str] = Field(None, max_length=280)
+    timestamp: Optional[float] = None
+
 class SOSRequest(BaseModel):
     ward_id: str
     message: str
+    ward_number: Optional[int] = None
+
+class EmergencyContact(BaseModel):
+    channel: str
+    address: str
+    name: Optional[str] = None
+
+class EmergencyContactsRequest(BaseModel):
+    ward_id: str
+    contacts: List[EmergencyContact]
 
 def predict_risk_dummy(rainfall: float, elevation: float, drainage_score: float) -> tuple:
     risk_score = 0.0
@@ -122,12 +235,48 @@ def predict_risk_dummy(rainfall: float, elevation: float, drainage_score: float)
     
     return risk_level, probability
 
+def predict_risk_batch(rows: List[tuple]) -> List[tuple]:
+    """(risk_level, probability) for many (rainfall, elevation, drainage_score) rows in one model call"""
+    if model is not None:
+        try:
+            features = np.array(rows)
+            levels = model.predict(features)
+            probabilities = model.predict_proba(features)
+            return [(int(level), float(probability[level])) for level, probability in zip(levels, probabilities)]
+        except Exception as e:
+            print(f"Model prediction error: {e}. Using dummy logic.")
+    return [predict_risk_dummy(*row) for row in rows]
+
+rainfall_feed.predict = predict_risk_batch
+
+def _publish_crowd_report(report: dict):
+    publish("crowd", "crowd_report", {key: value for key, value in report.items() if key != "reported_by"})
+
+def _publish_risk_change(hotspot_id: int, previous_level: int, risk: dict):
+    publish("risk", "risk_level", {
+        "hotspot_id": hotspot_id, "previous_level": previous_level,
+        "risk_level": risk["risk_level"], "probability": risk["probability"]
+    })
+
+def _publish_ward_assets(ward_id: str, assets: dict):
+    # Map wards are keyed by WARD_xxx id like /wards/risk; ward:<n> topics carry ward numbers only
+    publish("risk", "ward_assets", {
+        "ward_id": ward_id, **{key: assets[key] for key in ("pumps_available", "pumps_total", "drains_desilted", "version")}
+    })
+
+crowd_store.add_listener(_publish_crowd_report)
+rainfall_feed.add_listener(_publish_risk_change)
+ward_asset_store.add_listener(_publish_ward_assets)
+
 @app.get("/")
 def read_root():
     return {"message": "FloodWatch Delhi API", "status": "running"}
 
+def _not_modified(version: int) -> Response:
+    return Response(status_code=304, headers={"X-State-Version": str(version)})
+
 @app.post("/predict", response_model=PredictionResponse)
-def predict_flood_risk(request: PredictionRequest):
+def predict_flood_risk(request: PredictionRequest, since: Optional[int] = Query(None)):
     rainfall = request.rainfall_intensity
     predictions = []
     
@@ -152,11 +301,63 @@ def predict_flood_risk(request: PredictionRequest):
             "name": hotspot["name"],
             "lat": hotspot["lat"],
             "lng": hotspot["lng"],
-            "risk_level": int(risk_level),
-            "probability": float(probability)
+            "model_risk_level": int(risk_level),
+            "model_probability": float(probability),
+            # Recent crowd reports around the hotspot can raise the model's risk
+            **risk_fusion.fuse("hotspot", hotspot["id"], int(risk_level), float(probability))
         })
     
-    return PredictionResponse(hotspots=predictions)
+    # With `since`, only hotspots whose risk level changed after that version are sent
+    version, full, changed = select_changes(hotspot_risk_states, round(rainfall, 1), predictions, "id", since)
+    if changed is None:
+        return _not_modified(version)
+    return PredictionResponse(hotspots=changed, version=version, full=full)
+
+@app.post("/rainfall/readings")
+def ingest_rainfall(batch: RainfallBatch):
+    """Accept station or grid-cell rainfall intensities (mm/hr) and update the affected hotspot risk"""
+    return rainfall_feed.ingest([
+        reading.model_dump() if hasattr(reading, "model_dump") else reading.dict() for reading in batch.readings
+    ])
+
+@app.get("/risk/current")
+def get_current_risk():
+    """Risk from the live rainfall feed, raised by recent crowd reports"""
+    state = rainfall_feed.current()
+    for hotspot in state["hotspots"]:
+        hotspot.update(risk_fusion.fuse("hotspot", hotspot["id"], hotspot["risk_level"], hotspot["probability"]))
+    levels = {hotspot["id"]: hotspot["risk_level"] for hotspot in state["hotspots"]}
+    for ward in state["wards"]:
+        level = max((levels[hotspot_id] for hotspot_id in WARD_HOTSPOTS[ward["ward_id"]]), default=0)
+        ward.update(risk_fusion.fuse("ward", ward["ward_id"], level))
+    return state
+
+STREAM_TOPICS = {"risk", "crowd"}
+
+@app.get("/api/stream")
+async def stream_events(
+    topics: str = Query("risk"),
+    ward: Optional[List[int]] = Query(None),
+    user_id: Optional[str] = Query(None)
+):
+    """Server-Sent Events for the requested topics, ward numbers and user"""
+    requested = {topic.strip() for topic in topics.split(",") if topic.strip()}
+    unknown = requested - STREAM_TOPICS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown topics {sorted(unknown)}; use {sorted(STREAM_TOPICS)}, ward or user_id")
+    # EventSource cannot send headers, so the user is identified by a query parameter
+    requested |= {f"ward:{value}" for value in ward or []}
+    if user_id:
+        requested.add(f"user:{user_id}")
+    try:
+        subscription = event_broker.subscribe(requested)
+    except OverflowError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return StreamingResponse(
+        event_broker.stream(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.get("/hotspots")
 def get_hotspots():
@@ -207,10 +408,51 @@ def calculate_route(request: RouteRequest):
 
 @app.get("/wards", response_model=List[WardResponse])
 def get_wards():
-    return [WardResponse(**ward) for ward in WARDS]
+    wards = []
+    for ward in WARDS:
+        # Live pump and drain counts; preparedness_score stays the surveyed score from wards.py
+        assets = ward_asset_store.get(ward["id"])
+        wards.append(WardResponse(**{
+            **ward, **{key: assets[key] for key in ("pumps_available", "pumps_total", "drains_desilted")}
+        }))
+    return wards
+
+@app.get("/wards/{ward_id}/assets")
+def get_ward_assets(ward_id: str):
+    """A ward's live pumps and drains, its preparedness and the field reports behind them"""
+    assets = ward_asset_store.get(ward_id)
+    if not assets:
+        raise HTTPException(status_code=404, detail="Ward not found")
+    return {
+        "ward_id": ward_id, **assets,
+        "preparedness": ward_asset_store.preparedness(ward_id, 0),
+        "preparedness_at_risk": ward_asset_store.preparedness(ward_id, 1),
+        "recent_updates": WardAssetModel.find_events(ward_id)
+    }
+
+@app.put("/wards/{ward_id}/assets")
+def update_ward_assets(
+    ward_id: str,
+    update: WardAssetUpdate,
+    role: str = Header(..., alias="X-User-Role"),
+    user_id: Optional[str] = Header(None, alias="X-User-ID")
+):
+    """Record pumps deployed or failed and drains desilted by a field team"""
+    if role not in ["ward_admin", "admin"]:
+        raise HTTPException(status_code=403, detail="Only ward admins can update ward assets")
+    try:
+        fields = update.model_dump() if hasattr(update, "model_dump") else update.dict()
+        assets = ward_asset_store.update(ward_id, reported_by=user_id, **fields)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Ward not found")
+    except AssetConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "ward_id": ward_id, **assets, "preparedness": ward_asset_store.preparedness(ward_id, 0)}
 
 @app.get("/wards/risk")
-def get_ward_risks(rainfall_intensity: float = 50.0):
+def get_ward_risks(rainfall_intensity: float = 50.0, since: Optional[int] = Query(None)):
     predictions = []
     for hotspot in HOTSPOTS:
         elevation = hotspot["elevation"]
@@ -230,16 +472,13 @@ def get_ward_risks(rainfall_intensity: float = 50.0):
             "name": hotspot["name"],
             "lat": hotspot["lat"],
             "lng": hotspot["lng"],
-            "risk_level": int(risk_level)
+            "risk_level": risk_fusion.fuse("hotspot", hotspot["id"], int(risk_level))["risk_level"]
         })
     
+    predictions_by_id = {pred["id"]: pred for pred in predictions}
     ward_risks = []
     for ward in WARDS:
-        ward_hotspots = []
-        for pred in predictions:
-            if (ward["bounds"][0][0] <= pred["lat"] <= ward["bounds"][2][0] and
-                ward["bounds"][0][1] <= pred["lng"] <= ward["bounds"][2][1]):
-                ward_hotspots.append(pred)
+        ward_hotspots = [predictions_by_id[hotspot_id] for hotspot_id in WARD_HOTSPOTS[ward["id"]]]
         
         critical_count = sum(1 for h in ward_hotspots if h["risk_level"] == 2)
         warning_count = sum(1 for h in ward_hotspots if h["risk_level"] == 1)
@@ -253,14 +492,20 @@ def get_ward_risks(rainfall_intensity: float = 50.0):
             ward_risk_level = 1
         else:
             ward_risk_level = 0
+        # Reports anywhere in the ward count too, not only those near a hotspot
+        ward_crowd = risk_fusion.fuse("ward", ward["id"], ward_risk_level)
         
         max_risk_in_ward = max([h["risk_level"] for h in ward_hotspots], default=0)
-        preparedness = calculate_ward_preparedness(ward, ward_hotspots)
+        # Recomputed only when the ward's assets change
+        preparedness = ward_asset_store.preparedness(ward["id"], max_risk_in_ward)
+        assets = ward_asset_store.get(ward["id"])
         
         ward_risks.append({
             "ward_id": ward["id"],
             "ward_name": ward["name"],
-            "risk_level": ward_risk_level,
+            "risk_level": ward_crowd["risk_level"],
+            "crowd_risk": ward_crowd["crowd_risk"],
+            "crowd_reports": ward_crowd["crowd_reports"],
             "critical_hotspots": critical_count,
             "warning_hotspots": warning_count,
             "safe_hotspots": safe_count,
@@ -269,36 +514,91 @@ def get_ward_risks(rainfall_intensity: float = 50.0):
             "preparedness_level": preparedness["level"],
             "has_preparedness_gap": preparedness["has_gap"],
             "preparedness_gap_message": preparedness["gap_message"],
-            "pumps_available": ward["pumps_available"],
-            "pumps_total": ward["pumps_total"],
-            "drains_desilted": ward["drains_desilted"]
+            "pumps_available": assets["pumps_available"],
+            "pumps_total": assets["pumps_total"],
+            "drains_desilted": assets["drains_desilted"]
         })
     
-    return {"ward_risks": ward_risks}
+    version, full, changed = select_changes(ward_risk_states, round(rainfall_intensity, 1), ward_risks, "ward_id", since)
+    if changed is None:
+        return _not_modified(version)
+    return {"ward_risks": changed, "version": version, "full": full}
 
 @app.get("/crowdsource")
-def get_crowdsource_reports(rainfall_intensity: float = 50.0):
-    reports = generate_crowdsource_reports(rainfall_intensity, HOTSPOTS)
+def get_crowdsource_reports(
+    rainfall_intensity: float = 50.0,
+    south: Optional[float] = None,
+    west: Optional[float] = None,
+    north: Optional[float] = None,
+    east: Optional[float] = None,
+    minutes: int = Query(60, ge=1),
+    limit: int = Query(500, ge=1, le=CROWD_MAX_RESULTS)
+):
+    # Who filed a report is kept for moderation, not published
+    reports = [
+        {key: value for key, value in report.items() if key != "reported_by"}
+        for report in crowd_store.query(south, west, north, east, minutes, limit)
+    ]
+    if not reports and CROWDSOURCE_DEMO and not len(crowd_store):
+        reports = generate_crowdsource_reports(rainfall_intensity, HOTSPOTS)
     return CrowdsourceResponse(reports=reports)
 
+@app.post("/crowdsource", status_code=201)
+async def submit_crowdsource_report(
+    report: CrowdsourceReportCreate,
+    user_id: Optional[str] = Header(None, alias="X-User-ID")
+):
+    """Record a citizen water-depth report; it is served for CROWD_TTL_MINUTES"""
+    try:
+        return crowd_store.add(report.lat, report.lng, report.depth_cm, report.message, user_id, report.timestamp)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/sos/broadcast")
 def broadcast_sos(request: SOSRequest):
     ward = next((w for w in WARDS if w["id"] == request.ward_id), None)
     if not ward:
         raise HTTPException(status_code=404, detail="Ward not found")
     
-    contacts_count = ward["emergency_contacts"]
+    job = dispatch_sos(ward["id"], request.message, request.ward_number)
+    alert = {"ward_id": ward["id"], "message": request.message, "job_id": job["job_id"]}
+    publish("risk", "sos", alert)
+    if request.ward_number is not None:
+        publish(f"ward:{request.ward_number}", "sos", alert)
+    # Recipients are counted up front; the fan-out itself continues in the background
+    recipients = job["recipients"]
     
     return {
         "success": True,
+        "job_id": job["job_id"],
+        "status": job["status"],
         "message": request.message,
         "ward": ward["name"],
-        "sms_sent": contacts_count,
-        "whatsapp_groups_notified": 15,
-        "residents_notified": contacts_count,
+        "channels": recipients,
+        "sms_sent": recipients.get("sms", 0),
+        "whatsapp_groups_notified": recipients.get("whatsapp", 0),
+        "residents_notified": sum(recipients.values()),
         "timestamp": int(time.time())
     }
 
+@app.get("/sos/jobs/{job_id}")
+def get_sos_job_progress(job_id: str):
+    job = get_sos_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="SOS job not found")
+    return job
+
+@app.post("/sos/contacts")
+def register_emergency_contacts(request: EmergencyContactsRequest):
+    if not any(w["id"] == request.ward_id for w in WARDS):
+        raise HTTPException(status_code=404, detail="Ward not found")
+    contacts = [c.model_dump() if hasattr(c, "model_dump") else c.dict() for c in request.contacts]
+    invalid = [c["channel"] for c in contacts if c["channel"] not in ("sms", "whatsapp")]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Unsupported channels: {sorted(set(invalid))}")
+    updated = EmergencyContactModel.upsert_many(request.ward_id, contacts)
+    return {"success": True, "updated": updated, "contacts": EmergencyContactModel.count_by_ward(request.ward_id)}
+
 # ============================================================================
 # COMPLAINT API ENDPOINTS
 # ============================================================================
@@ -354,6 +654,112 @@ async def list_complaints(
             )
         raise HTTPException(status_code=500, detail=f"Error fetching complaints: {error_msg}")
 
+@app.post("/api/complaints/bulk")
+async def bulk_update_complaints_endpoint(
+    request: ComplaintBulkRequest,
+    role: str = Header(..., alias="X-User-Role"),
+    updated_by: str = Header(..., alias="X-User-ID")
+):
+    """Assign, update status or resolve many complaints at once"""
+    if role not in ["ward_admin", "admin"]:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    try:
+        return await run_in_threadpool(bulk_update_complaints, request.operations, updated_by)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/complaints/search")
+async def search_complaints_endpoint(
+    q: str = Query(..., min_length=1, max_length=200),
+    ward_number: Optional[int] = Query(None),
+    status: Optional[str] = Query(None),
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    role: str = Header(..., alias="X-User-Role")
+):
+    """Search complaint titles, descriptions and categories, most relevant first"""
+    if role not in ["ward_admin", "admin"]:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    try:
+        return await run_in_threadpool(search_complaints, q, ward_number, status, since, until, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching complaints: {str(e)}")
+
+@app.get("/api/complaints/near")
+async def get_complaints_near(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    radius: float = Query(1000, gt=0, le=geo.MAP_MAX_RADIUS_METERS),
+    status: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=geo.MAP_MAX_POINTS)
+):
+    """Complaints within `radius` meters of a point, nearest first"""
+    try:
+        complaints = await run_in_threadpool(geo.find_near, latitude, longitude, radius, status, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"complaints": complaints, "count": len(complaints)}
+
+@app.get("/api/complaints/bbox")
+async def get_complaints_in_bbox(
+    south: float = Query(...),
+    west: float = Query(...),
+    north: float = Query(...),
+    east: float = Query(...),
+    status: Optional[str] = Query(None),
+    limit: int = Query(500, ge=1, le=geo.MAP_MAX_POINTS)
+):
+    """Complaints inside a map viewport, newest first"""
+    try:
+        complaints = await run_in_threadpool(geo.find_in_bbox, south, west, north, east, status, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"complaints": complaints, "count": len(complaints)}
+
+@app.get("/api/complaints/clusters")
+async def get_complaint_clusters(
+    zoom: int = Query(..., ge=0, le=22),
+    south: float = Query(...),
+    west: float = Query(...),
+    north: float = Query(...),
+    east: float = Query(...),
+    status: Optional[str] = Query(None)
+):
+    """Complaint counts per map cluster for a viewport, or the complaints themselves when zoomed in"""
+    try:
+        return await run_in_threadpool(geo.get_clusters, zoom, south, west, north, east, status)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/complaints/export")
+async def export_complaints(
+    format: str = Query("ndjson"),
+    ward_number: Optional[int] = Query(None),
+    status: Optional[str] = Query(None),
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    include_attachments: bool = Query(False),
+    role: str = Header(..., alias="X-User-Role")
+):
+    """Stream complaints as NDJSON or CSV"""
+    if role not in ["ward_admin", "admin"]:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format must be one of {list(EXPORT_FORMATS)}")
+    query = build_export_query(ward_number, status, since, until)
+    filename = f"complaints-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{format}"
+    return StreamingResponse(
+        iter_export(query, format, include_attachments),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @app.get("/api/complaints/{complaint_id}")
 async def get_complaint(complaint_id: str):
     """Get complaint details"""
@@ -362,6 +768,66 @@ async def get_complaint(complaint_id: str):
         raise HTTPException(status_code=404, detail="Complaint not found")
     return complaint
 
+@app.get("/api/complaints/{complaint_id}/timeline")
+async def get_complaint_timeline_page(
+    complaint_id: str,
+    before: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100)
+):
+    """Page through a complaint's full timeline, newest first"""
+    try:
+        page = await run_in_threadpool(get_complaint_timeline, complaint_id, before, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not page:
+        raise HTTPException(status_code=404, detail="Complaint not found")
+    return page
+
+@app.get("/api/complaints/{complaint_id}/duplicates")
+async def get_complaint_duplicates(
+    complaint_id: str,
+    role: str = Header(..., alias="X-User-Role")
+):
+    """Complaints linked as duplicates of this one"""
+    if role not in ["ward_admin", "admin"]:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return await run_in_threadpool(get_duplicates, complaint_id)
+
+@app.put("/api/complaints/{complaint_id}/unlink")
+async def unlink_duplicate_endpoint(
+    complaint_id: str,
+    role: str = Header(..., alias="X-User-Role"),
+    updated_by: str = Header(..., alias="X-User-ID")
+):
+    """Treat a complaint wrongly linked as a duplicate as an original again"""
+    if role not in ["ward_admin", "admin"]:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    try:
+        return await run_in_threadpool(unlink_duplicate, complaint_id, updated_by)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/complaints/{complaint_id}/thumbnails/{index}")
+async def get_complaint_thumbnail(
+    complaint_id: str,
+    index: int,
+    size: int = Query(THUMBNAIL_DEFAULT_SIZE)
+):
+    """Serve a cached attachment thumbnail"""
+    if not is_valid_size(size):
+        raise HTTPException(status_code=400, detail=f"Size must be one of {THUMBNAIL_SIZES}")
+    try:
+        path = get_thumbnail(complaint_id, index, size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Attachment could not be decoded")
+    if not path:
+        raise HTTPException(status_code=404, detail="Thumbnail not ready")
+    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": THUMBNAIL_CACHE_CONTROL})
+
 @app.get("/api/complaints/track/{complaint_id}")
 async def track_complaint_public(complaint_id: str):
     """Public complaint tracking"""
@@ -505,6 +971,23 @@ async def get_notifications(
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/api/notifications/inbox")
+async def get_notification_inbox(
+    user_id: str = Header(..., alias="X-User-ID"),
+    before: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100)
+):
+    """Personal notifications and ward broadcasts in one list, paged with `next_cursor`"""
+    try:
+        return await run_in_threadpool(get_user_inbox, user_id, before, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/notifications/unread-count")
+async def get_unread_notification_count(user_id: str = Header(..., alias="X-User-ID")):
+    """Unread badge count, kept up to date as notifications are created and read"""
+    return {"unread": await run_in_threadpool(InboxModel.unread_count, user_id)}
+
 @app.get("/api/notifications/ward/{ward_number}")
 async def get_ward_notifications_endpoint(ward_number: int):
     """Get ward broadcast notifications"""
@@ -514,6 +997,14 @@ async def get_ward_notifications_endpoint(ward_number: int):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/api/notifications/{notification_id}/delivery")
+async def get_notification_delivery(notification_id: str):
+    """Get push fan-out progress of a broadcast"""
+    delivery = get_broadcast_delivery(notification_id)
+    if delivery is None:
+        raise HTTPException(status_code=404, detail="Notification not found")
+    return delivery
+
 @app.put("/api/notifications/{notification_id}/read")
 async def mark_notification_read(
     notification_id: str,
@@ -521,7 +1012,7 @@ async def mark_notification_read(
 ):
     """Mark notification as read"""
     try:
-        success = NotificationModel.mark_as_read(notification_id)
+        success = NotificationModel.mark_as_read(notification_id, user_id)
         if not success:
             raise HTTPException(status_code=404, detail="Notification not found")
         return {"success": True}
@@ -609,20 +1100,58 @@ async def get_admin_dashboard(
     
     try:
         if role == "ward_admin" and not ward_number:
-            user = UserModel.find_by_id(user_id)
+            user = await run_in_threadpool(UserModel.find_by_id, user_id)
             if user and user.get("ward_number"):
                 ward_number = user.get("ward_number")
         
-        stats = get_admin_dashboard_stats(ward_number)
-        recent_complaints = get_recent_complaints(ward_number, limit=10)
+        # The queries are independent, so run them concurrently
+        stats, recent_complaints, overdue_complaints = await asyncio.gather(
+            run_in_threadpool(get_admin_dashboard_stats, ward_number),
+            run_in_threadpool(get_recent_complaints, ward_number, 10),
+            run_in_threadpool(get_overdue_complaints, ward_number, 10)
+        )
         
         return {
             "stats": stats,
-            "recent_complaints": recent_complaints
+            "recent_complaints": recent_complaints,
+            "overdue_complaints": overdue_complaints
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/api/admin/trends")
+async def get_admin_trends(
+    ward_number: Optional[int] = Query(None),
+    granularity: str = Query("hour"),
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    role: str = Header(..., alias="X-User-Role")
+):
+    """Complaint counts per hour or day for dashboard charts"""
+    if role not in ["ward_admin", "admin"]:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    try:
+        return {"granularity": granularity, "trends": get_trends(ward_number, granularity, since, until)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/admin/notifications/archive")
+async def get_archived_notifications(
+    user_id: Optional[str] = Query(None),
+    ward_number: Optional[int] = Query(None),
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    limit: int = Query(100, ge=1, le=500),
+    role: str = Header(..., alias="X-User-Role")
+):
+    """Notifications moved out of the live collection, for audits"""
+    if role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    if not user_id and ward_number is None and not since:
+        raise HTTPException(status_code=400, detail="Filter by user_id, ward_number or since")
+    notifications = await run_in_threadpool(find_archived_notifications, user_id, ward_number, since, until, limit)
+    return JSONResponse(content=jsonable_encoder({"notifications": notifications, "count": len(notifications)}))
+
 @app.post("/api/admin/broadcast")
 async def admin_broadcast(
     broadcast_data: dict,
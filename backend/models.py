@@ -1,10 +1,12 @@
-from pymongo import MongoClient
-from typing import Optional, List, Dict, Any
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import ConnectionFailure, DuplicateKeyError
+from typing import Optional, List, Dict, Any, Iterator, Tuple
 from datetime import datetime
 from bson import ObjectId
 from bson.errors import InvalidId
 import os
 from dotenv import load_dotenv
+from local_store import LocalStore, FailoverStore, OP_SET, OP_INSERT
 
 load_dotenv()
 
@@ -19,11 +21,13 @@ try:
     client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)  # 5 second timeout
     # Test connection
     client.admin.command('ping')
+    mongo_connected = True
     print(f"[MongoDB] Connection successful!")
 except Exception as e:
     print(f"[MongoDB] Connection failed: {e}")
-    print(f"[MongoDB] WARNING: Continuing with client (will fail on first query)")
-    client = MongoClient(MONGO_URI)
+    print(f"[MongoDB] WARNING: Continuing with the local store until MongoDB is reachable")
+    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+    mongo_connected = False
 
 db = client[DATABASE_NAME]
 
@@ -31,41 +35,133 @@ db = client[DATABASE_NAME]
 complaints_collection = db["complaints"]
 notifications_collection = db["notifications"]
 users_collection = db["users"]
+outbox_collection = db["notification_outbox"]
+push_recipients_collection = db["push_recipients"]
+emergency_contacts_collection = db["emergency_contacts"]
+sos_jobs_collection = db["sos_jobs"]
+rollups_collection = db["complaint_rollups"]
+rollup_buckets_collection = db["complaint_rollup_buckets"]
+timeline_buckets_collection = db["complaint_timeline_buckets"]
+map_clusters_collection = db["complaint_map_clusters"]
+ward_assets_collection = db["ward_assets"]
+inbox_collection = db["notification_inbox"]
+notifications_archive_collection = db["notifications_archive"]
+notification_reads_collection = db["notification_reads"]
+ward_asset_events_collection = db["ward_asset_events"]
 
-print(f"[MongoDB] Collections initialized: complaints, notifications, users")
+# Times a recount is retried when the unread count changes while it is computed
+INBOX_RECOUNT_ATTEMPTS = int(os.getenv("INBOX_RECOUNT_ATTEMPTS", "5"))
+
+# Complaints embed only their latest timeline entries; the full history lives in fixed-size buckets
+TIMELINE_EMBEDDED_ENTRIES = int(os.getenv("TIMELINE_EMBEDDED_ENTRIES", "10"))
+TIMELINE_BUCKET_SIZE = int(os.getenv("TIMELINE_BUCKET_SIZE", "50"))
+
+print(f"[MongoDB] Collections initialized: complaints, notifications, users, notification_outbox, push_recipients, emergency_contacts, sos_jobs, complaint_rollups")
+
+# Complaints, notifications and users fall back to an embedded SQLite store while MongoDB is down
+store = FailoverStore(client, db, LocalStore(), available=mongo_connected)
+
+_transactions_supported = None
+
+def transactions_supported() -> bool:
+    """Multi-document transactions need a replica set or sharded cluster"""
+    global _transactions_supported
+    if _transactions_supported is None:
+        try:
+            hello = client.admin.command("hello")
+            _transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+        except Exception as e:
+            print(f"[MongoDB] Could not detect transaction support: {type(e).__name__}: {str(e)}")
+            return False
+    return _transactions_supported
+
+def run_transaction(callback):
+    """Run callback(session) in a transaction, or with no session on a standalone server"""
+    if not transactions_supported():
+        return callback(None)
+    with client.start_session() as session:
+        return session.with_transaction(callback)
 
 class ComplaintModel:
     @staticmethod
-    def create(complaint_data: Dict[str, Any]) -> str:
+    def ensure_indexes():
+        """Indexes for ID lookups and per-ward / per-user listings"""
+        complaints_collection.create_index("complaint_id", unique=True)
+        complaints_collection.create_index([("ward_number", 1), ("created_at", -1)])
+        complaints_collection.create_index([("created_at", -1)])
+        complaints_collection.create_index([("created_by", 1), ("created_at", -1)])
+        # Only open complaints carry SLA fields, so these indexes stay small
+        complaints_collection.create_index("due_at", partialFilterExpression={"due_at": {"$exists": True}})
+        complaints_collection.create_index("overdue_since", partialFilterExpression={"overdue_since": {"$exists": True}})
+        complaints_collection.create_index(
+            [("ward_number", 1), ("overdue_since", 1)],
+            partialFilterExpression={"overdue_since": {"$exists": True}}
+        )
+        complaints_collection.create_index("duplicate_of", partialFilterExpression={"duplicate_of": {"$exists": True}})
+    
+    @staticmethod
+    def create(complaint_data: Dict[str, Any], session=None) -> str:
         """Create a new complaint"""
         complaint_data["created_at"] = datetime.now()
         complaint_data["updated_at"] = datetime.now()
-        result = complaints_collection.insert_one(complaint_data)
+        result = complaints_collection.insert_one(complaint_data, session=session)
         return str(result.inserted_id)
     
+    @staticmethod
+    def create_local(complaint_data: Dict[str, Any]) -> str:
+        """Keep a new complaint in the local store until MongoDB is reachable again"""
+        complaint_data["created_at"] = datetime.now()
+        complaint_data["updated_at"] = datetime.now()
+        return store.insert_local("complaints", complaint_data)
+    
+    @staticmethod
+    def summary_pipeline(query: Dict[str, Any], projection: Optional[Dict[str, Any]] = None,
+                         limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Newest-first aggregation for list views: attachments are replaced by their count"""
+        pipeline = [{"$match": query}, {"$sort": {"created_at": -1}}]
+        if limit:
+            pipeline.append({"$limit": limit})
+        attachment_count = {"$size": {"$ifNull": ["$attachments", []]}}
+        if projection:
+            pipeline.append({"$project": {**projection, "attachment_count": attachment_count}})
+        else:
+            pipeline += [{"$addFields": {"attachment_count": attachment_count}}, {"$project": {"attachments": 0}}]
+        return pipeline
+    
+    @staticmethod
+    def _find(query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Complaints for a list view, without their full-size attachments"""
+        def read():
+            complaints = list(complaints_collection.aggregate(ComplaintModel.summary_pipeline(query)))
+            for complaint in complaints:
+                complaint["_id"] = str(complaint["_id"])
+            return complaints
+        complaints = store.find("complaints", query, read)
+        for complaint in complaints:
+            # Documents answered from the local store still carry them
+            if "attachments" in complaint:
+                complaint["attachment_count"] = len(complaint.pop("attachments") or [])
+        return complaints
+    
     @staticmethod
     def find_by_id(complaint_id: str) -> Optional[Dict[str, Any]]:
         """Find complaint by ID"""
-        complaint = complaints_collection.find_one({"complaint_id": complaint_id})
-        if complaint:
-            complaint["_id"] = str(complaint["_id"])
-        return complaint
+        def read():
+            complaint = complaints_collection.find_one({"complaint_id": complaint_id})
+            if complaint:
+                complaint["_id"] = str(complaint["_id"])
+            return complaint
+        return store.find_one("complaints", complaint_id, read)
     
     @staticmethod
     def find_by_user(user_id: str) -> List[Dict[str, Any]]:
         """Find all complaints by user"""
-        complaints = list(complaints_collection.find({"created_by": user_id}).sort("created_at", -1))
-        for complaint in complaints:
-            complaint["_id"] = str(complaint["_id"])
-        return complaints
+        return ComplaintModel._find({"created_by": user_id})
     
     @staticmethod
     def find_by_ward(ward_number: int) -> List[Dict[str, Any]]:
         """Find all complaints by ward"""
-        complaints = list(complaints_collection.find({"ward_number": ward_number}).sort("created_at", -1))
-        for complaint in complaints:
-            complaint["_id"] = str(complaint["_id"])
-        return complaints
+        return ComplaintModel._find({"ward_number": ward_number})
     
     @staticmethod
     def update(complaint_id: str, update_data: Dict[str, Any]) -> bool:
@@ -78,23 +174,251 @@ class ComplaintModel:
         return result.modified_count > 0
     
     @staticmethod
-    def add_timeline_entry(complaint_id: str, timeline_entry: Dict[str, Any]) -> bool:
-        """Add timeline entry to complaint"""
-        timeline_entry["timestamp"] = datetime.now()
+    def find_one_and_update(
+        complaint_id: str,
+        update: Any,
+        conditions: Optional[Dict[str, Any]] = None,
+        session=None,
+        return_document: ReturnDocument = ReturnDocument.AFTER
+    ) -> Optional[Dict[str, Any]]:
+        """Apply an update and return the updated (or previous) complaint in a single round trip"""
+        query = {"complaint_id": complaint_id, **(conditions or {})}
+        complaint = complaints_collection.find_one_and_update(
+            query,
+            update,
+            return_document=return_document,
+            session=session
+        )
+        if complaint:
+            complaint["_id"] = str(complaint["_id"])
+        return complaint
+    
+    @staticmethod
+    def find_many_by_ids(complaint_ids: List[str], projection: Optional[Dict[str, Any]] = None, session=None) -> Dict[str, Dict[str, Any]]:
+        """Complaints keyed by complaint_id, read in one query"""
+        cursor = complaints_collection.find({"complaint_id": {"$in": complaint_ids}}, projection, session=session)
+        return {complaint["complaint_id"]: complaint for complaint in cursor}
+    
+    @staticmethod
+    def link_duplicate(parent_id: str, linked_at: datetime, closed_statuses: List[str], session=None) -> bool:
+        """Count a duplicate against its parent, as long as the parent is still an open original"""
         result = complaints_collection.update_one(
-            {"complaint_id": complaint_id},
-            {"$push": {"timeline": timeline_entry}, "$set": {"updated_at": datetime.now()}}
+            {"complaint_id": parent_id, "status": {"$nin": closed_statuses}, "duplicate_of": {"$exists": False}},
+            {"$inc": {"duplicate_count": 1}, "$max": {"last_duplicate_at": linked_at}},
+            session=session
         )
-        return result.modified_count > 0
+        return result.modified_count == 1
+    
+    @staticmethod
+    def unlink_duplicate(parent_id: str, session=None):
+        """Stop counting a wrongly linked duplicate against its parent"""
+        complaints_collection.update_one(
+            {"complaint_id": parent_id, "duplicate_count": {"$gt": 0}},
+            {"$inc": {"duplicate_count": -1}},
+            session=session
+        )
+    
+    @staticmethod
+    def find_duplicates(parent_ids: List[str], session=None) -> List[Dict[str, Any]]:
+        """Complaints linked as duplicates of any of these parents, without timelines or attachments"""
+        cursor = complaints_collection.find(
+            {"duplicate_of": {"$in": parent_ids}}, {"timeline": 0, "attachments": 0}, session=session
+        )
+        return list(cursor)
+    
+    @staticmethod
+    def find_duplicates_of(parent_id: str) -> List[Dict[str, Any]]:
+        """Complaints linked as duplicates of a parent, for admin list views"""
+        return ComplaintModel._find({"duplicate_of": parent_id})
+    
+    @staticmethod
+    def bulk_write(operations: List[UpdateOne], session=None):
+        """Apply many complaint updates in one round trip"""
+        return complaints_collection.bulk_write(operations, ordered=False, session=session)
+    
+    @staticmethod
+    def transition(
+        complaint_id: str,
+        update_data: Dict[str, Any],
+        timeline_entry: Dict[str, Any],
+        session=None
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """Set fields and append a timeline entry atomically.
+        
+        Returns the complaint before and after the update, so callers can act on what changed.
+        """
+        now = datetime.now()
+        timeline_entry["timestamp"] = now
+        update_data = {**update_data, "updated_at": now}
+        # Values are wrapped in $literal so user supplied strings are never parsed as expressions
+        previous = ComplaintModel.find_one_and_update(complaint_id, [{"$set": {
+            **{key: {"$literal": value} for key, value in update_data.items()},
+            "timeline": TimelineModel.append_expression({key: {"$literal": value} for key, value in timeline_entry.items()})
+        }}], session=session, return_document=ReturnDocument.BEFORE)
+        if not previous:
+            return None, None
+        complaint = {**previous, **update_data, "timeline": TimelineModel.embedded(previous, timeline_entry)}
+        if previous.get("timeline_archived"):
+            TimelineModel.append(complaint_id, [timeline_entry], session=session)
+        return previous, complaint
+    
+    @staticmethod
+    def update_with_timeline(
+        complaint_id: str,
+        update_data: Dict[str, Any],
+        timeline_entry: Dict[str, Any],
+        session=None
+    ) -> Optional[Dict[str, Any]]:
+        """Set fields and append a timeline entry atomically, returning the updated complaint"""
+        _, complaint = ComplaintModel.transition(complaint_id, update_data, timeline_entry, session=session)
+        return complaint
+    
+    @staticmethod
+    def add_timeline_entry(complaint_id: str, timeline_entry: Dict[str, Any]) -> bool:
+        """Add timeline entry to complaint"""
+        return ComplaintModel.update_with_timeline(complaint_id, {}, timeline_entry) is not None
     
     @staticmethod
     def find_all(filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """Find all complaints with optional filters"""
-        query = filters or {}
-        complaints = list(complaints_collection.find(query).sort("created_at", -1))
-        for complaint in complaints:
-            complaint["_id"] = str(complaint["_id"])
-        return complaints
+        return ComplaintModel._find(filters or {})
+
+class TimelineModel:
+    """Complete complaint timelines, stored as buckets of TIMELINE_BUCKET_SIZE entries.
+    
+    Complaints with `timeline_archived` set have every entry here and only the latest
+    TIMELINE_EMBEDDED_ENTRIES embedded; older complaints keep their full embedded timeline
+    until migrated with `python timeline.py migrate`.
+    """
+    
+    @staticmethod
+    def ensure_indexes():
+        timeline_buckets_collection.create_index([("complaint_id", 1), ("first_at", -1), ("_id", -1)])
+        # Serves the oldest-first scan of every complaint's buckets used by rollup rebuilds and exports
+        timeline_buckets_collection.create_index([("complaint_id", 1), ("first_at", 1), ("_id", 1)])
+    
+    @staticmethod
+    def append_expression(entry: Any) -> Dict[str, Any]:
+        """Update-pipeline expression appending an entry to the embedded timeline"""
+        timeline = {"$concatArrays": [{"$ifNull": ["$timeline", []]}, [entry]]}
+        return {"$cond": [
+            {"$eq": ["$timeline_archived", True]},
+            {"$slice": [timeline, -TIMELINE_EMBEDDED_ENTRIES]},
+            timeline
+        ]}
+    
+    @staticmethod
+    def embedded(previous: Dict[str, Any], *entries: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """The embedded timeline append_expression leaves behind"""
+        timeline = (previous.get("timeline") or []) + list(entries)
+        if previous.get("timeline_archived"):
+            return timeline[-TIMELINE_EMBEDDED_ENTRIES:]
+        return timeline
+    
+    @staticmethod
+    def _append_operation(complaint_id: str, entry: Dict[str, Any]) -> UpdateOne:
+        # Fills the open bucket, or starts a new one once every bucket is full
+        timestamp = entry.get("timestamp") or datetime.now()
+        return UpdateOne(
+            {"complaint_id": complaint_id, "count": {"$lt": TIMELINE_BUCKET_SIZE}},
+            {
+                "$push": {"entries": entry},
+                "$inc": {"count": 1},
+                "$max": {"last_at": timestamp},
+                "$setOnInsert": {"first_at": timestamp}
+            },
+            upsert=True
+        )
+    
+    @staticmethod
+    def append_many(entries: List[Tuple[str, Dict[str, Any]]], session=None):
+        """Archive (complaint_id, entry) pairs in one ordered bulk write"""
+        if entries:
+            timeline_buckets_collection.bulk_write(
+                [TimelineModel._append_operation(complaint_id, entry) for complaint_id, entry in entries],
+                ordered=True, session=session
+            )
+    
+    @staticmethod
+    def append(complaint_id: str, entries: List[Dict[str, Any]], session=None):
+        TimelineModel.append_many([(complaint_id, entry) for entry in entries], session=session)
+    
+    @staticmethod
+    def replace(complaint_id: str, entries: List[Dict[str, Any]], session=None):
+        """Store a complete timeline, replacing any buckets the complaint had"""
+        timeline_buckets_collection.delete_many({"complaint_id": complaint_id}, session=session)
+        buckets = []
+        for start in range(0, len(entries), TIMELINE_BUCKET_SIZE):
+            chunk = entries[start:start + TIMELINE_BUCKET_SIZE]
+            timestamps = [entry["timestamp"] for entry in chunk if isinstance(entry.get("timestamp"), datetime)]
+            buckets.append({
+                "complaint_id": complaint_id,
+                "count": len(chunk),
+                "entries": chunk,
+                "first_at": min(timestamps) if timestamps else datetime.now(),
+                "last_at": max(timestamps) if timestamps else datetime.now()
+            })
+        if buckets:
+            timeline_buckets_collection.insert_many(buckets, session=session)
+    
+    @staticmethod
+    def iter_buckets(complaint_id: Optional[str] = None, newest_first: bool = False,
+                     projection: Optional[Dict[str, Any]] = None,
+                     complaint_ids: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        """Buckets in timeline order, of one complaint, of complaint_ids or of all of them grouped by complaint"""
+        direction = -1 if newest_first else 1
+        if complaint_id:
+            query = {"complaint_id": complaint_id}
+        elif complaint_ids is not None:
+            query = {"complaint_id": {"$in": complaint_ids}}
+        else:
+            query = {}
+        return timeline_buckets_collection.find(query, projection).sort([
+            ("complaint_id", 1), ("first_at", direction), ("_id", direction)
+        ])
+    
+    @staticmethod
+    def find_page(complaint_id: str, before: Optional[str] = None, limit: int = 20) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Entries newest first, and the cursor for the next page (None on the last one).
+        
+        A cursor is "<bucket id>:<n>", meaning the first n entries of that bucket are still to be read.
+        """
+        query = {"complaint_id": complaint_id}
+        cursor_bucket_id, offset = None, None
+        if before:
+            try:
+                bucket_id, offset = before.split(":")
+                cursor_bucket_id, offset = ObjectId(bucket_id), int(offset)
+            except (ValueError, InvalidId):
+                raise ValueError("Invalid timeline cursor")
+            cursor_bucket = timeline_buckets_collection.find_one(
+                {"_id": cursor_bucket_id, "complaint_id": complaint_id}, {"first_at": 1}
+            )
+            if not cursor_bucket:
+                raise ValueError("Invalid timeline cursor")
+            query["$or"] = [
+                {"first_at": {"$lt": cursor_bucket["first_at"]}},
+                {"first_at": cursor_bucket["first_at"], "_id": {"$lte": cursor_bucket_id}}
+            ]
+        
+        entries = []
+        cursor = timeline_buckets_collection.find(query).sort([("first_at", -1), ("_id", -1)])
+        try:
+            for bucket in cursor:
+                stored = bucket["entries"]
+                if bucket["_id"] == cursor_bucket_id:
+                    stored = stored[:offset]
+                if not stored:
+                    continue
+                if len(entries) == limit:
+                    return entries, f"{bucket['_id']}:{len(stored)}"
+                taken = stored[-(limit - len(entries)):]
+                entries.extend(reversed(taken))
+                if len(taken) < len(stored):
+                    return entries, f"{bucket['_id']}:{len(stored) - len(taken)}"
+        finally:
+            cursor.close()
+        return entries, None
 
 class NotificationModel:
     @staticmethod
@@ -106,9 +430,21 @@ class NotificationModel:
         notification_data["created_at"] = datetime.now()
         notification_data["read"] = False
         try:
-            result = notifications_collection.insert_one(notification_data)
-            notification_id = str(result.inserted_id)
-            print(f"[NotificationModel] SUCCESS: Notification created with ID: {notification_id}")
+            if store.available():
+                try:
+                    result = notifications_collection.insert_one(notification_data)
+                    notification_id = str(result.inserted_id)
+                    print(f"[NotificationModel] SUCCESS: Notification created with ID: {notification_id}")
+                    try:
+                        InboxModel.count_new(notification_data)
+                    except Exception as e:
+                        # The notification is saved; the count catches up on the next recount
+                        print(f"[NotificationModel] WARNING: Could not update unread counts: {type(e).__name__}: {str(e)}")
+                    return notification_id
+                except ConnectionFailure as e:
+                    store.mark_down(e)
+            notification_id = store.insert_local("notifications", notification_data)
+            print(f"[NotificationModel] Notification {notification_id} stored locally until MongoDB is back")
             return notification_id
         except Exception as e:
             print(f"[NotificationModel] ERROR: Failed to create notification: {type(e).__name__}: {str(e)}")
@@ -116,49 +452,289 @@ class NotificationModel:
             traceback.print_exc()
             raise
     
+    @staticmethod
+    def create_once(notification_id: ObjectId, notification_data: Dict[str, Any]) -> bool:
+        """Create a notification under a fixed _id; returns False if it already exists"""
+        notification_data["created_at"] = datetime.now()
+        notification_data["read"] = False
+        if store.available():
+            try:
+                result = notifications_collection.update_one(
+                    {"_id": notification_id}, {"$setOnInsert": notification_data}, upsert=True
+                )
+                if result.upserted_id is None:
+                    return False
+                notification_data["_id"] = notification_id
+                try:
+                    InboxModel.count_new(notification_data)
+                except Exception as e:
+                    print(f"[NotificationModel] WARNING: Could not update unread counts: {type(e).__name__}: {str(e)}")
+                return True
+            except ConnectionFailure as e:
+                store.mark_down(e)
+        if store.local.get("notifications", str(notification_id)):
+            return False
+        store.insert_local("notifications", {**notification_data, "_id": notification_id})
+        return True
+    
     @staticmethod
     def find_by_user(user_id: str, unread_only: bool = False) -> List[Dict[str, Any]]:
         """Find notifications by user"""
         query = {"user_id": user_id}
         if unread_only:
             query["read"] = False
-        notifications = list(notifications_collection.find(query).sort("created_at", -1))
-        for notification in notifications:
-            notification["_id"] = str(notification["_id"])
-        return notifications
+        return NotificationModel._find(query)
     
     @staticmethod
     def find_by_ward(ward_number: int) -> List[Dict[str, Any]]:
         """Find notifications for a ward"""
-        notifications = list(notifications_collection.find({
-            "ward_number": ward_number,
-            "type": "ward_broadcast"
-        }).sort("created_at", -1))
-        for notification in notifications:
-            notification["_id"] = str(notification["_id"])
-        return notifications
+        return NotificationModel._find({"ward_number": ward_number, "type": "ward_broadcast"})
+    
+    @staticmethod
+    def _find(query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        def read():
+            notifications = list(notifications_collection.find(query).sort("created_at", -1))
+            for notification in notifications:
+                notification["_id"] = str(notification["_id"])
+            return notifications
+        return store.find("notifications", query, read)
     
     @staticmethod
-    def mark_as_read(notification_id: str) -> bool:
-        """Mark notification as read"""
+    def update_delivery(notification_id: str, delivery: Dict[str, Any]) -> bool:
+        """Record push fan-out progress on a notification"""
         try:
             result = notifications_collection.update_one(
                 {"_id": ObjectId(notification_id)},
-                {"$set": {"read": True, "read_at": datetime.now()}}
+                {"$set": {"delivery": {**delivery, "updated_at": datetime.now()}}}
             )
             return result.modified_count > 0
         except (InvalidId, TypeError):
             return False
     
+    @staticmethod
+    def find_delivery(notification_id: str) -> Optional[Dict[str, Any]]:
+        """Get push fan-out progress of a notification"""
+        try:
+            notification = notifications_collection.find_one({"_id": ObjectId(notification_id)}, {"delivery": 1})
+        except (InvalidId, TypeError):
+            return None
+        if not notification:
+            return None
+        return notification.get("delivery", {})
+    
+    @staticmethod
+    def mark_as_read(notification_id: str, user_id: Optional[str] = None) -> bool:
+        """Mark notification as read; ward broadcasts are marked for `user_id` only"""
+        try:
+            object_id = ObjectId(notification_id)
+        except (InvalidId, TypeError):
+            return False
+        notification = notifications_collection.find_one_and_update(
+            {"_id": object_id, "type": {"$ne": "ward_broadcast"}, "read": False},
+            {"$set": {"read": True, "read_at": datetime.now()}},
+            projection={"user_id": 1}
+        )
+        if notification:
+            if notification.get("user_id"):
+                InboxModel.decrement(notification["user_id"])
+            return True
+        notification = notifications_collection.find_one({"_id": object_id}, {"type": 1, "created_at": 1, "ward_number": 1})
+        if not notification:
+            return False
+        if notification.get("type") == "ward_broadcast" and user_id:
+            InboxModel.mark_broadcast_read(user_id, notification)
+        # Already read
+        return True
+    
     @staticmethod
     def mark_all_as_read(user_id: str) -> int:
-        """Mark all notifications as read for user"""
+        """Mark all notifications as read for user, including their ward's broadcasts"""
         result = notifications_collection.update_many(
             {"user_id": user_id, "read": False},
             {"$set": {"read": True, "read_at": datetime.now()}}
         )
+        InboxModel.mark_all_read(user_id)
         return result.modified_count
 
+class InboxModel:
+    """Per-user unread counters and broadcast read receipts.
+
+    Personal notifications carry their own `read` flag. Ward broadcasts are
+    stored once per ward, so a user's reads of them are kept as receipts plus
+    a `broadcasts_read_at` watermark set by mark-all-read. Each user's unread
+    count lives in one notification_inbox document, kept up to date with $inc.
+    Every change also bumps its `generation`, so a recount only overwrites the
+    count if nothing changed it while the notifications were being counted.
+    """
+    
+    @staticmethod
+    def ensure_indexes():
+        notifications_collection.create_index([("user_id", 1), ("created_at", -1), ("_id", -1)])
+        notifications_collection.create_index([("ward_number", 1), ("type", 1), ("created_at", -1), ("_id", -1)])
+        inbox_collection.create_index("ward_number")
+        notification_reads_collection.create_index([("user_id", 1), ("notification_created_at", 1)])
+    
+    @staticmethod
+    def count_new(notification: Dict[str, Any]):
+        """Count a newly stored notification as unread for its recipients"""
+        if notification.get("type") == "ward_broadcast":
+            if notification.get("ward_number") is not None:
+                inbox_collection.update_many({"ward_number": notification["ward_number"]}, InboxModel.change(1))
+        elif notification.get("user_id"):
+            inbox_collection.update_one({"_id": notification["user_id"]}, InboxModel.change(1), upsert=True)
+    
+    @staticmethod
+    def change(unread: int) -> Dict[str, Any]:
+        """Update adding `unread` to a counter"""
+        return {"$inc": {"unread": unread, "generation": 1}}
+    
+    @staticmethod
+    def decrement(user_id: str):
+        inbox_collection.update_one({"_id": user_id, "unread": {"$gt": 0}}, InboxModel.change(-1))
+    
+    @staticmethod
+    def mark_broadcast_read(user_id: str, notification: Dict[str, Any]):
+        """Record that a user read a broadcast to their ward, counting it only the first time"""
+        inbox = inbox_collection.find_one({"_id": user_id}, {"broadcasts_read_at": 1, "ward_number": 1}) or {}
+        # A broadcast to another ward was never counted for this user
+        if notification.get("ward_number") is None or notification["ward_number"] != inbox.get("ward_number"):
+            return
+        watermark = inbox.get("broadcasts_read_at")
+        if watermark and notification.get("created_at") and notification["created_at"] <= watermark:
+            return
+        result = notification_reads_collection.update_one(
+            {"_id": f"{user_id}:{notification['_id']}"},
+            {"$setOnInsert": {
+                "user_id": user_id, "notification_id": str(notification["_id"]),
+                "notification_created_at": notification.get("created_at"), "read_at": datetime.now()
+            }},
+            upsert=True
+        )
+        if result.upserted_id is not None:
+            InboxModel.decrement(user_id)
+    
+    @staticmethod
+    def mark_all_read(user_id: str):
+        now = datetime.now()
+        inbox = inbox_collection.find_one_and_update(
+            {"_id": user_id}, {"$set": {"unread": 0, "broadcasts_read_at": now}, "$inc": {"generation": 1}},
+            projection={"ward_number": 1}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        # Receipts older than the watermark are implied by it
+        notification_reads_collection.delete_many({"user_id": user_id, "notification_created_at": {"$lte": now}})
+        # Count anything that arrived after the personal notifications were marked, instead of losing it to the reset
+        InboxModel.recount(user_id, inbox.get("ward_number"))
+    
+    @staticmethod
+    def unread_count(user_id: str) -> int:
+        inbox = inbox_collection.find_one({"_id": user_id}, {"unread": 1})
+        return max(inbox.get("unread", 0), 0) if inbox else 0
+    
+    @staticmethod
+    def _recipient_query(user_id: str, ward_number: Optional[int]) -> Dict[str, Any]:
+        if ward_number is None:
+            return {"user_id": user_id}
+        return {"$or": [{"user_id": user_id}, {"type": "ward_broadcast", "ward_number": ward_number}]}
+    
+    @staticmethod
+    def recount(user_id: str, ward_number: Optional[int]) -> int:
+        """Recompute a user's unread count from their notifications and read receipts"""
+        for _ in range(INBOX_RECOUNT_ATTEMPTS):
+            inbox = inbox_collection.find_one({"_id": user_id}, {"broadcasts_read_at": 1, "generation": 1}) or {}
+            unread = notifications_collection.count_documents({"user_id": user_id, "read": False})
+            if ward_number is not None:
+                broadcasts = {"type": "ward_broadcast", "ward_number": ward_number}
+                read = {"user_id": user_id}
+                if inbox.get("broadcasts_read_at"):
+                    broadcasts["created_at"] = {"$gt": inbox["broadcasts_read_at"]}
+                    read["notification_created_at"] = {"$gt": inbox["broadcasts_read_at"]}
+                unread += notifications_collection.count_documents(broadcasts)
+                unread -= notification_reads_collection.count_documents(read)
+            unread = max(unread, 0)
+            # Only if no notification was counted, read or archived since the counter was read
+            generation = inbox.get("generation", {"$exists": False})
+            try:
+                result = inbox_collection.update_one(
+                    {"_id": user_id, "generation": generation},
+                    {"$set": {"unread": unread, "ward_number": ward_number}, "$inc": {"generation": 1}},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                # The counter was created meanwhile
+                continue
+            if result.matched_count or result.upserted_id is not None:
+                return unread
+        print(f"[InboxModel] WARNING: Unread count of {user_id} kept changing, left as is")
+        return InboxModel.unread_count(user_id)
+    
+    @staticmethod
+    def sync_user(user: Dict[str, Any]):
+        """Follow a user to their ward's broadcasts; their count is rebuilt when the ward changes"""
+        user_id = user.get("user_id")
+        if not user_id:
+            return
+        inbox = inbox_collection.find_one({"_id": user_id}, {"ward_number": 1})
+        if inbox is None or inbox.get("ward_number") != user.get("ward_number"):
+            InboxModel.recount(user_id, user.get("ward_number"))
+    
+    @staticmethod
+    def is_empty() -> bool:
+        return inbox_collection.find_one({}, {"_id": 1}) is None
+    
+    @staticmethod
+    def rebuild() -> int:
+        """Create counters for every user from their current notifications"""
+        count = 0
+        for user in users_collection.find({}, {"user_id": 1, "ward_number": 1}):
+            if user.get("user_id"):
+                InboxModel.recount(user["user_id"], user.get("ward_number"))
+                count += 1
+        print(f"[InboxModel] Counted unread notifications for {count} users")
+        return count
+    
+    @staticmethod
+    def find_page(user_id: str, ward_number: Optional[int], before: Optional[str] = None,
+                  limit: int = 20) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Personal notifications and ward broadcasts, newest first; the cursor is <created_at>|<_id> of the last one"""
+        query = InboxModel._recipient_query(user_id, ward_number)
+        if before:
+            try:
+                created_at, object_id = before.split("|", 1)
+                created_at, object_id = datetime.fromisoformat(created_at), ObjectId(object_id)
+            except (ValueError, InvalidId):
+                raise ValueError("Invalid cursor")
+            query = {"$and": [query, {"$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "_id": {"$lt": object_id}}
+            ]}]}
+        notifications = list(
+            notifications_collection.find(query, {"delivery": 0}).sort([("created_at", -1), ("_id", -1)]).limit(limit + 1)
+        )
+        more = len(notifications) > limit
+        notifications = notifications[:limit]
+        broadcast_ids = [str(n["_id"]) for n in notifications if n.get("type") == "ward_broadcast"]
+        if broadcast_ids:
+            inbox = inbox_collection.find_one({"_id": user_id}, {"broadcasts_read_at": 1}) or {}
+            watermark = inbox.get("broadcasts_read_at")
+            read_ids = {
+                receipt["notification_id"] for receipt in notification_reads_collection.find(
+                    {"_id": {"$in": [f"{user_id}:{notification_id}" for notification_id in broadcast_ids]}},
+                    {"notification_id": 1}
+                )
+            }
+            for notification in notifications:
+                if notification.get("type") == "ward_broadcast":
+                    notification["read"] = str(notification["_id"]) in read_ids or bool(
+                        watermark and notification["created_at"] <= watermark
+                    )
+        cursor = None
+        if more and notifications:
+            last = notifications[-1]
+            cursor = f"{last['created_at'].isoformat()}|{last['_id']}"
+        for notification in notifications:
+            notification["_id"] = str(notification["_id"])
+        return notifications, cursor
+
 class UserModel:
     @staticmethod
     def create_or_update(user_data: Dict[str, Any]) -> str:
@@ -167,36 +743,43 @@ class UserModel:
         if not user_id:
             raise ValueError("user_id is required")
         
-        # Set defaults
-        update_data = {
-            **user_data,
-            "updated_at": datetime.now(),
-        }
+        now = datetime.now()
+        update = {"$set": {**user_data, "updated_at": now}}
         
         # Set created_at only on insert
-        existing_user = users_collection.find_one({"user_id": user_id})
-        if not existing_user and "created_at" not in update_data:
-            update_data["created_at"] = datetime.now()
+        if "created_at" not in user_data:
+            update["$setOnInsert"] = {"created_at": now}
         
-        result = users_collection.update_one(
-            {"user_id": user_id},
-            {"$set": update_data},
-            upsert=True
-        )
-        
-        if result.upserted_id:
-            return str(result.upserted_id)
-        user = users_collection.find_one({"user_id": user_id})
+        if store.available():
+            try:
+                user = users_collection.find_one_and_update(
+                    {"user_id": user_id},
+                    update,
+                    projection=PushRecipientModel.USER_PROJECTION,
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                PushRecipientModel.sync_user(user)
+                InboxModel.sync_user(user)
+                return str(user["_id"])
+            except ConnectionFailure as e:
+                store.mark_down(e)
+        # The push recipient index and inbox are synced when the change is replayed
+        user = store.set_local("users", user_id, update["$set"], update.get("$setOnInsert"))
         return str(user["_id"])
     
     @staticmethod
     def find_by_id(user_id: str) -> Optional[Dict[str, Any]]:
         """Find user by ID"""
         print(f"[UserModel] Finding user by ID: {user_id}")
-        try:
+        def read():
             user = users_collection.find_one({"user_id": user_id})
             if user:
                 user["_id"] = str(user["_id"])
+            return user
+        try:
+            user = store.find_one("users", user_id, read)
+            if user:
                 print(f"[UserModel] SUCCESS: User found - email: {user.get('email', 'N/A')}, role: {user.get('role', 'N/A')}, ward: {user.get('ward_number', 'N/A')}")
             else:
                 print(f"[UserModel] WARNING: User not found with ID: {user_id}")
@@ -222,12 +805,211 @@ class UserModel:
     @staticmethod
     def update_push_token(user_id: str, push_token: str, platform: str) -> bool:
         """Update user push notification token"""
-        result = users_collection.update_one(
+        user = users_collection.find_one_and_update(
             {"user_id": user_id},
             {"$set": {
                 "push_token": push_token,
                 "platform": platform,
                 "updated_at": datetime.now()
-            }}
+            }},
+            projection=PushRecipientModel.USER_PROJECTION,
+            return_document=ReturnDocument.AFTER
         )
-        return result.modified_count > 0
+        if not user:
+            return False
+        PushRecipientModel.sync_user(user)
+        return True
+    
+    @staticmethod
+    def remove_push_tokens(push_tokens: List[str]) -> int:
+        """Clear push tokens that FCM reports as no longer registered"""
+        result = users_collection.update_many(
+            {"push_token": {"$in": push_tokens}},
+            {"$unset": {"push_token": "", "platform": ""}, "$set": {"updated_at": datetime.now()}}
+        )
+        push_recipients_collection.delete_many({"push_token": {"$in": push_tokens}})
+        return result.modified_count
+
+class PushRecipientModel:
+    """Ward -> push token index, one entry per token, kept in sync with users"""
+    
+    USER_PROJECTION = {"_id": 1, "user_id": 1, "ward_number": 1, "role": 1, "push_token": 1}
+    
+    @staticmethod
+    def ensure_indexes():
+        """Unique tokens deduplicate recipients; the compound index covers ward lookups"""
+        push_recipients_collection.create_index("push_token", unique=True)
+        push_recipients_collection.create_index("user_id")
+        push_recipients_collection.create_index([("ward_number", 1), ("role", 1), ("push_token", 1)])
+    
+    @staticmethod
+    def sync_user(user: Dict[str, Any]):
+        """Update the index entry for a user after their ward, role or token changed"""
+        user_id = user.get("user_id")
+        push_token = user.get("push_token")
+        ward_number = user.get("ward_number")
+        if push_token and ward_number is not None:
+            push_recipients_collection.update_one(
+                {"push_token": push_token},
+                {"$set": {
+                    "user_id": user_id,
+                    "ward_number": ward_number,
+                    "role": user.get("role"),
+                    "updated_at": datetime.now()
+                }},
+                upsert=True
+            )
+            push_recipients_collection.delete_many({"user_id": user_id, "push_token": {"$ne": push_token}})
+        else:
+            push_recipients_collection.delete_many({"user_id": user_id})
+    
+    @staticmethod
+    def is_empty() -> bool:
+        return push_recipients_collection.find_one({}, {"_id": 1}) is None
+    
+    @staticmethod
+    def count_by_ward(ward_number: int, role: Optional[str] = None) -> int:
+        """Number of push recipients in a ward"""
+        query = {"ward_number": ward_number}
+        if role:
+            query["role"] = role
+        return push_recipients_collection.count_documents(query)
+    
+    @staticmethod
+    def iter_tokens(ward_number: int, role: Optional[str] = None, chunk_size: int = 1000) -> Iterator[List[str]]:
+        """Stream a ward's push tokens in chunks through a projection-only cursor"""
+        query = {"ward_number": ward_number}
+        if role:
+            query["role"] = role
+        cursor = push_recipients_collection.find(query, {"push_token": 1, "_id": 0}).batch_size(chunk_size)
+        chunk = []
+        for recipient in cursor:
+            chunk.append(recipient["push_token"])
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    
+    @staticmethod
+    def count(ward_number: int, role: Optional[str] = None) -> int:
+        """Number of push tokens in a ward, counted from the ward index"""
+        query = {"ward_number": ward_number}
+        if role:
+            query["role"] = role
+        return push_recipients_collection.count_documents(query)
+    
+    @staticmethod
+    def rebuild() -> int:
+        """Recreate the index from users_collection"""
+        push_recipients_collection.delete_many({})
+        count = 0
+        cursor = users_collection.find(
+            {"push_token": {"$nin": [None, ""]}, "ward_number": {"$ne": None}},
+            PushRecipientModel.USER_PROJECTION
+        )
+        for user in cursor:
+            PushRecipientModel.sync_user(user)
+            count += 1
+        print(f"[PushRecipientModel] Rebuilt index with {count} recipients")
+        return count
+
+class EmergencyContactModel:
+    @staticmethod
+    def upsert_many(ward_id: str, contacts: List[Dict[str, Any]]) -> int:
+        """Add or update a ward's emergency contacts, unique per channel and address"""
+        now = datetime.now()
+        operations = [
+            UpdateOne(
+                {"ward_id": ward_id, "channel": contact["channel"], "address": contact["address"]},
+                {"$set": {"name": contact.get("name"), "updated_at": now}, "$setOnInsert": {"created_at": now}},
+                upsert=True
+            )
+            for contact in contacts
+        ]
+        if not operations:
+            return 0
+        result = emergency_contacts_collection.bulk_write(operations, ordered=False)
+        return result.upserted_count + result.modified_count
+    
+    @staticmethod
+    def iter_addresses(ward_id: str, channel: str) -> Iterator[str]:
+        """Stream a ward's addresses for one channel"""
+        cursor = emergency_contacts_collection.find(
+            {"ward_id": ward_id, "channel": channel},
+            {"address": 1, "_id": 0}
+        ).batch_size(1000)
+        for contact in cursor:
+            yield contact["address"]
+    
+    @staticmethod
+    def count_by_ward(ward_id: str) -> Dict[str, int]:
+        """Number of contacts per channel in a ward"""
+        counts = emergency_contacts_collection.aggregate([
+            {"$match": {"ward_id": ward_id}},
+            {"$group": {"_id": "$channel", "count": {"$sum": 1}}}
+        ])
+        return {row["_id"]: row["count"] for row in counts}
+
+class WardAssetModel:
+    @staticmethod
+    def ensure_indexes():
+        ward_asset_events_collection.create_index([("ward_id", 1), ("version", -1)])
+    
+    @staticmethod
+    def find_all() -> List[Dict[str, Any]]:
+        """Current asset state of every ward that has had an update"""
+        return list(ward_assets_collection.find({}))
+    
+    @staticmethod
+    def save(ward_id: str, state: Dict[str, Any], previous_version: int) -> bool:
+        """Store the next version of a ward's assets; False if another writer saved one first"""
+        if previous_version == 0:
+            try:
+                ward_assets_collection.insert_one({"_id": ward_id, **state})
+                return True
+            except DuplicateKeyError:
+                return False
+        result = ward_assets_collection.update_one({"_id": ward_id, "version": previous_version}, {"$set": state})
+        return result.matched_count == 1
+    
+    @staticmethod
+    def record_event(ward_id: str, version: int, event: Dict[str, Any]):
+        """Keep the field report behind a version; idempotent per ward and version"""
+        ward_asset_events_collection.update_one(
+            {"_id": f"{ward_id}:{version}"},
+            {"$setOnInsert": {"ward_id": ward_id, "version": version, **event}},
+            upsert=True
+        )
+    
+    @staticmethod
+    def find_events(ward_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """A ward's latest field reports, newest first"""
+        cursor = ward_asset_events_collection.find({"ward_id": ward_id}, {"_id": 0}).sort("version", -1).limit(limit)
+        return list(cursor)
+
+class SOSJobModel:
+    @staticmethod
+    def save(job: Dict[str, Any]):
+        """Store the latest progress snapshot of an SOS job"""
+        sos_jobs_collection.update_one({"job_id": job["job_id"]}, {"$set": job}, upsert=True)
+    
+    @staticmethod
+    def find_by_id(job_id: str) -> Optional[Dict[str, Any]]:
+        """Find SOS job by ID"""
+        return sos_jobs_collection.find_one({"job_id": job_id}, {"_id": 0})
+
+def _sync_replayed_users(changes: List[Dict[str, Any]]):
+    """Users created or updated while MongoDB was down get their push recipient and inbox entries now"""
+    user_ids = list({change["fields"]["user_id"] for change in changes if change["fields"].get("user_id")})
+    for user in users_collection.find({"user_id": {"$in": user_ids}}, PushRecipientModel.USER_PROJECTION):
+        PushRecipientModel.sync_user(user)
+        InboxModel.sync_user(user)
+
+def _count_replayed_notifications(notifications: List[Dict[str, Any]]):
+    """Notifications stored while MongoDB was down count as unread once they reach it"""
+    for notification in notifications:
+        InboxModel.count_new(notification)
+
+store.register_replay_hook("users", OP_SET, _sync_replayed_users)
+store.register_replay_hook("notifications", OP_INSERT, _count_replayed_notifications)
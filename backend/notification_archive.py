@@ -0,0 +1,217 @@
+"""Retention for the notifications collection.
+
+Read personal notifications expire NOTIFICATION_READ_TTL_DAYS after being read,
+through a TTL index. Everything else older than NOTIFICATION_ARCHIVE_DAYS (ward
+broadcasts, admin alerts, personal notifications never read) is moved in
+batches of NOTIFICATION_ARCHIVE_BATCH to notifications_archive, one document
+per batch holding the notifications as gzip-compressed NDJSON, tagged with the
+users, wards and time range inside for audit lookups. Unread counters and
+broadcast read receipts are adjusted as notifications leave the hot collection.
+
+Every worker runs the archiver. Workers that pick up the same batch write the
+same archive document, and only the one that claims it adjusts the counters.
+
+The archiver runs every NOTIFICATION_ARCHIVE_INTERVAL_HOURS; to run it by hand:
+
+    python notification_archive.py archive
+"""
+from models import (
+    notifications_collection, notifications_archive_collection, notification_reads_collection, inbox_collection,
+    InboxModel
+)
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+from bson import Binary, json_util
+from bson.json_util import JSONOptions, JSONMode
+from collections import Counter
+from typing import List, Dict, Any, Optional
+from datetime import datetime, timedelta
+import gzip
+import os
+import sys
+import threading
+
+NOTIFICATION_READ_TTL_DAYS = float(os.getenv("NOTIFICATION_READ_TTL_DAYS", "30"))
+NOTIFICATION_ARCHIVE_DAYS = float(os.getenv("NOTIFICATION_ARCHIVE_DAYS", "90"))
+NOTIFICATION_ARCHIVE_BATCH = int(os.getenv("NOTIFICATION_ARCHIVE_BATCH", "1000"))
+NOTIFICATION_ARCHIVE_INTERVAL_HOURS = float(os.getenv("NOTIFICATION_ARCHIVE_INTERVAL_HOURS", "24"))
+ARCHIVE_MAX_RESULTS = 500
+
+READ_TTL_INDEX = "read_notification_ttl"
+_JSON_OPTIONS = JSONOptions(json_mode=JSONMode.RELAXED, tz_aware=False)
+
+def ensure_indexes():
+    """Create the archive indexes and the TTL index, following changes to NOTIFICATION_READ_TTL_DAYS"""
+    notifications_archive_collection.create_index([("last_created_at", ASCENDING)])
+    notifications_archive_collection.create_index([("user_ids", ASCENDING), ("last_created_at", ASCENDING)])
+    notifications_archive_collection.create_index([("ward_numbers", ASCENDING), ("last_created_at", ASCENDING)])
+    notification_reads_collection.create_index("notification_id")
+    # Serves the archiver's oldest-first batches
+    notifications_collection.create_index([("created_at", ASCENDING), ("_id", ASCENDING)])
+    if NOTIFICATION_READ_TTL_DAYS <= 0:
+        if READ_TTL_INDEX in notifications_collection.index_information():
+            notifications_collection.drop_index(READ_TTL_INDEX)
+        return
+    seconds = int(NOTIFICATION_READ_TTL_DAYS * 86400)
+    try:
+        # Only personal notifications have read_at; broadcasts are read per user through receipts
+        notifications_collection.create_index(
+            "read_at", name=READ_TTL_INDEX, expireAfterSeconds=seconds,
+            partialFilterExpression={"read_at": {"$exists": True}, "user_id": {"$exists": True}}
+        )
+    except OperationFailure:
+        # The index exists with a different expiry
+        notifications_collection.database.command(
+            "collMod", notifications_collection.name, index={"name": READ_TTL_INDEX, "expireAfterSeconds": seconds}
+        )
+
+def _compress(notifications: List[Dict[str, Any]]) -> bytes:
+    lines = "\n".join(json_util.dumps(notification, json_options=_JSON_OPTIONS) for notification in notifications)
+    return gzip.compress(lines.encode("utf-8"))
+
+def _decompress(data: bytes) -> List[Dict[str, Any]]:
+    lines = gzip.decompress(data).decode("utf-8").splitlines()
+    return [json_util.loads(line, json_options=_JSON_OPTIONS) for line in lines if line]
+
+def _release_counts(notifications: List[Dict[str, Any]]):
+    """Stop counting archived notifications as unread"""
+    unread = Counter(
+        n["user_id"] for n in notifications
+        if n.get("user_id") and not n.get("read") and n.get("type") != "ward_broadcast"
+    )
+    for user_id, count in unread.items():
+        inbox_collection.update_one({"_id": user_id, "unread": {"$gte": count}}, InboxModel.change(-count))
+    for broadcast in (n for n in notifications if n.get("type") == "ward_broadcast" and n.get("ward_number") is not None):
+        notification_id = str(broadcast["_id"])
+        readers = notification_reads_collection.distinct("user_id", {"notification_id": notification_id})
+        inbox_collection.update_many(
+            {
+                "ward_number": broadcast["ward_number"], "unread": {"$gt": 0}, "_id": {"$nin": readers},
+                "broadcasts_read_at": {"$not": {"$gte": broadcast["created_at"]}}
+            },
+            InboxModel.change(-1)
+        )
+        notification_reads_collection.delete_many({"notification_id": notification_id})
+
+def archive_batch(cutoff: datetime, batch_size: int = NOTIFICATION_ARCHIVE_BATCH) -> int:
+    """Move up to batch_size notifications created before cutoff to the archive; returns how many"""
+    notifications = list(
+        notifications_collection.find({"created_at": {"$lt": cutoff}})
+        .sort([("created_at", ASCENDING), ("_id", ASCENDING)]).limit(batch_size)
+    )
+    if not notifications:
+        return 0
+    first, last = notifications[0], notifications[-1]
+    # Deterministic id, so a batch retried after a crash, or archived by two workers at once, has one copy
+    archive_id = f"{first['_id']}-{last['_id']}"
+    notifications_archive_collection.update_one({"_id": archive_id}, {
+        "$set": {
+            "first_created_at": first["created_at"],
+            "last_created_at": last["created_at"],
+            "count": len(notifications),
+            "user_ids": sorted({n["user_id"] for n in notifications if n.get("user_id")}),
+            "ward_numbers": sorted({n["ward_number"] for n in notifications if n.get("ward_number") is not None}),
+            "data": Binary(_compress(notifications)),
+            "archived_at": datetime.now()
+        },
+        "$setOnInsert": {"counts_released": False}
+    }, upsert=True)
+    # Only the worker that claims the batch releases its counts, so they are never released twice.
+    # If it crashes before releasing them, the next recount of those users corrects their counters.
+    claimed = notifications_archive_collection.find_one_and_update(
+        {"_id": archive_id, "counts_released": False}, {"$set": {"counts_released": True}}, projection={"_id": 1}
+    )
+    if claimed:
+        _release_counts(notifications)
+    notifications_collection.delete_many({"_id": {"$in": [n["_id"] for n in notifications]}})
+    return len(notifications)
+
+def archive(older_than_days: float = NOTIFICATION_ARCHIVE_DAYS) -> int:
+    """Archive every notification older than the retention period, one batch at a time"""
+    cutoff = datetime.now() - timedelta(days=older_than_days)
+    total = 0
+    while True:
+        moved = archive_batch(cutoff)
+        total += moved
+        if moved < NOTIFICATION_ARCHIVE_BATCH:
+            break
+    if total:
+        print(f"[NotificationArchive] Archived {total} notifications created before {cutoff.isoformat()}")
+    return total
+
+def find_archived(user_id: Optional[str] = None, ward_number: Optional[int] = None,
+                  since: Optional[datetime] = None, until: Optional[datetime] = None,
+                  limit: int = 100) -> List[Dict[str, Any]]:
+    """Archived notifications for an audit, oldest first; only matching batches are decompressed"""
+    query = {}
+    if user_id:
+        query["user_ids"] = user_id
+    if ward_number is not None:
+        query["ward_numbers"] = ward_number
+    if since:
+        query["last_created_at"] = {"$gte": since}
+    if until:
+        query["first_created_at"] = {"$lt": until}
+    limit = min(limit, ARCHIVE_MAX_RESULTS)
+    results = []
+    for batch in notifications_archive_collection.find(query, {"data": 1}).sort("first_created_at", ASCENDING):
+        for notification in _decompress(batch["data"]):
+            if user_id and notification.get("user_id") != user_id:
+                continue
+            if ward_number is not None and notification.get("ward_number") != ward_number:
+                continue
+            created_at = notification.get("created_at")
+            if (since and created_at < since) or (until and created_at >= until):
+                continue
+            notification["_id"] = str(notification["_id"])
+            results.append(notification)
+            if len(results) >= limit:
+                return results
+    return results
+
+class NotificationArchiver:
+    """Runs the archiver periodically in the background"""
+
+    def __init__(self, interval_hours: float = NOTIFICATION_ARCHIVE_INTERVAL_HOURS):
+        self.interval = interval_hours * 3600
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread or self.interval <= 0:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="notification-archive", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(5)
+        self._thread = None
+
+    def _run_once(self):
+        try:
+            archive()
+        except Exception as e:
+            print(f"[NotificationArchive] WARNING: Archiving failed: {type(e).__name__}: {str(e)}")
+
+    def _run(self):
+        try:
+            ensure_indexes()
+        except Exception as e:
+            print(f"[NotificationArchive] WARNING: Could not create indexes: {type(e).__name__}: {str(e)}")
+        self._run_once()
+        while not self._stopping.wait(self.interval):
+            self._run_once()
+
+archiver = NotificationArchiver()
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "archive":
+        ensure_indexes()
+        print(f"{archive()} notifications archived")
+    else:
+        print(__doc__)
+        sys.exit(2)
@@ -1,16 +1,22 @@
-from models import NotificationModel, UserModel
+from models import NotificationModel, UserModel, PushRecipientModel, InboxModel
+from outbox import enqueue, register_handler
+from pubsub import publish
 from typing import List, Dict, Any, Optional
 from datetime import datetime
+from bson import ObjectId
 import os
-import json
-import requests
+import threading
 from google.oauth2 import service_account
 from google.auth.transport.requests import Request
+from fcm import FCMClient, SENT, FAILED
 
 # FCM V1 API Setup (using Service Account)
 FCM_SERVICE_ACCOUNT_PATH = os.getenv("FCM_SERVICE_ACCOUNT_PATH", "")
 FCM_PROJECT_ID = os.getenv("FCM_PROJECT_ID", "")
 fcm_credentials = None
+fcm_client = None
+
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "1000"))
 
 if FCM_SERVICE_ACCOUNT_PATH and os.path.exists(FCM_SERVICE_ACCOUNT_PATH):
     try:
@@ -19,6 +25,8 @@ if FCM_SERVICE_ACCOUNT_PATH and os.path.exists(FCM_SERVICE_ACCOUNT_PATH):
             scopes=['https://www.googleapis.com/auth/firebase.messaging']
         )
         fcm_credentials.refresh(Request())
+        if FCM_PROJECT_ID:
+            fcm_client = FCMClient(FCM_PROJECT_ID, fcm_credentials, on_invalid_tokens=UserModel.remove_push_tokens)
         print(f"[Notifications] FCM credentials loaded")
     except Exception as e:
         print(f"[Notifications] Error initializing FCM: {e}")
@@ -26,7 +34,18 @@ if FCM_SERVICE_ACCOUNT_PATH and os.path.exists(FCM_SERVICE_ACCOUNT_PATH):
 else:
     print(f"[Notifications] FCM_SERVICE_ACCOUNT_PATH not set. Push notifications disabled.")
 
-def create_notification_for_ward_admin(ward_number: int, complaint_id: str, complaint_title: str):
+def _create(notification: Dict[str, Any], event_id: Optional[str]) -> bool:
+    """Store a notification; with the outbox event behind it, only the first delivery attempt creates it"""
+    if event_id is None:
+        NotificationModel.create(notification)
+        return True
+    return NotificationModel.create_once(ObjectId(event_id), notification)
+
+def _push_id(event_id: Optional[str], push_token: str) -> Optional[str]:
+    return f"{event_id}:{push_token}" if event_id else None
+
+def create_notification_for_ward_admin(ward_number: int, complaint_id: str, complaint_title: str,
+                                       event_id: Optional[str] = None):
     """Create notification for ward admin when new complaint is filed"""
     notification = {
         "type": "new_complaint",
@@ -37,20 +56,22 @@ def create_notification_for_ward_admin(ward_number: int, complaint_id: str, comp
         "created_by": "system",
         "created_at": datetime.now()
     }
-    NotificationModel.create(notification)
+    if _create(notification, event_id):
+        publish(f"ward:{ward_number}", "new_complaint", {"complaint_id": complaint_id, "title": complaint_title})
     
-    # Send push notification to ward admin
-    ward_admins = UserModel.find_by_ward(ward_number)
-    for admin in ward_admins:
-        if admin.get("push_token") and admin.get("role") == "ward_admin":
-            send_push_notification(
-                admin["push_token"],
+    # Queue push notification to ward admin; a retry skips pushes already queued
+    for push_tokens in PushRecipientModel.iter_tokens(ward_number, role="ward_admin"):
+        for push_token in push_tokens:
+            enqueue_push_notification(
+                push_token,
                 notification["title"],
                 notification["message"],
-                {"complaint_id": complaint_id, "type": "new_complaint"}
+                {"complaint_id": complaint_id, "type": "new_complaint"},
+                push_id=_push_id(event_id, push_token)
             )
 
-def create_complaint_status_notification(complaint_id: str, complaint_title: str, status: str, user_id: str):
+def create_complaint_status_notification(complaint_id: str, complaint_title: str, status: str, user_id: str,
+                                        event_id: Optional[str] = None):
     """Create notification when complaint status changes"""
     notification = {
         "type": "complaint_update",
@@ -60,18 +81,47 @@ def create_complaint_status_notification(complaint_id: str, complaint_title: str
         "user_id": user_id,
         "created_by": "system"
     }
-    NotificationModel.create(notification)
+    if _create(notification, event_id):
+        publish(f"user:{user_id}", "complaint_status", {"complaint_id": complaint_id, "title": complaint_title, "status": status})
     
-    # Send push notification
+    # Queue push notification
     user = UserModel.find_by_id(user_id)
     if user and user.get("push_token"):
-        send_push_notification(
+        enqueue_push_notification(
             user["push_token"],
             notification["title"],
             notification["message"],
-            {"complaint_id": complaint_id, "type": "complaint_update", "status": status}
+            {"complaint_id": complaint_id, "type": "complaint_update", "status": status},
+            push_id=_push_id(event_id, user["push_token"])
         )
 
+def create_sla_breach_notification(ward_number: int, complaint_id: str, complaint_title: str, priority: str, escalation_level: int,
+                                   event_id: Optional[str] = None):
+    """Alert ward admins that a complaint missed its SLA deadline"""
+    notification = {
+        "type": "sla_breach",
+        "title": "Complaint Overdue",
+        "message": f"{(priority or 'medium').title()} priority complaint in Ward {ward_number} is overdue "
+                   f"(escalation level {escalation_level}): {complaint_title}",
+        "ward_number": ward_number,
+        "complaint_id": complaint_id,
+        "escalation_level": escalation_level,
+        "created_by": "system",
+        "created_at": datetime.now()
+    }
+    if _create(notification, event_id):
+        publish(f"ward:{ward_number}", "sla_breach", {"complaint_id": complaint_id, "escalation_level": escalation_level})
+    
+    for push_tokens in PushRecipientModel.iter_tokens(ward_number, role="ward_admin"):
+        for push_token in push_tokens:
+            enqueue_push_notification(
+                push_token,
+                notification["title"],
+                notification["message"],
+                {"complaint_id": complaint_id, "type": "sla_breach", "escalation_level": escalation_level},
+                push_id=_push_id(event_id, push_token)
+            )
+
 def create_ward_broadcast(ward_number: int, title: str, message: str, broadcast_by: str) -> str:
     """Create ward-wide broadcast notification"""
     print(f"[Notification] Creating ward broadcast for ward {ward_number}")
@@ -95,69 +145,92 @@ def create_ward_broadcast(ward_number: int, title: str, message: str, broadcast_
     except Exception as e:
         print(f"[Notification] ERROR: Failed to save notification: {type(e).__name__}: {str(e)}")
         raise
+    publish(f"ward:{ward_number}", "broadcast", {"notification_id": notification_id, "title": title, "message": message})
     
-    # Send push notifications to all users in ward
-    try:
-        print(f"[Notification] Finding users in ward {ward_number}...")
-        ward_users = UserModel.find_by_ward(ward_number)
-        print(f"[Notification] Found {len(ward_users)} users in ward {ward_number}")
-        
-        push_sent = 0
-        for user in ward_users:
-            if user.get("push_token"):
-                print(f"[Notification] Sending push to user {user.get('user_id')}...")
-                send_push_notification(
-                    user["push_token"],
-                    title,
-                    message,
-                    {"type": "ward_broadcast", "ward_number": ward_number, "notification_id": notification_id}
-                )
-                push_sent += 1
-        
-        print(f"[Notification] SUCCESS: Sent {push_sent} push notifications")
-    except Exception as e:
-        print(f"[Notification] WARNING: Error sending push notifications: {type(e).__name__}: {str(e)}")
+    # Send push notifications to all users in ward without holding up the request
+    threading.Thread(
+        target=fan_out_ward_broadcast,
+        args=(notification_id, ward_number, title, message),
+        name=f"broadcast-{notification_id}",
+        daemon=True
+    ).start()
     
     return notification_id
 
-def send_push_notification(push_token: str, title: str, message: str, data: Optional[Dict[str, Any]] = None):
-    """Send push notification via FCM V1 API"""
-    if not fcm_credentials or not FCM_PROJECT_ID or not push_token:
-        print(f"[Notifications] Push notification skipped: FCM not configured or no push token")
-        return False
-    
+def fan_out_ward_broadcast(notification_id: str, ward_number: int, title: str, message: str) -> Dict[str, Any]:
+    """Stream a ward's push tokens from the recipient index and send them chunk by chunk"""
+    delivery = {"status": "sending", "total": 0, "sent": 0, "invalid_token": 0, "failed": 0}
     try:
-        fcm_credentials.refresh(Request())
-        access_token = fcm_credentials.token
+        if not push_enabled():
+            delivery["status"] = "skipped"
+            print(f"[Notification] Push notifications skipped: FCM not configured")
+            return delivery
         
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
+        delivery["total"] = PushRecipientModel.count_by_ward(ward_number)
+        NotificationModel.update_delivery(notification_id, delivery)
+        print(f"[Notification] Sending broadcast {notification_id} to {delivery['total']} devices in ward {ward_number}")
         
-        payload = {
-            "message": {
-                "token": push_token,
-                "notification": {
-                    "title": title,
-                    "body": message
-                },
-                "data": {str(k): str(v) for k, v in (data or {}).items()}
-            }
-        }
+        data = {"type": "ward_broadcast", "ward_number": ward_number, "notification_id": notification_id}
+        for push_tokens in PushRecipientModel.iter_tokens(ward_number, chunk_size=BROADCAST_CHUNK_SIZE):
+            results = fcm_client.send_many(push_tokens, title, message, data)
+            for key, count in results.items():
+                delivery[key] += count
+            NotificationModel.update_delivery(notification_id, delivery)
+            print(f"[Notification] Broadcast {notification_id} progress: {delivery['sent']}/{delivery['total']} sent")
         
-        response = requests.post(
-            f"https://fcm.googleapis.com/v1/projects/{FCM_PROJECT_ID}/messages:send",
-            headers=headers,
-            json=payload,
-            timeout=10
-        )
-        response.raise_for_status()
-        print(f"[Notifications] Push notification sent successfully")
-        return True
+        delivery["status"] = "completed"
+        print(f"[Notification] SUCCESS: Broadcast {notification_id} finished: {delivery}")
+    except Exception as e:
+        delivery["status"] = "failed"
+        delivery["error"] = f"{type(e).__name__}: {str(e)}"
+        print(f"[Notification] WARNING: Error sending push notifications: {delivery['error']}")
+    finally:
+        NotificationModel.update_delivery(notification_id, delivery)
+    return delivery
+
+def prepare_push_recipients():
+    """Create recipient index indexes and backfill it for users registered before it existed"""
+    try:
+        PushRecipientModel.ensure_indexes()
+        if PushRecipientModel.is_empty():
+            PushRecipientModel.rebuild()
+    except Exception as e:
+        print(f"[Notifications] WARNING: Could not prepare push recipient index: {type(e).__name__}: {str(e)}")
+
+def prepare_inbox():
+    """Create inbox indexes and count unread notifications for users registered before counters existed"""
+    try:
+        InboxModel.ensure_indexes()
+        if InboxModel.is_empty():
+            InboxModel.rebuild()
     except Exception as e:
-        print(f"[Notifications] Error sending push notification: {type(e).__name__}: {str(e)}")
+        print(f"[Notifications] WARNING: Could not prepare notification inbox: {type(e).__name__}: {str(e)}")
+
+def get_broadcast_delivery(notification_id: str) -> Optional[Dict[str, Any]]:
+    """Get push fan-out progress of a broadcast"""
+    delivery = NotificationModel.find_delivery(notification_id)
+    if delivery and isinstance(delivery.get("updated_at"), datetime):
+        delivery["updated_at"] = delivery["updated_at"].isoformat()
+    return delivery
+
+def push_enabled() -> bool:
+    """Whether FCM is configured"""
+    return fcm_client is not None
+
+def enqueue_push_notification(push_token: str, title: str, message: str, data: Optional[Dict[str, Any]] = None,
+                              push_id: Optional[str] = None) -> Optional[str]:
+    """Queue a push notification on the outbox so it is retried independently; a push_id is only queued once"""
+    if not push_enabled() or not push_token:
+        print(f"[Notifications] Push notification skipped: FCM not configured or no push token")
+        return None
+    return enqueue("push", {"push_token": push_token, "title": title, "message": message, "data": data or {}}, event_id=push_id)
+
+def send_push_notification(push_token: str, title: str, message: str, data: Optional[Dict[str, Any]] = None):
+    """Send push notification via FCM V1 API"""
+    if not push_enabled() or not push_token:
+        print(f"[Notifications] Push notification skipped: FCM not configured or no push token")
         return False
+    return fcm_client.send(push_token, title, message, data) == SENT
 
 def get_user_notifications(user_id: str, unread_only: bool = False) -> List[Dict[str, Any]]:
     """Get notifications for a user"""
@@ -167,6 +240,15 @@ def get_user_notifications(user_id: str, unread_only: bool = False) -> List[Dict
             n["created_at"] = n["created_at"].isoformat()
     return notifications
 
+def get_user_inbox(user_id: str, before: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+    """A user's notifications merged with their ward's broadcasts, newest first"""
+    user = UserModel.find_by_id(user_id)
+    notifications, cursor = InboxModel.find_page(user_id, user.get("ward_number") if user else None, before, limit)
+    for n in notifications:
+        if "created_at" in n and isinstance(n["created_at"], datetime):
+            n["created_at"] = n["created_at"].isoformat()
+    return {"notifications": notifications, "next_cursor": cursor}
+
 def get_ward_notifications(ward_number: int) -> List[Dict[str, Any]]:
     """Get notifications for a ward"""
     notifications = NotificationModel.find_by_ward(ward_number)
@@ -174,3 +256,43 @@ def get_ward_notifications(ward_number: int) -> List[Dict[str, Any]]:
         if "created_at" in n and isinstance(n["created_at"], datetime):
             n["created_at"] = n["created_at"].isoformat()
     return notifications
+
+# ============================================================================
+# OUTBOX HANDLERS
+# ============================================================================
+
+def _handle_new_complaint(payload: Dict[str, Any], event_id: str):
+    create_notification_for_ward_admin(payload["ward_number"], payload["complaint_id"], payload["complaint_title"], event_id)
+
+def _handle_complaint_status(payload: Dict[str, Any], event_id: str):
+    create_complaint_status_notification(
+        payload["complaint_id"],
+        payload["complaint_title"],
+        payload["status"],
+        payload["user_id"],
+        event_id
+    )
+
+def _handle_sla_breach(payload: Dict[str, Any], event_id: str):
+    create_sla_breach_notification(
+        payload["ward_number"],
+        payload["complaint_id"],
+        payload["complaint_title"],
+        payload.get("priority"),
+        payload["escalation_level"],
+        event_id
+    )
+
+def _handle_push(payload: Dict[str, Any], event_id: str):
+    if not push_enabled():
+        print(f"[Notifications] Push notification dropped: FCM not configured")
+        return
+    # Invalid tokens are pruned by the client and not worth retrying
+    result = fcm_client.send(payload["push_token"], payload["title"], payload["message"], payload.get("data"))
+    if result == FAILED:
+        raise RuntimeError("Push notification delivery failed")
+
+register_handler("new_complaint", _handle_new_complaint)
+register_handler("complaint_status", _handle_complaint_status)
+register_handler("sla_breach", _handle_sla_breach)
+register_handler("push", _handle_push)
@@ -0,0 +1,210 @@
+from models import outbox_collection
+from pymongo import ReturnDocument, ASCENDING
+from pymongo.errors import DuplicateKeyError
+from typing import List, Dict, Any, Callable, Optional
+from datetime import datetime, timedelta
+import os
+import random
+import threading
+import traceback
+
+# Outbox dispatcher settings
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BASE_DELAY_SECONDS = float(os.getenv("OUTBOX_BASE_DELAY_SECONDS", "2"))
+OUTBOX_MAX_DELAY_SECONDS = float(os.getenv("OUTBOX_MAX_DELAY_SECONDS", "600"))
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+OUTBOX_POLL_INTERVAL_SECONDS = float(os.getenv("OUTBOX_POLL_INTERVAL_SECONDS", "1"))
+OUTBOX_SENT_RETENTION_SECONDS = int(os.getenv("OUTBOX_SENT_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+STATUS_PENDING = "pending"
+STATUS_PROCESSING = "processing"
+STATUS_SENT = "sent"
+STATUS_DEAD = "dead"
+
+_handlers: Dict[str, Callable[[Dict[str, Any], str], None]] = {}
+
+def register_handler(kind: str, handler: Callable[[Dict[str, Any], str], None]):
+    """Register the function that delivers outbox events of a kind.
+
+    It is called with the payload and the event id. Events are delivered at
+    least once, so a handler uses the id to make a retry a no-op.
+    """
+    _handlers[kind] = handler
+
+def enqueue(kind: str, payload: Dict[str, Any], session=None, event_id: Optional[str] = None) -> str:
+    """Persist an event for background delivery.
+
+    Pass the session of the surrounding complaint write so both commit together.
+    With an event_id, enqueueing the same id again is a no-op.
+    """
+    now = datetime.now()
+    event = {
+        "kind": kind,
+        "payload": payload,
+        "status": STATUS_PENDING,
+        "attempts": 0,
+        "next_attempt_at": now,
+        "locked_until": None,
+        "last_error": None,
+        "created_at": now
+    }
+    if event_id is not None:
+        event["_id"] = event_id
+    try:
+        result = outbox_collection.insert_one(event, session=session)
+    except DuplicateKeyError:
+        return event_id
+    dispatcher.wake()
+    return str(result.inserted_id)
+
+def enqueue_many(kind: str, payloads: List[Dict[str, Any]], session=None) -> List[str]:
+    """Persist several events of one kind with a single insert"""
+    if not payloads:
+        return []
+    now = datetime.now()
+    result = outbox_collection.insert_many([{
+        "kind": kind,
+        "payload": payload,
+        "status": STATUS_PENDING,
+        "attempts": 0,
+        "next_attempt_at": now,
+        "locked_until": None,
+        "last_error": None,
+        "created_at": now
+    } for payload in payloads], ordered=False, session=session)
+    dispatcher.wake()
+    return [str(inserted_id) for inserted_id in result.inserted_ids]
+
+def ensure_indexes():
+    """Indexes used to claim due events and expire delivered ones"""
+    outbox_collection.create_index([("status", ASCENDING), ("next_attempt_at", ASCENDING)])
+    outbox_collection.create_index([("status", ASCENDING), ("locked_until", ASCENDING)])
+    outbox_collection.create_index("sent_at", expireAfterSeconds=OUTBOX_SENT_RETENTION_SECONDS)
+
+def backoff_delay(attempts: int) -> float:
+    """Exponential backoff with full jitter"""
+    delay = min(OUTBOX_BASE_DELAY_SECONDS * (2 ** max(attempts - 1, 0)), OUTBOX_MAX_DELAY_SECONDS)
+    return random.uniform(delay / 2, delay)
+
+def claim_next() -> Optional[Dict[str, Any]]:
+    """Lease the next due event. Events whose lease expired (crashed worker) are claimed again."""
+    now = datetime.now()
+    return outbox_collection.find_one_and_update(
+        {"$or": [
+            {"status": STATUS_PENDING, "next_attempt_at": {"$lte": now}},
+            {"status": STATUS_PROCESSING, "locked_until": {"$lte": now}}
+        ]},
+        {
+            "$set": {"status": STATUS_PROCESSING, "locked_until": now + timedelta(seconds=OUTBOX_LEASE_SECONDS)},
+            "$inc": {"attempts": 1}
+        },
+        sort=[("next_attempt_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def process_event(event: Dict[str, Any]) -> bool:
+    """Deliver one claimed event and record the outcome. Returns True on success."""
+    try:
+        handler = _handlers.get(event["kind"])
+        if handler is None:
+            raise KeyError(f"No handler registered for outbox event kind '{event['kind']}'")
+        handler(event["payload"], str(event["_id"]))
+    except Exception as e:
+        error = f"{type(e).__name__}: {str(e)}"
+        now = datetime.now()
+        if event["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+            print(f"[Outbox] ERROR: Event {event['_id']} ({event['kind']}) dead-lettered after {event['attempts']} attempts: {error}")
+            update = {"status": STATUS_DEAD, "dead_at": now, "locked_until": None, "last_error": error}
+        else:
+            delay = backoff_delay(event["attempts"])
+            print(f"[Outbox] WARNING: Event {event['_id']} ({event['kind']}) failed, retrying in {delay:.1f}s: {error}")
+            update = {
+                "status": STATUS_PENDING,
+                "next_attempt_at": now + timedelta(seconds=delay),
+                "locked_until": None,
+                "last_error": error
+            }
+        outbox_collection.update_one({"_id": event["_id"]}, {"$set": update})
+        return False
+
+    outbox_collection.update_one(
+        {"_id": event["_id"]},
+        {"$set": {"status": STATUS_SENT, "sent_at": datetime.now(), "locked_until": None}}
+    )
+    return True
+
+def requeue_dead(kind: Optional[str] = None) -> int:
+    """Move dead-lettered events back to pending, e.g. after fixing the cause"""
+    query = {"status": STATUS_DEAD}
+    if kind:
+        query["kind"] = kind
+    result = outbox_collection.update_many(query, {"$set": {
+        "status": STATUS_PENDING,
+        "attempts": 0,
+        "next_attempt_at": datetime.now()
+    }})
+    dispatcher.wake()
+    return result.modified_count
+
+def get_outbox_stats() -> Dict[str, int]:
+    """Count outbox events by status"""
+    counts = {STATUS_PENDING: 0, STATUS_PROCESSING: 0, STATUS_SENT: 0, STATUS_DEAD: 0}
+    for row in outbox_collection.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+        counts[row["_id"]] = row["count"]
+    return counts
+
+class OutboxDispatcher:
+    """Worker pool draining the outbox with at-least-once delivery"""
+
+    def __init__(self, workers: int = OUTBOX_WORKERS):
+        self.workers = workers
+        self._threads = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+    def start(self):
+        if self._threads:
+            return
+        try:
+            ensure_indexes()
+        except Exception as e:
+            print(f"[Outbox] WARNING: Could not create indexes: {type(e).__name__}: {str(e)}")
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"outbox-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"[Outbox] Dispatcher started with {self.workers} workers")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        print(f"[Outbox] Dispatcher stopped")
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                event = claim_next()
+            except Exception as e:
+                print(f"[Outbox] ERROR: Failed to claim event: {type(e).__name__}: {str(e)}")
+                event = None
+
+            if event is None:
+                self._wakeup.wait(OUTBOX_POLL_INTERVAL_SECONDS)
+                self._wakeup.clear()
+                continue
+
+            try:
+                process_event(event)
+            except Exception:
+                # Outcome could not be recorded; the lease expires and the event is retried
+                traceback.print_exc()
+
+dispatcher = OutboxDispatcher()
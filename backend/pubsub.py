@@ -0,0 +1,136 @@
+"""In-process pub/sub behind the /api/stream Server-Sent Events endpoint.
+
+Publishers on any thread call `publish(topic, event, data)`. Each event is
+encoded as an SSE frame once and handed to the event loop in a single
+thread-safe call, which appends it to the queue of every subscriber of the topic.
+
+Queues are bounded. A subscriber that falls PUBSUB_QUEUE_SIZE events behind
+loses its oldest events and is sent a `resync` event telling it to re-fetch
+state, so one slow client never holds up the others or grows memory.
+
+Topics:
+    risk            hotspot risk-level changes, and asset changes and SOS alerts by WARD_xxx id
+    crowd           new crowd reports
+    ward:<number>   complaints, SLA breaches, broadcasts and SOS alerts for a ward number
+    user:<user_id>  status changes of the user's complaints
+
+Subscribers only see events published by the worker process they are connected to.
+"""
+from collections import deque
+from typing import Dict, Any, Optional, Set, Iterable, AsyncIterator
+import asyncio
+import itertools
+import json
+import os
+import threading
+
+PUBSUB_QUEUE_SIZE = int(os.getenv("PUBSUB_QUEUE_SIZE", "256"))
+PUBSUB_MAX_SUBSCRIBERS = int(os.getenv("PUBSUB_MAX_SUBSCRIBERS", "10000"))
+PUBSUB_HEARTBEAT_SECONDS = float(os.getenv("PUBSUB_HEARTBEAT_SECONDS", "15"))
+
+def _frame(event_id: int, event: str, data: Any) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'), default=str)}\n\n"
+
+class Subscription:
+    def __init__(self, topics: Set[str], queue_size: int):
+        self.topics = topics
+        self.frames: deque = deque(maxlen=queue_size)
+        self.lagged = False
+        self.dropped = 0
+        self.ready = asyncio.Event()
+
+    def push(self, frame: str):
+        if len(self.frames) == self.frames.maxlen:
+            self.lagged = True
+            self.dropped += 1
+        self.frames.append(frame)
+        self.ready.set()
+
+class Broker:
+    def __init__(self, queue_size: int = PUBSUB_QUEUE_SIZE, max_subscribers: int = PUBSUB_MAX_SUBSCRIBERS):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Topic -> subscriptions; only touched from the event loop thread
+        self._topics: Dict[str, Set[Subscription]] = {}
+        self._subscribers = 0
+        self._ids = itertools.count(1)
+        self._id_lock = threading.Lock()
+        self.published = 0
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """Deliver events on this loop; events published before binding are dropped"""
+        self._loop = loop
+
+    def subscribe(self, topics: Iterable[str]) -> Subscription:
+        if self._subscribers >= self.max_subscribers:
+            raise OverflowError("Too many subscribers")
+        subscription = Subscription(set(topics), self.queue_size)
+        for topic in subscription.topics:
+            self._topics.setdefault(topic, set()).add(subscription)
+        self._subscribers += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        for topic in subscription.topics:
+            subscribers = self._topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._topics[topic]
+        self._subscribers -= 1
+
+    def subscriber_count(self) -> int:
+        return self._subscribers
+
+    def _deliver(self, topic: str, frame: str):
+        for subscription in self._topics.get(topic, ()):
+            subscription.push(frame)
+
+    def publish(self, topic: str, event: str, data: Any):
+        """Send an event to every subscriber of `topic`; safe to call from any thread"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        with self._id_lock:
+            event_id = next(self._ids)
+        frame = _frame(event_id, event, {"topic": topic, **data} if isinstance(data, dict) else data)
+        self.published += 1
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._deliver(topic, frame)
+        else:
+            try:
+                loop.call_soon_threadsafe(self._deliver, topic, frame)
+            except RuntimeError:
+                # The loop closed while shutting down
+                pass
+
+    async def stream(self, subscription: Subscription, heartbeat: float = PUBSUB_HEARTBEAT_SECONDS) -> AsyncIterator[str]:
+        """SSE frames for a subscription until the client goes away"""
+        try:
+            yield f"retry: 5000\nevent: subscribed\ndata: {json.dumps(sorted(subscription.topics))}\n\n"
+            while True:
+                try:
+                    await asyncio.wait_for(subscription.ready.wait(), heartbeat)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection
+                    yield ": heartbeat\n\n"
+                    continue
+                subscription.ready.clear()
+                if subscription.lagged:
+                    subscription.lagged = False
+                    yield f"event: resync\ndata: {json.dumps({'dropped': subscription.dropped})}\n\n"
+                frames = list(subscription.frames)
+                subscription.frames.clear()
+                yield "".join(frames)
+        finally:
+            self.unsubscribe(subscription)
+
+broker = Broker()
+
+def publish(topic: str, event: str, data: Any):
+    broker.publish(topic, event, data)
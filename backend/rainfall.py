@@ -0,0 +1,228 @@
+"""Live rainfall feed and the hotspot risk it drives.
+
+Stations (or grid cells, sent as stations at the cell centre) post rainfall
+intensity readings. Each station's current intensity is the mean of its
+readings over RAINFALL_WINDOW_MINUTES; a hotspot's is the inverse-distance
+weighted mean of the stations within RAINFALL_STATION_RADIUS_KM. The model is
+only re-run for hotspots whose intensity moved by RAINFALL_RECOMPUTE_MM_PER_HR
+or more since their risk was last computed, in one batch, and the current risk
+picture is served from memory.
+
+For testing, a CSV or NDJSON file of readings (station_id, lat, lng,
+timestamp, intensity) can be replayed through the feed:
+
+    RAINFALL_REPLAY_PATH=storm.csv RAINFALL_REPLAY_SPEED=60 uvicorn main:app
+"""
+from hotspots import HOTSPOTS
+from wards import WARDS
+from collections import deque
+from typing import List, Dict, Any, Optional, Callable, Tuple
+from datetime import datetime
+import csv
+import json
+import math
+import os
+import threading
+import time
+
+RAINFALL_WINDOW_MINUTES = float(os.getenv("RAINFALL_WINDOW_MINUTES", "60"))
+RAINFALL_STATION_RADIUS_KM = float(os.getenv("RAINFALL_STATION_RADIUS_KM", "10"))
+RAINFALL_RECOMPUTE_MM_PER_HR = float(os.getenv("RAINFALL_RECOMPUTE_MM_PER_HR", "2"))
+RAINFALL_REPLAY_PATH = os.getenv("RAINFALL_REPLAY_PATH")
+RAINFALL_REPLAY_SPEED = float(os.getenv("RAINFALL_REPLAY_SPEED", "60"))
+
+# predict([(rainfall, elevation, drainage_score), ...]) -> [(risk_level, probability), ...]
+Predictor = Callable[[List[Tuple[float, float, float]]], List[Tuple[int, float]]]
+
+def _distance_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    x = math.radians(lng2 - lng1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return 6371 * math.hypot(x, y)
+
+def _ward_centre(ward: Dict[str, Any]) -> Tuple[float, float]:
+    (south, west), (north, east) = ward["bounds"][0], ward["bounds"][2]
+    return (south + north) / 2, (west + east) / 2
+
+class RainfallFeed:
+    """Current rainfall per station, hotspot and ward, and the risk computed from it"""
+
+    def __init__(self, predict: Optional[Predictor] = None, window_minutes: float = RAINFALL_WINDOW_MINUTES,
+                 radius_km: float = RAINFALL_STATION_RADIUS_KM, threshold: float = RAINFALL_RECOMPUTE_MM_PER_HR):
+        self.predict = predict
+        self.window = window_minutes * 60
+        self.radius = radius_km
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        # Station id -> {"lat", "lng", "readings": deque of (timestamp, intensity), "sum"}
+        self._stations: Dict[str, Dict[str, Any]] = {}
+        # Site key -> [(station id, weight)] and station id -> site keys, filled as stations appear
+        self._site_stations: Dict[tuple, List[Tuple[str, float]]] = {}
+        self._station_sites: Dict[str, List[tuple]] = {}
+        self._sites = {("hotspot", h["id"]): (h["lat"], h["lng"]) for h in HOTSPOTS}
+        self._sites.update({("ward", w["id"]): _ward_centre(w) for w in WARDS})
+        self._rainfall: Dict[tuple, float] = {key: 0.0 for key in self._sites}
+        # Hotspot id -> risk as last computed, with the rainfall it was computed for
+        self._risk: Dict[Any, Dict[str, Any]] = {}
+        self.model_runs = 0
+        self._replay_thread = None
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Call listener(hotspot_id, previous_level, risk) whenever a hotspot's risk level changes"""
+        self._listeners.append(listener)
+
+    def _station(self, station_id: str, lat: float, lng: float) -> Dict[str, Any]:
+        station = self._stations.get(station_id)
+        if station is None:
+            station = {"lat": lat, "lng": lng, "readings": deque(), "sum": 0.0}
+            self._stations[station_id] = station
+            sites = []
+            for key, (site_lat, site_lng) in self._sites.items():
+                distance = _distance_km(lat, lng, site_lat, site_lng)
+                if distance <= self.radius:
+                    # Inverse-distance weights; a station on top of the site dominates but is not infinite
+                    self._site_stations.setdefault(key, []).append((station_id, 1 / max(distance, 0.1) ** 2))
+                    sites.append(key)
+            self._station_sites[station_id] = sites
+        return station
+
+    def _expire(self, station: Dict[str, Any], now: float) -> bool:
+        readings = station["readings"]
+        expired = False
+        while readings and readings[0][0] <= now - self.window:
+            station["sum"] -= readings.popleft()[1]
+            expired = True
+        if not readings:
+            station["sum"] = 0.0
+        return expired
+
+    def _station_intensity(self, station: Dict[str, Any]) -> Optional[float]:
+        readings = station["readings"]
+        return station["sum"] / len(readings) if readings else None
+
+    def _interpolate(self, key: tuple) -> float:
+        total = weights = 0.0
+        for station_id, weight in self._site_stations.get(key, []):
+            intensity = self._station_intensity(self._stations[station_id])
+            if intensity is not None:
+                total += intensity * weight
+                weights += weight
+        return total / weights if weights else 0.0
+
+    def _refresh(self, keys, force: bool = False) -> int:
+        """Re-interpolate these sites and re-run the model for hotspots that moved past the threshold"""
+        changed = []
+        for key in keys:
+            self._rainfall[key] = self._interpolate(key)
+            if key[0] != "hotspot":
+                continue
+            previous = self._risk.get(key[1])
+            if force or previous is None or abs(self._rainfall[key] - previous["rainfall_intensity"]) >= self.threshold:
+                changed.append(key[1])
+        if not changed or not self.predict:
+            return 0
+        hotspots = {hotspot["id"]: hotspot for hotspot in HOTSPOTS}
+        rows = [
+            (self._rainfall[("hotspot", hotspot_id)], hotspots[hotspot_id]["elevation"], hotspots[hotspot_id]["drainage_score"])
+            for hotspot_id in changed
+        ]
+        now = datetime.now().isoformat()
+        for hotspot_id, row, (risk_level, probability) in zip(changed, rows, self.predict(rows)):
+            previous = self._risk.get(hotspot_id)
+            self._risk[hotspot_id] = {
+                "risk_level": int(risk_level), "probability": float(probability),
+                "rainfall_intensity": row[0], "computed_at": now
+            }
+            if previous and previous["risk_level"] != int(risk_level):
+                for listener in self._listeners:
+                    try:
+                        listener(hotspot_id, previous["risk_level"], self._risk[hotspot_id])
+                    except Exception as e:
+                        print(f"[Rainfall] WARNING: Risk listener failed: {type(e).__name__}: {str(e)}")
+        self.model_runs += 1
+        return len(changed)
+
+    def ingest(self, readings: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Add readings ({station_id, lat, lng, intensity, timestamp?}) and update the affected risk"""
+        now = time.time()
+        accepted = 0
+        touched = set()
+        with self._lock:
+            for reading in readings:
+                timestamp = min(float(reading.get("timestamp") or now), now)
+                if timestamp <= now - self.window:
+                    continue
+                station = self._station(str(reading["station_id"]), float(reading["lat"]), float(reading["lng"]))
+                readings_window = station["readings"]
+                intensity = float(reading["intensity"])
+                if readings_window and timestamp < readings_window[-1][0]:
+                    # Out-of-order reading: keep the window sorted so expiry stays a popleft
+                    ordered = sorted(list(readings_window) + [(timestamp, intensity)])
+                    readings_window.clear()
+                    readings_window.extend(ordered)
+                else:
+                    readings_window.append((timestamp, intensity))
+                station["sum"] += intensity
+                accepted += 1
+                touched.add(str(reading["station_id"]))
+            for station_id, station in self._stations.items():
+                if self._expire(station, now):
+                    touched.add(station_id)
+            keys = {key for station_id in touched for key in self._station_sites[station_id]}
+            recomputed = self._refresh(keys)
+        return {"accepted": accepted, "rejected": len(readings) - accepted, "recomputed": recomputed}
+
+    def current(self) -> Dict[str, Any]:
+        """Current rainfall and risk per hotspot and ward, without re-running the model unless inputs moved"""
+        now = time.time()
+        with self._lock:
+            expired = [station_id for station_id, station in self._stations.items() if self._expire(station, now)]
+            keys = {key for station_id in expired for key in self._station_sites[station_id]}
+            missing = [("hotspot", hotspot["id"]) for hotspot in HOTSPOTS if hotspot["id"] not in self._risk]
+            self._refresh(keys | set(missing))
+            hotspots = [
+                {"id": hotspot["id"], "name": hotspot["name"], "lat": hotspot["lat"], "lng": hotspot["lng"],
+                 **self._risk.get(hotspot["id"], {"risk_level": 0, "probability": 0.0, "rainfall_intensity": 0.0}),
+                 "current_rainfall_intensity": round(self._rainfall[("hotspot", hotspot["id"])], 2)}
+                for hotspot in HOTSPOTS
+            ]
+            wards = [
+                {"ward_id": ward["id"], "ward_name": ward["name"],
+                 "rainfall_intensity": round(self._rainfall[("ward", ward["id"])], 2)}
+                for ward in WARDS
+            ]
+            stations = len(self._stations)
+        return {"hotspots": hotspots, "wards": wards, "stations": stations}
+
+    def replay(self, path: str, speed: float = RAINFALL_REPLAY_SPEED):
+        """Feed a CSV or NDJSON file of readings through ingest, `speed` times faster than recorded"""
+        with open(path, encoding="utf-8") as file:
+            if path.endswith(".csv"):
+                rows = list(csv.DictReader(file))
+            else:
+                rows = [json.loads(line) for line in file if line.strip()]
+        rows.sort(key=lambda row: float(row["timestamp"]))
+        if not rows:
+            return
+        started = time.time()
+        for row in rows:
+            recorded = float(row["timestamp"]) - float(rows[0]["timestamp"])
+            delay = started + recorded / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            # Readings are stamped when replayed, so they fall inside the window
+            self.ingest([{**row, "timestamp": None}])
+        print(f"[Rainfall] Replayed {len(rows)} readings from {path}")
+
+    def start_replay(self, path: Optional[str] = RAINFALL_REPLAY_PATH):
+        if not path or self._replay_thread:
+            return
+        def run():
+            try:
+                self.replay(path)
+            except Exception as e:
+                print(f"[Rainfall] WARNING: Replay of {path} failed: {type(e).__name__}: {str(e)}")
+        self._replay_thread = threading.Thread(target=run, name="rainfall-replay", daemon=True)
+        self._replay_thread.start()
+
+feed = RainfallFeed()
@@ -0,0 +1,335 @@
+"""Per-ward and city-wide complaint counters, maintained with $inc on every write.
+
+Rebuild or verify them from the complaints collection with:
+
+    python rollups.py rebuild
+    python rollups.py check
+"""
+from models import complaints_collection, rollups_collection, rollup_buckets_collection, TimelineModel
+from geo import record_cluster_changes
+from pymongo import UpdateOne, ASCENDING
+from typing import List, Dict, Any, Optional, Tuple
+from collections import defaultdict
+from datetime import datetime, timedelta
+import sys
+
+CITY_SCOPE = "city"
+META_ID = "meta"
+GRANULARITIES = ["hour", "day"]
+DEFAULT_TREND_WINDOW = {"hour": timedelta(hours=48), "day": timedelta(days=30)}
+
+def ward_scope(ward_number: int) -> str:
+    return f"ward:{ward_number}"
+
+def _scopes(complaint: Dict[str, Any]) -> List[str]:
+    scopes = [CITY_SCOPE]
+    if complaint.get("ward_number") is not None:
+        scopes.append(ward_scope(complaint["ward_number"]))
+    return scopes
+
+def _as_datetime(value) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    return None
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def contributions(complaint: Optional[Dict[str, Any]]) -> Dict[str, float]:
+    """What one complaint adds to the counters, as flat $inc keys"""
+    if not complaint:
+        return {}
+    inc = {"total": 1}
+    if complaint.get("status"):
+        inc[f"status.{complaint['status']}"] = 1
+    if complaint.get("priority"):
+        inc[f"priority.{complaint['priority']}"] = 1
+    response_time = complaint.get("response_time_hours")
+    if complaint.get("status") == "resolved" and response_time and response_time > 0:
+        inc["response_time_sum"] = response_time
+        inc["response_time_count"] = 1
+    if complaint.get("rating"):
+        inc[f"ratings.{int(complaint['rating'])}"] = 1
+    if complaint.get("overdue_since"):
+        inc["overdue"] = 1
+    return inc
+
+def _delta(previous: Optional[Dict[str, Any]], complaint: Optional[Dict[str, Any]]) -> Dict[str, float]:
+    inc = defaultdict(int)
+    for key, value in contributions(complaint).items():
+        inc[key] += value
+    for key, value in contributions(previous).items():
+        inc[key] -= value
+    return {key: value for key, value in inc.items() if value}
+
+def _bucket_operations(scopes: List[str], timestamp: datetime, inc: Dict[str, int]) -> List[UpdateOne]:
+    operations = []
+    for scope in scopes:
+        for granularity in GRANULARITIES:
+            start = bucket_start(timestamp, granularity)
+            operations.append(UpdateOne(
+                {"_id": f"{scope}:{granularity}:{start.isoformat()}"},
+                {"$inc": inc, "$setOnInsert": {"scope": scope, "granularity": granularity, "bucket": start}},
+                upsert=True
+            ))
+    return operations
+
+def _write(scopes: List[str], inc: Dict[str, float], bucket_ops: List[UpdateOne], session=None):
+    now = datetime.now()
+    if inc:
+        rollups_collection.bulk_write([
+            UpdateOne({"_id": scope}, {"$inc": inc, "$set": {"updated_at": now}}, upsert=True)
+            for scope in scopes
+        ], ordered=False, session=session)
+    if bucket_ops:
+        rollup_buckets_collection.bulk_write(bucket_ops, ordered=False, session=session)
+
+def record_filed(complaint: Dict[str, Any], session=None):
+    """Count a newly filed complaint"""
+    scopes = _scopes(complaint)
+    created_at = _as_datetime(complaint.get("created_at")) or datetime.now()
+    _write(scopes, contributions(complaint), _bucket_operations(scopes, created_at, {"filed": 1}), session)
+    # Map clusters follow the same changes as the counters
+    record_cluster_changes([(None, complaint)], session=session)
+
+def record_transition(previous: Optional[Dict[str, Any]], complaint: Optional[Dict[str, Any]], session=None):
+    """Move a complaint's counters from its previous state to its current one"""
+    if not previous or not complaint:
+        return
+    scopes = _scopes(complaint)
+    bucket_ops = []
+    status = complaint.get("status")
+    if status and status != previous.get("status"):
+        changed_at = _as_datetime(complaint.get("updated_at")) or datetime.now()
+        bucket_ops = _bucket_operations(scopes, changed_at, {f"transitions.{status}": 1})
+    _write(scopes, _delta(previous, complaint), bucket_ops, session)
+    record_cluster_changes([(previous, complaint)], session=session)
+
+def record_transitions(changes: List[Tuple[Dict[str, Any], Dict[str, Any]]], session=None):
+    """record_transition for many (previous, complaint) pairs, merged into one write per collection"""
+    totals = defaultdict(lambda: defaultdict(int))
+    buckets = defaultdict(lambda: defaultdict(int))
+    for previous, complaint in changes:
+        if not previous or not complaint:
+            continue
+        scopes = _scopes(complaint)
+        for key, value in _delta(previous, complaint).items():
+            for scope in scopes:
+                totals[scope][key] += value
+        status = complaint.get("status")
+        if status and status != previous.get("status"):
+            changed_at = _as_datetime(complaint.get("updated_at")) or datetime.now()
+            for scope in scopes:
+                for granularity in GRANULARITIES:
+                    buckets[(scope, granularity, bucket_start(changed_at, granularity))][f"transitions.{status}"] += 1
+    now = datetime.now()
+    operations = []
+    for scope, counters in totals.items():
+        inc = {key: value for key, value in counters.items() if value}
+        if inc:
+            operations.append(UpdateOne({"_id": scope}, {"$inc": inc, "$set": {"updated_at": now}}, upsert=True))
+    if operations:
+        rollups_collection.bulk_write(operations, ordered=False, session=session)
+    if buckets:
+        rollup_buckets_collection.bulk_write([
+            UpdateOne(
+                {"_id": f"{scope}:{granularity}:{start.isoformat()}"},
+                {"$inc": dict(inc), "$setOnInsert": {"scope": scope, "granularity": granularity, "bucket": start}},
+                upsert=True
+            )
+            for (scope, granularity, start), inc in buckets.items()
+        ], ordered=False, session=session)
+    record_cluster_changes(changes, session=session)
+
+def ensure_indexes():
+    rollup_buckets_collection.create_index([("scope", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING)])
+
+def rollups_ready() -> bool:
+    """Rollups are only trusted once they have been built from the existing complaints"""
+    return rollups_collection.find_one({"_id": META_ID}, {"_id": 1}) is not None
+
+def stats_from_rollup(rollup: Dict[str, Any]) -> Dict[str, Any]:
+    """Dashboard stats in the same shape as admin.get_admin_dashboard_stats"""
+    status = rollup.get("status", {})
+    priority = rollup.get("priority", {})
+    ratings = rollup.get("ratings", {})
+    rated = sum(ratings.values())
+    satisfied = ratings.get("4", 0) + ratings.get("5", 0)
+    response_time_count = rollup.get("response_time_count", 0)
+    return {
+        "total_complaints": rollup.get("total", 0),
+        "pending": status.get("pending", 0),
+        "acknowledged": status.get("acknowledged", 0),
+        "in_progress": status.get("in_progress", 0),
+        "resolved": status.get("resolved", 0),
+        "high_priority": priority.get("high", 0) + priority.get("urgent", 0),
+        "avg_response_time": round(rollup.get("response_time_sum", 0) / response_time_count, 2) if response_time_count else None,
+        "satisfaction_rate": round((satisfied / rated) * 100, 1) if rated else None,
+        "overdue": rollup.get("overdue", 0),
+    }
+
+def get_rollup_stats(ward_number: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Dashboard stats from a single rollup document, or None if rollups are not built yet"""
+    if not rollups_ready():
+        return None
+    scope = ward_scope(ward_number) if ward_number else CITY_SCOPE
+    return stats_from_rollup(rollups_collection.find_one({"_id": scope}) or {})
+
+def get_trends(
+    ward_number: Optional[int] = None,
+    granularity: str = "hour",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+) -> List[Dict[str, Any]]:
+    """Filed and status-transition counts per time bucket"""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {GRANULARITIES}")
+    until = until or datetime.now()
+    since = since or until - DEFAULT_TREND_WINDOW[granularity]
+    scope = ward_scope(ward_number) if ward_number else CITY_SCOPE
+    cursor = rollup_buckets_collection.find(
+        {"scope": scope, "granularity": granularity, "bucket": {"$gte": bucket_start(since, granularity), "$lte": until}},
+        {"_id": 0, "scope": 0, "granularity": 0}
+    ).sort("bucket", ASCENDING)
+    trends = []
+    for row in cursor:
+        trends.append({
+            "bucket": row["bucket"].isoformat(),
+            "filed": row.get("filed", 0),
+            "transitions": row.get("transitions", {})
+        })
+    return trends
+
+def _nest(flat: Dict[str, float]) -> Dict[str, Any]:
+    nested = {}
+    for key, value in flat.items():
+        target = nested
+        parts = key.split(".")
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return nested
+
+def _flatten(document: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in document.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def _archived_timelines():
+    """Generator sent complaint_ids in ascending order, answering each with that complaint's archived entries"""
+    buckets = TimelineModel.iter_buckets(projection={"complaint_id": 1, "entries.status": 1, "entries.timestamp": 1})
+    pending = next(buckets, None)
+    entries = None
+    while True:
+        complaint_id = yield entries
+        entries = []
+        while pending is not None and pending["complaint_id"] < complaint_id:
+            pending = next(buckets, None)
+        while pending is not None and pending["complaint_id"] == complaint_id:
+            entries.extend(pending.get("entries") or [])
+            pending = next(buckets, None)
+
+def compute_rollups():
+    """Recompute every counter and bucket from the complaints collection"""
+    totals = defaultdict(lambda: defaultdict(int))
+    buckets = defaultdict(lambda: defaultdict(int))
+    # Both cursors are ordered by complaint_id so archived timelines are merged in as they stream past
+    cursor = complaints_collection.find({}, {
+        "complaint_id": 1, "status": 1, "priority": 1, "response_time_hours": 1, "rating": 1,
+        "overdue_since": 1, "ward_number": 1, "created_at": 1, "timeline_archived": 1,
+        "timeline.status": 1, "timeline.timestamp": 1
+    }).sort("complaint_id", ASCENDING)
+    archived = _archived_timelines()
+    next(archived)
+    for complaint in cursor:
+        scopes = _scopes(complaint)
+        for key, value in contributions(complaint).items():
+            for scope in scopes:
+                totals[scope][key] += value
+
+        events = []
+        created_at = _as_datetime(complaint.get("created_at"))
+        if created_at:
+            events.append((created_at, "filed"))
+        previous_status = None
+        timeline = complaint.get("timeline") or []
+        if complaint.get("timeline_archived"):
+            timeline = archived.send(complaint.get("complaint_id"))
+        for entry in timeline:
+            status = entry.get("status")
+            timestamp = _as_datetime(entry.get("timestamp"))
+            if previous_status is not None and status != previous_status and timestamp:
+                events.append((timestamp, f"transitions.{status}"))
+            previous_status = status
+
+        for timestamp, key in events:
+            for scope in scopes:
+                for granularity in GRANULARITIES:
+                    buckets[(scope, granularity, bucket_start(timestamp, granularity))][key] += 1
+    return totals, buckets
+
+def rebuild() -> Dict[str, int]:
+    """Replace the rollups with freshly computed ones.
+
+    Writes that land while this runs may be lost, so run it while traffic is quiet.
+    """
+    totals, buckets = compute_rollups()
+    now = datetime.now()
+    rollups_collection.delete_many({})
+    rollup_buckets_collection.delete_many({})
+    if totals:
+        rollups_collection.insert_many([
+            {"_id": scope, **_nest(counters), "updated_at": now} for scope, counters in totals.items()
+        ])
+    if buckets:
+        rollup_buckets_collection.insert_many([
+            {
+                "_id": f"{scope}:{granularity}:{start.isoformat()}",
+                "scope": scope,
+                "granularity": granularity,
+                "bucket": start,
+                **_nest(counters)
+            }
+            for (scope, granularity, start), counters in buckets.items()
+        ])
+    rollups_collection.insert_one({"_id": META_ID, "built_at": now})
+    print(f"[Rollups] Rebuilt {len(totals)} rollups and {len(buckets)} time buckets")
+    return {"rollups": len(totals), "buckets": len(buckets)}
+
+def check() -> List[str]:
+    """Compare stored counters with freshly computed ones and list the differences"""
+    totals, _ = compute_rollups()
+    mismatches = []
+    stored = {doc["_id"]: _flatten(doc) for doc in rollups_collection.find({"_id": {"$ne": META_ID}})}
+    for scope in sorted(set(totals) | set(stored)):
+        expected = {k: v for k, v in totals.get(scope, {}).items() if v}
+        actual = {k: v for k, v in stored.get(scope, {}).items() if v}
+        for key in sorted(set(expected) | set(actual)):
+            if abs(expected.get(key, 0) - actual.get(key, 0)) > 1e-6:
+                mismatches.append(f"{scope} {key}: stored {actual.get(key, 0)}, expected {expected.get(key, 0)}")
+    return mismatches
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    if command == "rebuild":
+        print(rebuild())
+    elif command == "check":
+        problems = check()
+        for problem in problems:
+            print(problem)
+        print(f"{len(problems)} mismatches")
+        sys.exit(1 if problems else 0)
+    else:
+        print(__doc__)
+        sys.exit(2)
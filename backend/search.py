@@ -0,0 +1,119 @@
+"""Ranked full-text search over complaints.
+
+Backed by the `complaint_text` index on title, category and description, which
+MongoDB keeps up to date on every insert and update. Results are ordered by
+relevance and paged with an opaque cursor; the first page also carries ward,
+status and month facets over every match.
+"""
+from models import complaints_collection
+from bson import ObjectId
+from bson.errors import InvalidId
+from typing import Dict, Any, Optional, Tuple
+from datetime import datetime
+import os
+
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "100"))
+SEARCH_FACET_SIZE = int(os.getenv("SEARCH_FACET_SIZE", "20"))
+
+TEXT_INDEX_NAME = "complaint_text"
+# Matches in the title count for more than matches in a long description
+TEXT_INDEX_WEIGHTS = {"title": 10, "category": 5, "description": 1}
+
+SEARCH_PROJECTION = {
+    "complaint_id": 1, "title": 1, "description": 1, "category": 1, "ward_number": 1,
+    "status": 1, "priority": 1, "created_by": 1, "assigned_officer_id": 1, "location": 1,
+    "created_at": 1, "updated_at": 1, "score": 1
+}
+
+def ensure_text_index():
+    complaints_collection.create_index(
+        [(field, "text") for field in TEXT_INDEX_WEIGHTS],
+        name=TEXT_INDEX_NAME, weights=TEXT_INDEX_WEIGHTS, default_language="english"
+    )
+
+def _parse_cursor(cursor: str) -> Tuple[float, ObjectId]:
+    try:
+        score, complaint_id = cursor.split(":")
+        return float(score), ObjectId(complaint_id)
+    except (ValueError, InvalidId):
+        raise ValueError("Invalid search cursor")
+
+def _count_by(field) -> list:
+    return [
+        {"$group": {"_id": field, "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": SEARCH_FACET_SIZE}
+    ]
+
+def search_complaints(
+    text: str,
+    ward_number: Optional[int] = None,
+    status: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20
+) -> Dict[str, Any]:
+    """One page of complaints matching `text`, most relevant first"""
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    match = {"$text": {"$search": text}}
+    if ward_number:
+        match["ward_number"] = ward_number
+    if status:
+        match["status"] = status
+    if since or until:
+        match["created_at"] = {}
+        if since:
+            match["created_at"]["$gte"] = since
+        if until:
+            match["created_at"]["$lt"] = until
+
+    page = [{"$sort": {"score": -1, "_id": -1}}]
+    if cursor:
+        score, last_id = _parse_cursor(cursor)
+        page.insert(0, {"$match": {"$or": [
+            {"score": {"$lt": score}},
+            {"score": score, "_id": {"$lt": last_id}}
+        ]}})
+    # One extra result tells whether another page follows
+    page += [{"$limit": limit + 1}, {"$project": SEARCH_PROJECTION}]
+
+    pipeline = [{"$match": match}, {"$addFields": {"score": {"$meta": "textScore"}}}]
+    if cursor:
+        pipeline += page
+    else:
+        # Facets only change with the query, so they are computed for the first page alone
+        pipeline.append({"$facet": {
+            "results": page,
+            "total": [{"$count": "count"}],
+            "wards": _count_by("$ward_number"),
+            "statuses": _count_by("$status"),
+            "months": _count_by({"$dateToString": {"format": "%Y-%m", "date": "$created_at"}}),
+        }})
+
+    rows = list(complaints_collection.aggregate(pipeline))
+    response: Dict[str, Any] = {}
+    if cursor:
+        results = rows
+    else:
+        facets = rows[0] if rows else {}
+        results = facets.get("results", [])
+        total = facets.get("total") or [{"count": 0}]
+        response["total"] = total[0]["count"]
+        response["facets"] = {
+            name: [{"value": row["_id"], "count": row["count"]} for row in facets.get(name, [])]
+            for name in ("wards", "statuses", "months")
+        }
+
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = f"{results[-1]['score']!r}:{results[-1]['_id']}"
+    for complaint in results:
+        complaint["_id"] = str(complaint["_id"])
+        for key in ("created_at", "updated_at"):
+            if isinstance(complaint.get(key), datetime):
+                complaint[key] = complaint[key].isoformat()
+    response["complaints"] = results
+    response["next_cursor"] = next_cursor
+    return response
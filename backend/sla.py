@@ -0,0 +1,215 @@
+"""Service-level deadlines for open complaints.
+
+Every open complaint carries a `due_at` derived from its priority and status.
+SLATracker keeps the deadlines falling due within a lookahead window in a heap
+and escalates each one when it passes, so the database is only asked for
+complaints that are about to breach, never for every open complaint.
+
+Set deadlines on complaints filed before SLAs were tracked with:
+
+    python sla.py backfill
+"""
+from models import complaints_collection
+from pymongo import UpdateOne, ASCENDING
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime, timedelta
+import heapq
+import os
+import sys
+import threading
+
+# SLA tracker settings
+SLA_LOOKAHEAD_SECONDS = int(os.getenv("SLA_LOOKAHEAD_SECONDS", "3600"))
+SLA_ESCALATION_INTERVAL_HOURS = float(os.getenv("SLA_ESCALATION_INTERVAL_HOURS", "4"))
+SLA_MAX_ESCALATIONS = int(os.getenv("SLA_MAX_ESCALATIONS", "3"))
+
+# Hours allowed in each open status, by priority
+SLA_HOURS = {
+    "urgent": {"pending": 1, "acknowledged": 2, "in_progress": 12},
+    "high": {"pending": 4, "acknowledged": 8, "in_progress": 48},
+    "medium": {"pending": 12, "acknowledged": 24, "in_progress": 72},
+    "low": {"pending": 24, "acknowledged": 48, "in_progress": 168},
+}
+DEFAULT_PRIORITY = "medium"
+CLOSED_STATUSES = ["resolved", "closed"]
+
+def _truncate(timestamp: datetime) -> datetime:
+    # MongoDB dates have millisecond precision; deadlines are matched exactly when escalating
+    return timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+
+def sla_hours(priority: Optional[str], status: Optional[str]) -> Optional[float]:
+    """Hours allowed for a complaint in this status, or None once it is closed"""
+    return SLA_HOURS.get(priority, SLA_HOURS[DEFAULT_PRIORITY]).get(status)
+
+def compute_due_at(priority: Optional[str], status: Optional[str], since: datetime) -> Optional[datetime]:
+    """Deadline for leaving the status entered at `since`"""
+    hours = sla_hours(priority, status)
+    if hours is None:
+        return None
+    return _truncate(since) + timedelta(hours=hours)
+
+def due_at_expression(status: str, since: datetime):
+    """Update-pipeline expression computing compute_due_at from the stored priority"""
+    if status not in SLA_HOURS[DEFAULT_PRIORITY]:
+        return "$$REMOVE"
+    branches = [
+        {"case": {"$eq": ["$priority", priority]}, "then": int(hours[status] * 3600 * 1000)}
+        for priority, hours in SLA_HOURS.items()
+    ]
+    default = int(SLA_HOURS[DEFAULT_PRIORITY][status] * 3600 * 1000)
+    return {"$add": [since, {"$switch": {"branches": branches, "default": default}}]}
+
+def next_escalation_at(now: datetime) -> datetime:
+    """When a breached complaint escalates again if it is still open"""
+    return _truncate(now) + timedelta(hours=SLA_ESCALATION_INTERVAL_HOURS)
+
+def find_due(after: Optional[datetime], until: datetime) -> List[Tuple[datetime, str]]:
+    """Deadlines in (after, until], read from the due_at index"""
+    window = {"$exists": True, "$lte": until}
+    if after is not None:
+        window["$gt"] = after
+    cursor = complaints_collection.find(
+        {"due_at": window}, {"_id": 0, "complaint_id": 1, "due_at": 1}
+    ).sort("due_at", ASCENDING)
+    return [(row["due_at"], row["complaint_id"]) for row in cursor]
+
+def backfill() -> int:
+    """Give open complaints without a deadline one, measured from their last update.
+
+    Overdue complaints are skipped: they have no deadline once their escalations are exhausted.
+    """
+    operations = []
+    no_deadline = {"status": {"$nin": CLOSED_STATUSES}, "due_at": {"$exists": False}, "overdue_since": {"$exists": False}}
+    cursor = complaints_collection.find(
+        no_deadline,
+        {"complaint_id": 1, "priority": 1, "status": 1, "created_at": 1, "updated_at": 1}
+    )
+    for complaint in cursor:
+        since = complaint.get("updated_at") or complaint.get("created_at")
+        if not isinstance(since, datetime):
+            since = datetime.now()
+        due_at = compute_due_at(complaint.get("priority"), complaint.get("status"), since)
+        if due_at is not None:
+            operations.append(UpdateOne(
+                {"_id": complaint["_id"], **no_deadline},
+                {"$set": {"due_at": due_at, "escalation_level": 0}}
+            ))
+    if operations:
+        complaints_collection.bulk_write(operations, ordered=False)
+        print(f"[SLA] Set deadlines on {len(operations)} open complaints")
+    return len(operations)
+
+class SLATracker:
+    """Background thread escalating complaints as their deadlines pass"""
+
+    def __init__(self, lookahead_seconds: int = SLA_LOOKAHEAD_SECONDS):
+        self.lookahead = timedelta(seconds=lookahead_seconds)
+        self._heap: List[Tuple[datetime, str]] = []
+        self._loaded_until: Optional[datetime] = None
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="sla-tracker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join(5)
+        self._thread = None
+
+    def track(self, complaint_id: str, due_at: Optional[datetime]):
+        """Note a new deadline. Ones beyond the lookahead are picked up by a later refill.
+
+        A deadline may end up in the heap twice; escalation matches on the exact due_at, so only one escalates.
+        """
+        if due_at is None or due_at > datetime.now() + self.lookahead:
+            return
+        with self._condition:
+            heapq.heappush(self._heap, (due_at, complaint_id))
+            self._condition.notify()
+
+    def _refill(self, now: datetime):
+        until = now + self.lookahead
+        rows = find_due(self._loaded_until, until)
+        with self._condition:
+            for row in rows:
+                heapq.heappush(self._heap, row)
+            self._loaded_until = until
+        if rows:
+            print(f"[SLA] Loaded {len(rows)} deadlines due by {until.isoformat()}")
+
+    def _pop_due(self, now: datetime) -> List[Tuple[datetime, str]]:
+        due = []
+        with self._condition:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap))
+        return due
+
+    def _escalate(self, complaint_id: str, due_at: datetime):
+        from complaints_db import escalate_overdue_complaint
+        try:
+            complaint = escalate_overdue_complaint(complaint_id, due_at)
+        except Exception as e:
+            print(f"[SLA] WARNING: Failed to escalate {complaint_id}: {type(e).__name__}: {str(e)}")
+            return
+        # None means the complaint moved on (or another instance escalated it) since the deadline was loaded
+        if complaint:
+            print(f"[SLA] Complaint {complaint_id} breached its deadline, escalation level {complaint['escalation_level']}")
+
+    def _run(self):
+        try:
+            backfill()
+        except Exception as e:
+            print(f"[SLA] WARNING: Deadline backfill failed: {type(e).__name__}: {str(e)}")
+        while not self._stopping:
+            now = datetime.now()
+            try:
+                if self._loaded_until is None or self._loaded_until - now < self.lookahead / 2:
+                    self._refill(now)
+            except Exception as e:
+                print(f"[SLA] WARNING: Could not load deadlines: {type(e).__name__}: {str(e)}")
+            for due_at, complaint_id in self._pop_due(now):
+                self._escalate(complaint_id, due_at)
+            with self._condition:
+                if self._stopping:
+                    return
+                wake_at = now + self.lookahead / 2
+                if self._heap:
+                    wake_at = min(wake_at, self._heap[0][0])
+                self._condition.wait(max((wake_at - datetime.now()).total_seconds(), 0))
+
+tracker = SLATracker()
+
+def get_overdue_complaints(ward_number: Optional[int] = None, limit: int = 10) -> List[Dict[str, Any]]:
+    """Open complaints past their deadline, longest overdue first"""
+    query = {"overdue_since": {"$exists": True}}
+    if ward_number:
+        query["ward_number"] = ward_number
+    cursor = complaints_collection.find(query, {
+        "complaint_id": 1, "title": 1, "ward_number": 1, "status": 1, "priority": 1,
+        "assigned_officer_id": 1, "due_at": 1, "overdue_since": 1, "escalation_level": 1
+    }).sort("overdue_since", ASCENDING).limit(limit)
+    complaints = []
+    for complaint in cursor:
+        complaint["_id"] = str(complaint["_id"])
+        for key in ("due_at", "overdue_since"):
+            if isinstance(complaint.get(key), datetime):
+                complaint[key] = complaint[key].isoformat()
+        complaints.append(complaint)
+    return complaints
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "backfill":
+        print(f"{backfill()} complaints updated")
+    else:
+        print(__doc__)
+        sys.exit(2)
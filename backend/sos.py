@@ -0,0 +1,347 @@
+from models import EmergencyContactModel, SOSJobModel, PushRecipientModel
+from typing import List, Dict, Any, Optional, Iterable
+from datetime import datetime
+import itertools
+import os
+import queue
+import threading
+import time
+import uuid
+import requests
+from requests.adapters import HTTPAdapter
+
+# SOS dispatch settings
+SOS_WORKERS = int(os.getenv("SOS_WORKERS", "32"))
+SOS_CHUNK_SIZE = int(os.getenv("SOS_CHUNK_SIZE", "20"))
+SOS_JOBS_KEPT_IN_MEMORY = int(os.getenv("SOS_JOBS_KEPT_IN_MEMORY", "200"))
+
+SMS_GATEWAY_URL = os.getenv("SMS_GATEWAY_URL", "")
+SMS_GATEWAY_API_KEY = os.getenv("SMS_GATEWAY_API_KEY", "")
+SMS_RATE_PER_SECOND = float(os.getenv("SMS_RATE_PER_SECOND", "200"))
+WHATSAPP_GATEWAY_URL = os.getenv("WHATSAPP_GATEWAY_URL", "")
+WHATSAPP_GATEWAY_TOKEN = os.getenv("WHATSAPP_GATEWAY_TOKEN", "")
+WHATSAPP_RATE_PER_SECOND = float(os.getenv("WHATSAPP_RATE_PER_SECOND", "50"))
+PUSH_RATE_PER_SECOND = float(os.getenv("PUSH_RATE_PER_SECOND", "500"))
+
+# Lower value is served first. Priorities order jobs within the engine, which
+# only carries SOS traffic today; ordinary notifications go through the outbox.
+PRIORITY_SOS = 0
+PRIORITY_NORMAL = 10
+
+class TokenBucket:
+    """Thread-safe rate limiter"""
+
+    def __init__(self, rate_per_second: float, burst: Optional[float] = None):
+        self.rate = rate_per_second
+        self.capacity = burst if burst is not None else max(rate_per_second, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class Channel:
+    """A delivery channel. Subclasses implement send()."""
+
+    name = "channel"
+
+    def __init__(self, rate_per_second: float):
+        self.limiter = TokenBucket(rate_per_second)
+
+    def send(self, address: str, message: str) -> bool:
+        raise NotImplementedError
+
+class HTTPGatewayChannel(Channel):
+    """SMS or WhatsApp gateway accepting {"to", "message"} JSON over pooled keep-alive connections"""
+
+    def __init__(self, name: str, url: str, api_key: str, rate_per_second: float, timeout: float = 10.0):
+        super().__init__(rate_per_second)
+        self.name = name
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=SOS_WORKERS)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def send(self, address: str, message: str) -> bool:
+        try:
+            response = self.session.post(self.url, json={"to": address, "message": message}, timeout=self.timeout)
+            return response.ok
+        except Exception as e:
+            print(f"[SOS] {self.name} send error: {type(e).__name__}: {str(e)}")
+            return False
+
+class PushChannel(Channel):
+    """Push notifications through the shared FCM client"""
+
+    name = "push"
+
+    def __init__(self, fcm_client, rate_per_second: float = PUSH_RATE_PER_SECOND):
+        super().__init__(rate_per_second)
+        self.fcm_client = fcm_client
+
+    def send(self, address: str, message: str) -> bool:
+        from fcm import SENT
+        return self.fcm_client.send(address, "SOS Emergency Alert", message, {"type": "sos"}) == SENT
+
+class SOSJob:
+    """Progress of one fan-out, updated by the workers"""
+
+    def __init__(self, ward_id: str, message: str, priority: int, recipients: Optional[Dict[str, int]] = None):
+        self.job_id = f"SOS-{uuid.uuid4().hex[:12].upper()}"
+        self.ward_id = ward_id
+        self.message = message
+        self.priority = priority
+        self.status = "queued"
+        self.channels: Dict[str, Dict[str, int]] = {}
+        # Recipients per channel counted at submission, reported before the producer has read them all
+        self.recipients: Dict[str, int] = dict(recipients or {})
+        self.pending_chunks = 0
+        # Recipients are still being read and chunked
+        self.producing = True
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        # Bumped on every change under lock, so saves never go back to an older snapshot
+        self.revision = 0
+        self.saved_revision = -1
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            channels = {name: dict(counts) for name, counts in self.channels.items()}
+            total = sum(c["queued"] for c in channels.values())
+            if self.producing:
+                total = max(total, sum(self.recipients.values()))
+            done = sum(c["sent"] + c["failed"] for c in channels.values())
+            elapsed = ((self.finished_at or datetime.now()) - self.started_at).total_seconds() if self.started_at else 0
+            return {
+                "job_id": self.job_id,
+                "ward_id": self.ward_id,
+                "message": self.message,
+                "priority": self.priority,
+                "status": self.status,
+                "channels": channels,
+                "recipients": dict(self.recipients),
+                "total": total,
+                "completed": done,
+                "progress": round(done / total * 100, 1) if total else 100.0,
+                "messages_per_minute": round(done / elapsed * 60, 1) if elapsed > 0 else None,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "revision": self.revision
+            }
+
+class DispatchEngine:
+    """Priority worker pool fanning messages out over rate-limited channels"""
+
+    def __init__(self, workers: int = SOS_WORKERS, chunk_size: int = SOS_CHUNK_SIZE, persist: bool = True):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.persist = persist
+        self.channels: Dict[str, Channel] = {}
+        self.jobs: Dict[str, SOSJob] = {}
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._threads = []
+        self._jobs_lock = threading.Lock()
+
+    def register_channel(self, channel: Channel):
+        self.channels[channel.name] = channel
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"sos-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"[SOS] Dispatch engine started with {self.workers} workers, channels: {list(self.channels)}")
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put((-1, next(self._sequence), None, None, None))
+        for thread in self._threads:
+            thread.join(5)
+        self._threads = []
+
+    def submit(
+        self,
+        ward_id: str,
+        message: str,
+        recipients: Dict[str, Iterable[str]],
+        priority: int = PRIORITY_SOS,
+        counts: Optional[Dict[str, int]] = None
+    ) -> SOSJob:
+        """Queue a message for every recipient address, keyed by channel name.
+
+        counts, the number of recipients per channel if known, is reported until every address has been read.
+        """
+        job = SOSJob(ward_id, message, priority, {
+            name: count for name, count in (counts or {}).items() if name in self.channels and name in recipients
+        })
+        with self._jobs_lock:
+            self.jobs[job.job_id] = job
+            while len(self.jobs) > SOS_JOBS_KEPT_IN_MEMORY:
+                self.jobs.pop(next(iter(self.jobs)))
+
+        for channel_name in recipients:
+            if channel_name in self.channels:
+                job.channels[channel_name] = {"queued": 0, "sent": 0, "failed": 0}
+            else:
+                print(f"[SOS] WARNING: Channel '{channel_name}' not configured, skipping")
+        self._save(job)
+        # Recipients are read and chunked off the request thread, so workers start on the first chunk
+        threading.Thread(
+            target=self._produce, args=(job, recipients), name=f"sos-producer-{job.job_id}", daemon=True
+        ).start()
+        return job
+
+    def _produce(self, job: SOSJob, recipients: Dict[str, Iterable[str]]):
+        """Feed the job's recipients to the workers chunk by chunk as they are read"""
+        try:
+            for channel_name, addresses in recipients.items():
+                if channel_name not in job.channels:
+                    continue
+                chunk = []
+                for address in addresses:
+                    chunk.append(address)
+                    if len(chunk) >= self.chunk_size:
+                        self._enqueue(job, channel_name, chunk)
+                        chunk = []
+                if chunk:
+                    self._enqueue(job, channel_name, chunk)
+        except Exception as e:
+            print(f"[SOS] ERROR: Reading recipients for job {job.job_id} failed: {type(e).__name__}: {str(e)}")
+        with job.lock:
+            job.producing = False
+            job.revision += 1
+            finished = job.pending_chunks == 0
+            if finished:
+                job.status = "completed"
+                job.finished_at = datetime.now()
+                if job.started_at is None:
+                    job.started_at = job.finished_at
+        if finished:
+            self._log_completed(job)
+        self._save(job)
+
+    def _log_completed(self, job: SOSJob):
+        snapshot = job.snapshot()
+        print(f"[SOS] Job {job.job_id} completed: {snapshot['completed']}/{snapshot['total']} "
+              f"at {snapshot['messages_per_minute']} msg/min")
+
+    def _enqueue(self, job: SOSJob, channel_name: str, chunk: List[str]):
+        with job.lock:
+            job.channels[channel_name]["queued"] += len(chunk)
+            job.pending_chunks += 1
+            job.revision += 1
+        self._queue.put((job.priority, next(self._sequence), job, channel_name, chunk))
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.jobs.get(job_id)
+        if job:
+            return job.snapshot()
+        return SOSJobModel.find_by_id(job_id) if self.persist else None
+
+    def _save(self, job: SOSJob):
+        if not self.persist:
+            return
+        try:
+            # The snapshot is taken while holding save_lock, so a save never overwrites a newer one
+            with job.save_lock:
+                snapshot = job.snapshot()
+                if snapshot["revision"] <= job.saved_revision:
+                    return
+                SOSJobModel.save(snapshot)
+                job.saved_revision = snapshot["revision"]
+        except Exception as e:
+            print(f"[SOS] WARNING: Failed to persist job {job.job_id}: {type(e).__name__}: {str(e)}")
+
+    def _run(self):
+        while True:
+            _, _, job, channel_name, chunk = self._queue.get()
+            if job is None:
+                return
+            channel = self.channels[channel_name]
+            with job.lock:
+                if job.started_at is None:
+                    job.started_at = datetime.now()
+                    job.status = "sending"
+                    job.revision += 1
+            sent = failed = 0
+            for address in chunk:
+                channel.limiter.acquire()
+                if channel.send(address, job.message):
+                    sent += 1
+                else:
+                    failed += 1
+            with job.lock:
+                counts = job.channels[channel_name]
+                counts["sent"] += sent
+                counts["failed"] += failed
+                job.pending_chunks -= 1
+                job.revision += 1
+                finished = job.pending_chunks == 0 and not job.producing
+                if finished:
+                    job.status = "completed"
+                    job.finished_at = datetime.now()
+            if finished:
+                self._log_completed(job)
+            self._save(job)
+
+def build_default_engine() -> DispatchEngine:
+    """Engine with every channel that is configured in the environment"""
+    engine = DispatchEngine()
+    if SMS_GATEWAY_URL:
+        engine.register_channel(HTTPGatewayChannel("sms", SMS_GATEWAY_URL, SMS_GATEWAY_API_KEY, SMS_RATE_PER_SECOND))
+    else:
+        print(f"[SOS] SMS_GATEWAY_URL not set. SMS channel disabled.")
+    if WHATSAPP_GATEWAY_URL:
+        engine.register_channel(HTTPGatewayChannel("whatsapp", WHATSAPP_GATEWAY_URL, WHATSAPP_GATEWAY_TOKEN, WHATSAPP_RATE_PER_SECOND))
+    else:
+        print(f"[SOS] WHATSAPP_GATEWAY_URL not set. WhatsApp channel disabled.")
+    from notifications import fcm_client
+    if fcm_client is not None:
+        engine.register_channel(PushChannel(fcm_client))
+    return engine
+
+engine = build_default_engine()
+
+def dispatch_sos(ward_id: str, message: str, ward_number: Optional[int] = None) -> Dict[str, Any]:
+    """Fan an SOS out to the ward's emergency contacts and, if given a ward number, its app users"""
+    recipients = {
+        channel: EmergencyContactModel.iter_addresses(ward_id, channel)
+        for channel in ("sms", "whatsapp")
+        if channel in engine.channels
+    }
+    counts = EmergencyContactModel.count_by_ward(ward_id)
+    if ward_number is not None and "push" in engine.channels:
+        recipients["push"] = itertools.chain.from_iterable(PushRecipientModel.iter_tokens(ward_number))
+        counts["push"] = PushRecipientModel.count(ward_number)
+    job = engine.submit(ward_id, message, recipients, priority=PRIORITY_SOS, counts=counts)
+    return job.snapshot()
+
+def get_sos_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Live progress of an SOS job"""
+    job = engine.get_job(job_id)
+    if job:
+        for key in ("created_at", "started_at", "finished_at"):
+            if isinstance(job.get(key), datetime):
+                job[key] = job[key].isoformat()
+    return job
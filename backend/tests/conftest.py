@@ -0,0 +1,20 @@
+"""Run the backend modules against mongomock instead of a MongoDB server"""
+import os
+import sys
+import tempfile
+
+import mongomock
+import pymongo
+import pytest
+
+os.environ.setdefault("LOCAL_STORE_PATH", os.path.join(tempfile.mkdtemp(), "local_store.db"))
+pymongo.MongoClient = mongomock.MongoClient
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models
+
+@pytest.fixture(autouse=True)
+def empty_database():
+    for name in models.db.list_collection_names():
+        models.db.drop_collection(name)
+    yield
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+from models import InboxModel, NotificationModel, notifications_collection, inbox_collection
+
+def personal(user_id="u1"):
+    return NotificationModel.create({"type": "complaint_status", "user_id": user_id, "title": "Update"})
+
+def broadcast(ward_number=5):
+    return NotificationModel.create({"type": "ward_broadcast", "ward_number": ward_number, "title": "Alert"})
+
+def unread_notifications(user_id="u1"):
+    return notifications_collection.count_documents({"user_id": user_id, "read": False})
+
+def race_recount(monkeypatch, concurrent):
+    """Run `concurrent` once, between recount counting the notifications and saving the count"""
+    count_documents = notifications_collection.count_documents
+    calls = []
+
+    def counting(*args, **kwargs):
+        result = count_documents(*args, **kwargs)
+        if not calls:
+            calls.append(True)
+            concurrent()
+        return result
+
+    monkeypatch.setattr(notifications_collection, "count_documents", counting)
+
+def test_new_and_read_notifications_are_counted():
+    first = personal()
+    personal()
+    assert InboxModel.unread_count("u1") == 2
+    assert NotificationModel.mark_as_read(first, "u1")
+    assert NotificationModel.mark_as_read(first, "u1")
+    assert InboxModel.unread_count("u1") == 1
+
+def test_broadcasts_are_counted_once_per_reader():
+    InboxModel.recount("u1", 5)
+    notification_id = broadcast()
+    broadcast(ward_number=6)
+    assert InboxModel.unread_count("u1") == 1
+    NotificationModel.mark_as_read(notification_id, "u1")
+    NotificationModel.mark_as_read(notification_id, "u1")
+    assert InboxModel.unread_count("u1") == 0
+
+def test_mark_all_read_resets_the_count():
+    InboxModel.recount("u1", 5)
+    personal()
+    broadcast()
+    assert InboxModel.unread_count("u1") == 2
+    NotificationModel.mark_all_as_read("u1")
+    assert InboxModel.unread_count("u1") == 0
+
+def test_mark_all_read_keeps_a_notification_counted_during_the_recount(monkeypatch):
+    personal()
+    race_recount(monkeypatch, personal)
+    NotificationModel.mark_all_as_read("u1")
+    assert unread_notifications() == 1
+    assert InboxModel.unread_count("u1") == 1
+
+def test_recount_keeps_a_read_during_the_recount(monkeypatch):
+    first = personal()
+    personal()
+    race_recount(monkeypatch, lambda: NotificationModel.mark_as_read(first, "u1"))
+    InboxModel.recount("u1", None)
+    assert InboxModel.unread_count("u1") == unread_notifications() == 1
+
+def test_recount_creates_the_counter():
+    personal()
+    inbox_collection.delete_many({})
+    assert InboxModel.recount("u1", None) == 1
+    assert InboxModel.unread_count("u1") == 1
+
+def test_recount_ignores_broadcasts_read_before_the_watermark():
+    InboxModel.recount("u1", 5)
+    broadcast()
+    inbox_collection.update_one({"_id": "u1"}, {"$set": {"broadcasts_read_at": datetime.now() + timedelta(seconds=1)}})
+    assert InboxModel.recount("u1", 5) == 0
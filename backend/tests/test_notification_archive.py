@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+import notification_archive
+from models import InboxModel, NotificationModel, notifications_collection, notifications_archive_collection
+
+def personal(user_id="u1", days_old=0):
+    notification_id = NotificationModel.create({"type": "complaint_status", "user_id": user_id, "title": "Update"})
+    notifications_collection.update_one(
+        {"_id": ObjectId(notification_id)}, {"$set": {"created_at": datetime.now() - timedelta(days=days_old)}}
+    )
+
+def test_archiving_releases_unread_counts():
+    personal(days_old=100)
+    personal(days_old=100)
+    personal()
+    assert InboxModel.unread_count("u1") == 3
+    assert notification_archive.archive(older_than_days=90) == 2
+    assert InboxModel.unread_count("u1") == 1
+    assert notifications_archive_collection.count_documents({"counts_released": True}) == 1
+    assert [n["title"] for n in notification_archive.find_archived(user_id="u1")] == ["Update", "Update"]
+
+def test_concurrent_archivers_release_counts_once(monkeypatch):
+    for _ in range(2):
+        personal(days_old=100)
+    for _ in range(2):
+        personal()
+    assert InboxModel.unread_count("u1") == 4
+    cutoff = datetime.now() - timedelta(days=90)
+    release_counts = notification_archive._release_counts
+    calls = []
+
+    def interleaved(notifications):
+        # Another worker archives the same batch while this one is releasing its counts
+        if not calls:
+            calls.append(True)
+            notification_archive.archive_batch(cutoff)
+        release_counts(notifications)
+
+    monkeypatch.setattr(notification_archive, "_release_counts", interleaved)
+    # Both workers read the batch before either deletes it
+    notification_archive.archive_batch(cutoff)
+    assert InboxModel.unread_count("u1") == 2
+    assert notifications_archive_collection.count_documents({}) == 1
@@ -0,0 +1,177 @@
+import base64
+import io
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+    print("[Thumbnails] Pillow not installed. Thumbnail generation disabled.")
+
+# Thumbnail cache setup
+THUMBNAIL_DIR = os.getenv(
+    "THUMBNAIL_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "thumbnail_cache")
+)
+THUMBNAIL_SIZES = sorted(int(s) for s in os.getenv("THUMBNAIL_SIZES", "128,320,640").split(","))
+THUMBNAIL_DEFAULT_SIZE = 320 if 320 in THUMBNAIL_SIZES else THUMBNAIL_SIZES[0]
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+THUMBNAIL_FAILURE_TTL_SECONDS = float(os.getenv("THUMBNAIL_FAILURE_TTL_SECONDS", "600"))
+
+# Attachments never change after filing, so a generated thumbnail can be cached forever
+THUMBNAIL_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_COMPLAINT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnails")
+_pending = set()
+_pending_lock = threading.Lock()
+# (complaint id, attachment index or None for the whole complaint) -> when to try again
+_failures: Dict[Tuple[str, Optional[int]], float] = {}
+
+def _record_failure(complaint_id: str, index: Optional[int] = None):
+    now = time.monotonic()
+    with _pending_lock:
+        if len(_failures) >= 10000:
+            for key in [key for key, retry_at in _failures.items() if retry_at <= now]:
+                del _failures[key]
+        _failures[(complaint_id, index)] = now + THUMBNAIL_FAILURE_TTL_SECONDS
+
+def _recently_failed(complaint_id: str, index: int) -> bool:
+    now = time.monotonic()
+    with _pending_lock:
+        for key in ((complaint_id, None), (complaint_id, index)):
+            retry_at = _failures.get(key)
+            if retry_at is not None:
+                if retry_at > now:
+                    return True
+                del _failures[key]
+    return False
+
+def is_valid_size(size: int) -> bool:
+    """Check that a requested thumbnail size is one we generate"""
+    return size in THUMBNAIL_SIZES
+
+def thumbnail_path(complaint_id: str, index: int, size: int) -> str:
+    """Path of a cached thumbnail on disk"""
+    if not _COMPLAINT_ID_PATTERN.match(complaint_id):
+        raise ValueError(f"Invalid complaint id: {complaint_id}")
+    return os.path.join(THUMBNAIL_DIR, complaint_id, f"{int(index)}_{int(size)}.jpg")
+
+def thumbnail_url(complaint_id: str, index: int, size: int) -> str:
+    """Public URL of a thumbnail"""
+    return f"/api/complaints/{complaint_id}/thumbnails/{index}?size={size}"
+
+def thumbnail_refs(complaint_id: str, attachment_count: int) -> List[Dict[str, str]]:
+    """Thumbnail URLs for every attachment, keyed by size"""
+    return [
+        {str(size): thumbnail_url(complaint_id, index, size) for size in THUMBNAIL_SIZES}
+        for index in range(attachment_count)
+    ]
+
+def add_thumbnail_refs(complaint: Dict[str, Any]) -> Dict[str, Any]:
+    """Add thumbnail references to a complaint response, with or without its attachments"""
+    if "attachments" in complaint:
+        attachment_count = len(complaint["attachments"] or [])
+    else:
+        # List views project attachments out and keep only their count
+        attachment_count = complaint.get("attachment_count", 0)
+    complaint_id = complaint.get("complaint_id")
+    if complaint_id and _COMPLAINT_ID_PATTERN.match(complaint_id):
+        complaint["thumbnails"] = thumbnail_refs(complaint_id, attachment_count)
+    else:
+        complaint["thumbnails"] = []
+    return complaint
+
+def decode_attachment(attachment: str) -> bytes:
+    """Decode a base64 attachment (plain or data URL)"""
+    if attachment.startswith("data:"):
+        attachment = attachment.split(",", 1)[1]
+    return base64.b64decode(attachment)
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.tmp-{threading.get_ident()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def generate_thumbnails(complaint_id: str, attachments: List[str]) -> int:
+    """Decode each attachment once and write every thumbnail size to the cache"""
+    if Image is None:
+        return 0
+
+    generated = 0
+    os.makedirs(os.path.join(THUMBNAIL_DIR, complaint_id), exist_ok=True)
+    for index, attachment in enumerate(attachments):
+        missing = [s for s in THUMBNAIL_SIZES if not os.path.exists(thumbnail_path(complaint_id, index, s))]
+        if not missing:
+            continue
+        try:
+            image = Image.open(io.BytesIO(decode_attachment(attachment)))
+            image.load()
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            # Largest first, so each smaller size is resampled from an already reduced image
+            for size in sorted(missing, reverse=True):
+                image.thumbnail((size, size))
+                buffer = io.BytesIO()
+                image.save(buffer, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+                _write_atomic(thumbnail_path(complaint_id, index, size), buffer.getvalue())
+                generated += 1
+        except Exception as e:
+            _record_failure(complaint_id, index)
+            print(f"[Thumbnails] Error processing attachment {index} of {complaint_id}: {type(e).__name__}: {str(e)}")
+    return generated
+
+def _run_job(complaint_id: str, attachments: Optional[List[str]]):
+    try:
+        if attachments is None:
+            from models import ComplaintModel
+            complaint = ComplaintModel.find_by_id(complaint_id)
+            attachments = (complaint or {}).get("attachments") or []
+            if not attachments:
+                _record_failure(complaint_id)
+        generated = generate_thumbnails(complaint_id, attachments)
+        if generated:
+            print(f"[Thumbnails] Generated {generated} thumbnails for {complaint_id}")
+    except Exception as e:
+        print(f"[Thumbnails] ERROR: Thumbnail job failed for {complaint_id}: {type(e).__name__}: {str(e)}")
+    finally:
+        with _pending_lock:
+            _pending.discard(complaint_id)
+
+def schedule_thumbnails(complaint_id: str, attachments: Optional[List[str]] = None) -> bool:
+    """Queue thumbnail generation on the worker pool. Never blocks the caller.
+
+    If attachments are not given the worker loads them from MongoDB.
+    """
+    if Image is None or not _COMPLAINT_ID_PATTERN.match(complaint_id or ""):
+        return False
+    if attachments is not None and len(attachments) == 0:
+        return False
+    with _pending_lock:
+        if complaint_id in _pending:
+            return False
+        _pending.add(complaint_id)
+    _executor.submit(_run_job, complaint_id, attachments)
+    return True
+
+def get_thumbnail(complaint_id: str, index: int, size: int) -> Optional[str]:
+    """Return the cached thumbnail path, or queue generation and return None.
+
+    Raises LookupError if the attachment failed to decode or does not exist, until
+    THUMBNAIL_FAILURE_TTL_SECONDS have passed.
+    """
+    path = thumbnail_path(complaint_id, index, size)
+    if os.path.exists(path):
+        return path
+    if _recently_failed(complaint_id, index):
+        raise LookupError(f"No thumbnail for attachment {index} of {complaint_id}")
+    schedule_thumbnails(complaint_id)
+    return None
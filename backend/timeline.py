@@ -0,0 +1,44 @@
+"""Move complete complaint timelines into buckets, keeping only the latest entries embedded.
+
+Complaints filed since timelines were bucketed are archived as they are written.
+Older ones are migrated with:
+
+    python timeline.py migrate
+"""
+from models import complaints_collection, timeline_buckets_collection, TimelineModel, TIMELINE_EMBEDDED_ENTRIES
+from typing import Dict
+import sys
+
+def migrate(batch_size: int = 100) -> Dict[str, int]:
+    """Archive the embedded timelines of complaints that predate the buckets"""
+    TimelineModel.ensure_indexes()
+    totals = {"migrated": 0, "conflicts": 0}
+    query = {"timeline_archived": {"$exists": False}}
+    cursor = complaints_collection.find(
+        query, {"complaint_id": 1, "timeline": 1, "updated_at": 1}
+    ).batch_size(batch_size)
+    for complaint in cursor:
+        timeline = complaint.get("timeline") or []
+        TimelineModel.replace(complaint["complaint_id"], timeline)
+        # Only trim the embedded copy if nothing was appended since it was read
+        result = complaints_collection.update_one(
+            {"_id": complaint["_id"], "timeline_archived": {"$exists": False}, "updated_at": complaint.get("updated_at")},
+            {"$set": {"timeline": timeline[-TIMELINE_EMBEDDED_ENTRIES:], "timeline_archived": True}}
+        )
+        if result.modified_count:
+            totals["migrated"] += 1
+        else:
+            # The complaint changed meanwhile; the next run copies its newer timeline
+            timeline_buckets_collection.delete_many({"complaint_id": complaint["complaint_id"]})
+            totals["conflicts"] += 1
+    if totals["migrated"] or totals["conflicts"]:
+        print(f"[Timeline] Archived {totals['migrated']} timelines, {totals['conflicts']} changed during migration")
+    return totals
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "migrate":
+        print(migrate())
+    else:
+        print(__doc__)
+        sys.exit(2)
@@ -0,0 +1,106 @@
+"""State versions for the risk endpoints, so clients can fetch only what changed.
+
+Every response of /wards/risk and /predict carries a `version`. A client that
+sends it back as `since` gets only the wards or hotspots whose risk level,
+counts or preparedness changed after that version, or a 304 when none did.
+Each distinct set of query inputs (e.g. rainfall intensity) is versioned
+separately, and keeps the keys changed by its last RISK_VERSION_HISTORY
+versions in a ring buffer; a `since` that set of inputs did not issue, or no
+longer has history for, gets the full state.
+
+Versions come from one counter seeded with the startup time in milliseconds,
+so they keep increasing across restarts, with the low bits taken from the
+process id. Each worker process versions its own responses, and a version one
+worker issued is never mistaken for one of another's.
+"""
+from collections import deque, OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Iterable
+import itertools
+import os
+import threading
+import time
+
+RISK_VERSION_HISTORY = int(os.getenv("RISK_VERSION_HISTORY", "64"))
+RISK_VERSION_VARIANTS = int(os.getenv("RISK_VERSION_VARIANTS", "32"))
+
+_versions = itertools.count(int(time.time() * 1000))
+_versions_lock = threading.Lock()
+_PROCESS_BITS = 10
+
+def _next_version() -> int:
+    with _versions_lock:
+        count = next(_versions)
+    # Read the pid on every call: workers forked after import share the counter's seed
+    return (count << _PROCESS_BITS) | (os.getpid() & ((1 << _PROCESS_BITS) - 1))
+
+class VersionedState:
+    """The significant fields of one response's items, with the keys each recent version changed"""
+
+    def __init__(self, fields: Iterable[str], history: int = RISK_VERSION_HISTORY):
+        self.fields = tuple(fields)
+        self.version: Optional[int] = None
+        # Oldest version the history can still diff from
+        self.base: Optional[int] = None
+        self._signatures: Dict[Any, tuple] = {}
+        self._history: deque = deque(maxlen=history)
+        # Versions this state issued that `since` can still diff from: base and every version in the history
+        self._issued: set = set()
+        self._lock = threading.Lock()
+
+    def sync(self, items: Dict[Any, Dict[str, Any]], since: Optional[int] = None) -> Tuple[int, Optional[set]]:
+        """Record the current items; returns the version and the keys changed after `since`, or None for all"""
+        signatures = {key: tuple(item.get(field) for field in self.fields) for key, item in items.items()}
+        with self._lock:
+            if self.version is None:
+                self.version = self.base = _next_version()
+                self._issued.add(self.version)
+            else:
+                changed = {key for key, signature in signatures.items() if self._signatures.get(key) != signature}
+                if changed:
+                    if len(self._history) == self._history.maxlen:
+                        self._issued.discard(self.base)
+                        self.base = self._history[0][0]
+                    self.version = _next_version()
+                    self._history.append((self.version, frozenset(changed)))
+                    self._issued.add(self.version)
+            self._signatures = signatures
+            if since is None or since not in self._issued:
+                return self.version, None
+            return self.version, set().union(*(keys for version, keys in self._history if version > since))
+
+class VersionedStates:
+    """A VersionedState per set of query inputs, least recently used dropped first"""
+
+    def __init__(self, fields: Iterable[str], variants: int = RISK_VERSION_VARIANTS):
+        self.fields = tuple(fields)
+        self.variants = variants
+        self._states: "OrderedDict[Any, VersionedState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, inputs) -> VersionedState:
+        with self._lock:
+            state = self._states.get(inputs)
+            if state is None:
+                state = self._states[inputs] = VersionedState(self.fields)
+                if len(self._states) > self.variants:
+                    self._states.popitem(last=False)
+            else:
+                self._states.move_to_end(inputs)
+            return state
+
+def select(states: VersionedStates, inputs, items: List[Dict[str, Any]], key: str,
+           since: Optional[int] = None) -> Tuple[int, bool, Optional[List[Dict[str, Any]]]]:
+    """Version of `items`, whether the full list is sent, and the items to send; None when nothing changed"""
+    version, changed = states.get(inputs).sync({item[key]: item for item in items}, since)
+    if changed is None:
+        return version, True, items
+    if not changed:
+        return version, False, None
+    return version, False, [item for item in items if item[key] in changed]
+
+ward_risk_states = VersionedStates([
+    "risk_level", "critical_hotspots", "warning_hotspots", "safe_hotspots", "total_hotspots",
+    "preparedness_score", "preparedness_level", "has_preparedness_gap",
+    "pumps_available", "pumps_total", "drains_desilted"
+])
+hotspot_risk_states = VersionedStates(["risk_level", "model_risk_level"])
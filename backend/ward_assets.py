@@ -0,0 +1,176 @@
+"""Live pump and drain state per ward, and the preparedness computed from it.
+
+Field teams report pumps brought into or out of service and drains desilted
+through PUT /wards/{ward_id}/assets. Each update is validated, saved to MongoDB
+as the ward's next version (a stale version is a conflict, never a lost
+update) and logged, and only that ward's preparedness is recomputed. The risk
+endpoints read preparedness from memory, so their cost does not grow with how
+often assets change.
+
+Wards start from the values in wards.py until their first update. Other worker
+processes pick up updates every WARD_ASSETS_SYNC_SECONDS.
+"""
+from models import WardAssetModel
+from preparedness import calculate_preparedness_score
+from hotspots import HOTSPOTS
+from wards import WARDS
+from typing import List, Dict, Any, Optional
+from datetime import datetime
+import os
+import threading
+
+WARD_ASSETS_SYNC_SECONDS = float(os.getenv("WARD_ASSETS_SYNC_SECONDS", "15"))
+WARD_ASSETS_SAVE_ATTEMPTS = 3
+
+ASSET_FIELDS = ("pumps_available", "pumps_total", "drains_desilted")
+
+def _in_ward(ward: Dict[str, Any], lat: float, lng: float) -> bool:
+    (south, west), (north, east) = ward["bounds"][0], ward["bounds"][2]
+    return south <= lat <= north and west <= lng <= east
+
+# Hotspot ids inside each ward, computed once instead of on every request
+WARD_HOTSPOTS = {
+    ward["id"]: [hotspot["id"] for hotspot in HOTSPOTS if _in_ward(ward, hotspot["lat"], hotspot["lng"])]
+    for ward in WARDS
+}
+
+class AssetConflictError(Exception):
+    """The ward's assets changed since the version the update was based on"""
+
+class WardAssetStore:
+    """Current assets per ward, with preparedness cached for quiet and at-risk conditions"""
+
+    def __init__(self, wards: List[Dict[str, Any]] = WARDS):
+        self._assets: Dict[str, Dict[str, Any]] = {
+            ward["id"]: {**{field: ward.get(field, 0) for field in ASSET_FIELDS}, "version": 0, "updated_at": None}
+            for ward in wards
+        }
+        # Ward id -> [preparedness with no hotspot at risk, preparedness with one at risk]
+        self._preparedness: Dict[str, List[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._listeners = []
+        for ward_id in self._assets:
+            self._recompute(ward_id)
+
+    def _recompute(self, ward_id: str):
+        assets = self._assets[ward_id]
+        # The score only depends on risk through whether any hotspot is at level 1 or above
+        self._preparedness[ward_id] = [
+            calculate_preparedness_score(assets["pumps_available"], assets["pumps_total"], assets["drains_desilted"], level)
+            for level in (0, 1)
+        ]
+
+    def add_listener(self, listener):
+        """Call listener(ward_id, assets) after a ward's assets change"""
+        self._listeners.append(listener)
+
+    def _notify(self, ward_id: str, assets: Dict[str, Any]):
+        for listener in self._listeners:
+            try:
+                listener(ward_id, assets)
+            except Exception as e:
+                print(f"[WardAssets] WARNING: Listener failed: {type(e).__name__}: {str(e)}")
+
+    def get(self, ward_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            assets = self._assets.get(ward_id)
+            return dict(assets) if assets else None
+
+    def preparedness(self, ward_id: str, max_risk_level: int) -> Dict[str, Any]:
+        """Cached preparedness of a ward whose riskiest hotspot is at max_risk_level"""
+        with self._lock:
+            return self._preparedness[ward_id][1 if max_risk_level >= 1 else 0]
+
+    def _apply(self, ward_id: str, document: Dict[str, Any]) -> bool:
+        current = self._assets.get(ward_id)
+        if current is None or document.get("version", 0) <= current["version"]:
+            return False
+        self._assets[ward_id] = {field: document[field] for field in (*ASSET_FIELDS, "version", "updated_at")}
+        self._recompute(ward_id)
+        return True
+
+    def update(self, ward_id: str, pumps_delta: int = 0, pumps_available: Optional[int] = None,
+               pumps_total: Optional[int] = None, drains_desilted: Optional[bool] = None,
+               expected_version: Optional[int] = None, reported_by: Optional[str] = None,
+               note: Optional[str] = None) -> Dict[str, Any]:
+        """Apply a field report and return the ward's new assets.
+
+        pumps_delta counts pumps deployed (positive) or failed (negative); the
+        other fields set absolute values. Raises KeyError for an unknown ward,
+        ValueError for an impossible state and AssetConflictError if
+        expected_version is not the current version.
+        """
+        if ward_id not in self._assets:
+            raise KeyError(ward_id)
+        for _ in range(WARD_ASSETS_SAVE_ATTEMPTS):
+            current = self.get(ward_id)
+            if expected_version is not None and expected_version != current["version"]:
+                raise AssetConflictError(f"Ward assets are at version {current['version']}, not {expected_version}")
+            state = {
+                "pumps_total": current["pumps_total"] if pumps_total is None else pumps_total,
+                "pumps_available": (current["pumps_available"] if pumps_available is None else pumps_available) + pumps_delta,
+                "drains_desilted": current["drains_desilted"] if drains_desilted is None else drains_desilted,
+            }
+            if state["pumps_total"] < 0 or not 0 <= state["pumps_available"] <= state["pumps_total"]:
+                raise ValueError(
+                    f"Pumps available must be between 0 and {state['pumps_total']}, got {state['pumps_available']}"
+                )
+            state.update({"version": current["version"] + 1, "updated_at": datetime.now(), "updated_by": reported_by})
+            if WardAssetModel.save(ward_id, state, current["version"]):
+                break
+            # Another worker saved first; catch up and re-apply the report on top of its version
+            self.sync()
+        else:
+            raise AssetConflictError("Ward assets are changing too quickly, try again")
+        WardAssetModel.record_event(ward_id, state["version"], {
+            "pumps_delta": pumps_delta, "pumps_available": pumps_available, "pumps_total": pumps_total,
+            "drains_desilted": drains_desilted, "note": note, "reported_by": reported_by,
+            "reported_at": state["updated_at"]
+        })
+        with self._lock:
+            self._apply(ward_id, state)
+            assets = dict(self._assets[ward_id])
+        self._notify(ward_id, assets)
+        return assets
+
+    def sync(self) -> int:
+        """Take any newer versions saved by other processes; returns the number of wards changed"""
+        changed = []
+        documents = WardAssetModel.find_all()
+        with self._lock:
+            for document in documents:
+                if self._apply(document["_id"], document):
+                    changed.append((document["_id"], dict(self._assets[document["_id"]])))
+        for ward_id, assets in changed:
+            self._notify(ward_id, assets)
+        return len(changed)
+
+    def start(self):
+        if self._thread:
+            return
+        try:
+            WardAssetModel.ensure_indexes()
+            loaded = self.sync()
+            print(f"[WardAssets] Loaded live assets for {loaded} wards")
+        except Exception as e:
+            print(f"[WardAssets] WARNING: Could not load ward assets: {type(e).__name__}: {str(e)}")
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="ward-assets", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(5)
+        self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(WARD_ASSETS_SYNC_SECONDS):
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"[WardAssets] WARNING: Sync failed: {type(e).__name__}: {str(e)}")
+
+store = WardAssetStore()
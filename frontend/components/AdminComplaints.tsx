@@ -3,6 +3,7 @@
 import { useState } from 'react';
 import Link from 'next/link';
 import { Clock, MapPin, Eye } from 'lucide-react';
+import { thumbnailUrl } from '@/lib/api';
 
 interface Complaint {
   complaint_id: string;
@@ -13,6 +14,7 @@ interface Complaint {
   status: string;
   priority: string;
   created_at: string;
+  thumbnails?: Record<string, string>[];
 }
 
 interface AdminComplaintsProps {
@@ -114,9 +116,21 @@ export default function AdminComplaints({ complaints }: AdminComplaintsProps) {
                     </span>
                   </td>
                   <td className="px-6 py-4">
-                    <div className="text-sm font-medium text-gray-900">{complaint.title}</div>
-                    <div className="text-sm text-gray-500 truncate max-w-xs">
-                      {complaint.description}
+                    <div className="flex items-center gap-3">
+                      {complaint.thumbnails && complaint.thumbnails.length > 0 && (
+                        <img
+                          src={thumbnailUrl(Object.values(complaint.thumbnails[0])[0])}
+                          alt=""
+                          loading="lazy"
+                          className="w-10 h-10 object-cover rounded border flex-shrink-0"
+                        />
+                      )}
+                      <div>
+                        <div className="text-sm font-medium text-gray-900">{complaint.title}</div>
+                        <div className="text-sm text-gray-500 truncate max-w-xs">
+                          {complaint.description}
+                        </div>
+                      </div>
                     </div>
                   </td>
                   <td className="px-6 py-4 whitespace-nowrap">
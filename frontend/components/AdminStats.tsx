@@ -11,6 +11,7 @@ interface Stats {
   high_priority: number;
   avg_response_time: number | null;
   satisfaction_rate: number | null;
+  overdue?: number;
 }
 
 interface AdminStatsProps {
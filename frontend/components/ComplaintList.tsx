@@ -1,7 +1,7 @@
 'use client';
 
 import { useState, useEffect } from 'react';
-import { useComplaintAPI } from '@/lib/api';
+import { useComplaintAPI, thumbnailUrl } from '@/lib/api';
 import { useAuth } from '@clerk/nextjs';
 import Link from 'next/link';
 import { Clock, MapPin, AlertCircle, CheckCircle, XCircle, Loader } from 'lucide-react';
@@ -16,6 +16,7 @@ interface Complaint {
   priority: string;
   created_at: string;
   location?: { latitude: number; longitude: number };
+  thumbnails?: Record<string, string>[];
 }
 
 export default function ComplaintList({ filterStatus }: { filterStatus?: string }) {
@@ -170,6 +171,14 @@ export default function ComplaintList({ filterStatus }: { filterStatus?: string
           className="block bg-white border border-gray-200 rounded-lg p-6 hover:shadow-lg transition-shadow"
         >
           <div className="flex items-start justify-between">
+            {complaint.thumbnails && complaint.thumbnails.length > 0 && (
+              <img
+                src={thumbnailUrl(Object.values(complaint.thumbnails[0])[0])}
+                alt=""
+                loading="lazy"
+                className="w-20 h-20 object-cover rounded-lg border mr-4 flex-shrink-0"
+              />
+            )}
             <div className="flex-1">
               <div className="flex items-center gap-3 mb-2">
                 <h3 className="text-lg font-semibold text-gray-900">{complaint.title}</h3>
@@ -5,6 +5,11 @@ import { useAuth, useUser } from '@clerk/nextjs';
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
 
+// Thumbnail refs in complaint lists are paths on the API server
+export function thumbnailUrl(path: string) {
+  return `${API_BASE_URL}${path}`;
+}
+
 // Complaint API hook for client components
 export function useComplaintAPI() {
   const { getToken, userId } = useAuth();
@@ -39,12 +39,20 @@ export interface Complaint {
   created_by: string;
   assigned_officer_id: string | null;
   location: LocationData | null;
-  attachments: string[];
+  // Only on the detail endpoint; lists send attachment_count and thumbnails instead
+  attachments?: string[];
+  attachment_count?: number;
+  thumbnails?: Record<string, string>[];
   timeline: TimelineEntry[];
   response_time_hours: number | null;
   resolution: string | null;
   rating: number | null;
   feedback: string | null;
+  due_at?: string;
+  overdue_since?: string;
+  escalation_level?: number;
+  duplicate_of?: string;
+  duplicate_count?: number;
   created_at: string;
   updated_at: string;
 }